@@ -1,11 +1,43 @@
 import os
 import json
-import boto3
+import io
+import base64
+from boto3.s3.transfer import TransferConfig
 import uuid
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 from dotenv import load_dotenv
 import traceback
+import threading
+import queue
+import atexit
+import time
+from concurrent.futures import ThreadPoolExecutor
+from aws_clients import AwsClients
+from corpus import list_note_page, load_corpus, read_note
+from note_cache import NoteCache, note_version
+from note_codec import CODECS, available_codec, encode_file
+from ingest import ContentIndex, UploadTooLarge, content_digest, scan_upload
+from bedrock_models import generation_params, invoke_text, stream_text
+from bedrock_scheduler import BACKGROUND, BATCH, BedrockScheduler, QueueTimeout, current_priority, model_priority
+from response_cache import ResponseCache, cache_key, corpus_hash
+from summarize import SummaryStore, summarize_notes
+from singleflight import SingleFlight
+from health import CachedProbe
+import metrics
+from metrics import REQUEST_SECONDS, server_timing_header, start_request_timings, timed
+from jobs import JobQueue, QueueFull
+from topics import (
+    TOPIC_FALLBACK_PROMPT, TopicIndex, classify, format_topics, parse_model_topics, topic_digest, topics_source
+)
+from search_index import SearchIndex, make_snippet, tokenize
+from vector_index import BedrockEmbedder, HashingEmbedder, VectorIndex
+from prompt_builder import MinHasher, select_notes, token_budget
+from shards import (
+    COMPRESSIONS, SHARD_PREFIX, Compactor, ManifestCache, list_sharded_page, load_sharded_corpus, read_shard_notes,
+    read_sharded_note
+)
+from study_profile import PROFILE_REBUILD_PROMPT, PROFILE_UPDATE_PROMPT, ProfileStore, parse_profile_response
 
 # Load environment variables
 load_dotenv()
@@ -17,6 +49,145 @@ aws_session_token = os.getenv("AWS_SESSION_TOKEN")
 s3_bucket_name = os.getenv('S3_BUCKET_NAME')
 bedrock_model_id = os.getenv('BEDROCK_MODEL_ID')
 region = os.getenv('AWS_REGION')
+# Number of notes downloaded from S3 in parallel when loading the corpus
+s3_max_workers = int(os.getenv('S3_MAX_WORKERS', '16'))
+# Connections kept per AWS client; sized so parallel S3 reads and model calls do not queue for one
+aws_max_pool_connections = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', str(max(32, 2 * s3_max_workers))))
+aws_max_attempts = int(os.getenv('AWS_MAX_ATTEMPTS', '8'))
+bedrock_read_timeout = int(os.getenv('BEDROCK_READ_TIMEOUT_SECONDS', '300'))
+# Model calls in flight adapt between 1 and BEDROCK_MAX_CONCURRENCY, halving whenever Bedrock throttles.
+# Throttled calls are retried by the scheduler, so botocore itself makes only BEDROCK_CLIENT_MAX_ATTEMPTS attempts.
+bedrock_initial_concurrency = int(os.getenv('BEDROCK_INITIAL_CONCURRENCY', '4'))
+bedrock_max_concurrency = int(os.getenv('BEDROCK_MAX_CONCURRENCY', '16'))
+if not 1 <= bedrock_initial_concurrency <= bedrock_max_concurrency:
+    raise ValueError("BEDROCK_INITIAL_CONCURRENCY must be between 1 and BEDROCK_MAX_CONCURRENCY")
+bedrock_queue_timeout = float(os.getenv('BEDROCK_QUEUE_TIMEOUT_SECONDS', '120'))
+bedrock_throttle_retries = int(os.getenv('BEDROCK_THROTTLE_RETRIES', '6'))
+bedrock_backoff_base = float(os.getenv('BEDROCK_BACKOFF_BASE_SECONDS', '0.5'))
+bedrock_backoff_max = float(os.getenv('BEDROCK_BACKOFF_MAX_SECONDS', '20'))
+bedrock_client_max_attempts = int(os.getenv('BEDROCK_CLIENT_MAX_ATTEMPTS', '2'))
+# How long a /api/check-config result is served before it is refreshed in the background
+config_check_ttl = int(os.getenv('CONFIG_CHECK_TTL_SECONDS', '60'))
+
+# Add a Server-Timing header with per-stage durations to every response (or per request with ?server_timing=1)
+server_timing = os.getenv('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+# Dollars per 1,000 tokens for the configured model, used to estimate spend in /metrics
+metrics.token_prices["input"] = float(os.getenv('BEDROCK_INPUT_PRICE_PER_1K_TOKENS', '0'))
+metrics.token_prices["output"] = float(os.getenv('BEDROCK_OUTPUT_PRICE_PER_1K_TOKENS', '0'))
+# Local cache of note contents, so unchanged notes are not downloaded again
+note_cache_max_bytes = int(os.getenv('NOTE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+note_cache_dir = os.getenv('NOTE_CACHE_DIR')
+note_cache_disk_max_bytes = int(os.getenv('NOTE_CACHE_DISK_MAX_BYTES', str(512 * 1024 * 1024)))
+# Compression for newly stored notes: none, gzip or zstd (falls back to gzip without the zstandard package)
+note_codec = os.getenv('NOTE_CODEC', 'none')
+if note_codec not in CODECS:
+    raise ValueError(f"NOTE_CODEC must be one of {', '.join(CODECS)}")
+note_codec = available_codec(note_codec)
+
+# Uploads larger than this are rejected with 413; stored notes at least multipart_threshold bytes use multipart upload
+max_upload_bytes = int(os.getenv('MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))
+# Batch submissions: most notes per request and S3 writes in flight at once
+submit_batch_max_notes = int(os.getenv('SUBMIT_BATCH_MAX_NOTES', '1000'))
+submit_max_workers = int(os.getenv('SUBMIT_MAX_WORKERS', '8'))
+# Largest page /api/notes returns
+notes_page_max = int(os.getenv('NOTES_PAGE_MAX', '1000'))
+multipart_threshold = int(os.getenv('MULTIPART_THRESHOLD_BYTES', str(8 * 1024 * 1024)))
+transfer_config = TransferConfig(multipart_threshold=multipart_threshold, multipart_chunksize=multipart_threshold)
+# Cache of model responses for identical notes, model and prompt
+response_cache_max_entries = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '256'))
+response_cache_ttl = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '3600'))
+
+SUMMARY_PROMPT = "Summarize the following notes in a clear and concise way:\n\n{notes}"
+RECOMMENDATION_PROMPT = "Based on these notes, what are the next topics I should study?\n\n{notes}"
+SUMMARY_REDUCE_PROMPT = (
+    "Each paragraph below summarizes one of my notes. "
+    "Summarize them in a clear and concise way:\n\n{notes}"
+)
+
+# How summaries are built: "full" sends every note in one prompt, "hierarchical"
+# summarizes each note once and reduces the per-note summaries, and "auto" picks
+# hierarchical once the notes no longer fit in SUMMARY_DIRECT_MAX_CHARS
+summary_mode = os.getenv('SUMMARY_MODE', 'auto')
+summary_direct_max_chars = int(os.getenv('SUMMARY_DIRECT_MAX_CHARS', '48000'))
+summary_chunk_chars = int(os.getenv('SUMMARY_CHUNK_CHARS', '12000'))
+summary_max_workers = int(os.getenv('SUMMARY_MAX_WORKERS', '4'))
+summary_store_max_entries = int(os.getenv('SUMMARY_STORE_MAX_ENTRIES', '4096'))
+SUMMARY_MODES = ('auto', 'full', 'hierarchical', 'retrieval')
+
+TOPIC_RECOMMENDATION_PROMPT = (
+    "Below is how often each algorithm topic appears in my competitive programming notes, "
+    "followed by a few excerpts from them. Based on this, what are the next topics I should study?\n\n{notes}"
+)
+
+# How recommendations are built: "full" sends every note, "topics" sends a topic
+# histogram plus a few excerpts, and "auto" picks topics once the notes no longer
+# fit in RECOMMENDATION_DIRECT_MAX_CHARS
+recommendation_mode = os.getenv('RECOMMENDATION_MODE', 'auto')
+recommendation_direct_max_chars = int(os.getenv('RECOMMENDATION_DIRECT_MAX_CHARS', '48000'))
+topic_snippets = int(os.getenv('TOPIC_SNIPPETS', '8'))
+# Ask the model for topics when no keyword rule matches a new note
+topic_model_fallback = os.getenv('TOPIC_MODEL_FALLBACK', '').lower() in ('1', 'true', 'yes')
+# "delta" sends only notes added or changed since the last delta run, plus a saved student profile
+RECOMMENDATION_MODES = ('auto', 'full', 'topics', 'retrieval', 'delta')
+
+# Retrieval mode prompts with only the note chunks closest to a few probe queries
+RETRIEVAL_SUMMARY_PROMPT = "Summarize the following excerpts from my notes in a clear and concise way:\n\n{notes}"
+RETRIEVAL_RECOMMENDATION_PROMPT = (
+    "Based on these excerpts from my notes, what are the next topics I should study?\n\n{notes}"
+)
+SUMMARY_RETRIEVAL_QUERIES = [
+    "key algorithms and techniques used to solve the problem",
+    "important insights, observations and takeaways",
+    "common mistakes, edge cases and pitfalls"
+]
+RECOMMENDATION_RETRIEVAL_QUERIES = [
+    "topics I struggled with or found difficult",
+    "mistakes, bugs, wrong answers and time limit exceeded",
+    "ideas I want to learn, practice or review next"
+]
+# Bedrock embedding model for retrieval; a local hashing embedder is used when unset
+embedding_model_id = os.getenv('EMBEDDING_MODEL_ID')
+retrieval_top_k = int(os.getenv('RETRIEVAL_TOP_K', '12'))
+
+# Notes sent in full-mode prompts are deduplicated and packed into a token budget.
+# The budget defaults to a per-provider estimate; PROMPT_PRIORITY picks which notes
+# go in first: "recent" (most recently modified) or "topic" (least covered topic)
+prompt_token_budget = int(os.getenv('PROMPT_TOKEN_BUDGET', '0'))
+prompt_priority = os.getenv('PROMPT_PRIORITY', 'recent')
+near_duplicate_threshold = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', '0.85'))
+
+# Local state (job results, indexes, ...) lives under DATA_DIR unless configured otherwise
+data_dir = os.getenv('DATA_DIR', '.algonotes')
+# Background jobs for long-running analyses
+job_store_dir = os.getenv('JOB_STORE_DIR', os.path.join(data_dir, 'jobs'))
+job_max_workers = int(os.getenv('JOB_MAX_WORKERS', '2'))
+job_max_pending = int(os.getenv('JOB_MAX_PENDING', '100'))
+job_retention_seconds = int(os.getenv('JOB_RETENTION_SECONDS', '86400'))
+topic_index_path = os.getenv('TOPIC_INDEX_PATH', os.path.join(data_dir, 'topics.json'))
+search_index_path = os.getenv('SEARCH_INDEX_PATH', os.path.join(data_dir, 'search.json'))
+vector_index_path = os.getenv('VECTOR_INDEX_PATH', os.path.join(data_dir, 'vectors'))
+profile_state_path = os.getenv('PROFILE_STATE_PATH', os.path.join(data_dir, 'profile.json'))
+content_index_path = os.getenv('CONTENT_INDEX_PATH', os.path.join(data_dir, 'content_hashes.json'))
+# Set SUMMARY_STORE_DIR to an empty value to keep per-note summaries in memory only
+summary_store_dir = os.getenv('SUMMARY_STORE_DIR', os.path.join(data_dir, 'summaries'))
+
+# "objects" reads every note as its own S3 object; "sharded" also reads the shards
+# written by the compactor, which packs small note objects into a few large ones
+STORAGE_LAYOUTS = ('objects', 'sharded')
+storage_layout = os.getenv('STORAGE_LAYOUT', 'objects')
+if storage_layout not in STORAGE_LAYOUTS:
+    raise ValueError(f"STORAGE_LAYOUT must be one of {', '.join(STORAGE_LAYOUTS)}")
+shard_max_bytes = int(os.getenv('SHARD_MAX_BYTES', str(8 * 1024 * 1024)))
+shard_compression = os.getenv('SHARD_COMPRESSION', 'none')
+if shard_compression not in COMPRESSIONS:
+    raise ValueError(f"SHARD_COMPRESSION must be one of {', '.join(COMPRESSIONS)}")
+compact_interval = int(os.getenv('COMPACT_INTERVAL_SECONDS', '300'))
+compact_min_objects = int(os.getenv('COMPACT_MIN_OBJECTS', '50'))
+# A WSGI server imports this module in every worker, so the background compactor is opt-in there;
+# under `python app.py` it runs in the dev server's serving process
+background_compaction = os.getenv(
+    'BACKGROUND_COMPACTION', '1' if __name__ == '__main__' else '0'
+).lower() in ('1', 'true', 'yes')
 
 # Print credentials availability (not the actual values for security)
 print(f"AWS Access Key available: {bool(aws_access_key)}")
@@ -27,39 +198,457 @@ print(f"Bedrock Model ID: {bedrock_model_id}")
 print(f"AWS Region: {region}")
 
 app = Flask(__name__)
+# Leave room for the multipart form around the file itself
+app.config['MAX_CONTENT_LENGTH'] = max_upload_bytes + 64 * 1024
 CORS(app)
 
-# Only create clients if credentials are available
-if aws_access_key and aws_secret_key and region:
+@app.before_request
+def start_timing():
+    request.environ['algonotes.start'] = time.perf_counter()
+    start_request_timings()
+
+@app.after_request
+def finish_timing(response):
+    start = request.environ.get('algonotes.start')
+    if start is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=request.endpoint or 'unknown',
+                                status=response.status_code)
+    if server_timing or flag_enabled('server_timing'):
+        header = server_timing_header()
+        if header:
+            response.headers['Server-Timing'] = header
+    return response
+
+note_cache = NoteCache(note_cache_max_bytes, disk_dir=note_cache_dir, disk_max_bytes=note_cache_disk_max_bytes)
+response_cache = ResponseCache(response_cache_max_entries, response_cache_ttl)
+summary_store = SummaryStore(summary_store_dir or None, max_entries=summary_store_max_entries)
+topic_index = TopicIndex(topic_index_path)
+search_index = SearchIndex(search_index_path)
+# The local indexes save at most every few seconds; write out anything pending on exit
+atexit.register(topic_index.save, force=True)
+atexit.register(search_index.save, force=True)
+content_index = ContentIndex(content_index_path)
+atexit.register(content_index.save, force=True)
+# Concurrent requests for the same corpus or the same model call share one in-flight result
+corpus_flight = SingleFlight()
+model_flight = SingleFlight()
+# Concurrent saves of the same contents write one object; the others report it as a duplicate
+note_flight = SingleFlight()
+
+# AWS clients are created on first use and shared by every endpoint
+aws = AwsClients(
+    region,
+    access_key=aws_access_key,
+    secret_key=aws_secret_key,
+    session_token=aws_session_token,
+    max_pool_connections=aws_max_pool_connections,
+    max_attempts=aws_max_attempts,
+    bedrock_read_timeout=bedrock_read_timeout,
+    bedrock_max_attempts=bedrock_client_max_attempts
+)
+bedrock_scheduler = BedrockScheduler(
+    initial_limit=bedrock_initial_concurrency,
+    max_limit=bedrock_max_concurrency,
+    queue_timeout=bedrock_queue_timeout,
+    max_retries=bedrock_throttle_retries,
+    backoff_base=bedrock_backoff_base,
+    backoff_max=bedrock_backoff_max
+)
+if not aws.configured:
+    print("WARNING: AWS credentials not available. Set AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, and AWS_REGION environment variables.")
+
+if embedding_model_id and aws.configured:
+    embedder = BedrockEmbedder(lambda: aws.bedrock_runtime, embedding_model_id, bedrock_scheduler)
+else:
+    embedder = HashingEmbedder()
+vector_index = VectorIndex(embedder, vector_index_path)
+minhasher = MinHasher()
+profile_store = ProfileStore(profile_state_path)
+atexit.register(vector_index.save, force=True)
+
+# Latest shard manifest, revalidated by ETag before use so compactions are never missed
+shard_manifests = ManifestCache()
+compactor = Compactor(
+    lambda: aws.s3,
+    s3_bucket_name,
+    shard_max_bytes=shard_max_bytes,
+    compression=shard_compression,
+    min_objects=compact_min_objects,
+    max_workers=s3_max_workers,
+    manifests=shard_manifests
+)
+
+def start_background_compaction():
+    if background_compaction and storage_layout == 'sharded' and aws.configured:
+        compactor.start(compact_interval)
+
+def corpus_error(corpus):
+    """(payload, status) for a corpus load that produced no readable notes"""
+    if corpus.errors:
+        return {
+            "error": "Failed to read notes from S3",
+            "failed_notes": corpus.errors
+        }, 502
+    return {"error": "No content found in S3"}, 404
+
+def with_failed_notes(payload, corpus):
+    """Attach per-note read failures so partial loads are visible to the caller"""
+    if corpus.errors:
+        payload["failed_notes"] = corpus.errors
+    return payload
+
+def tag_note(text):
+    """Topic counts for a new note, asking the model only when no rule matches and the fallback is enabled.
+
+    Returns (topics, whether they came from the model).
+    """
+    topics = classify(text)
+    if topics or not (topic_model_fallback and aws.configured):
+        return topics, False
     try:
-        s3 = boto3.client(
-            's3',
-            region_name=region,
-            aws_access_key_id=aws_access_key,
-            aws_secret_access_key=aws_secret_key,
-            aws_session_token=aws_session_token
+        answer = bedrock_scheduler.call(lambda: invoke_text(
+            aws.bedrock_runtime,
+            bedrock_model_id,
+            TOPIC_FALLBACK_PROMPT.format(notes=text[:4000]),
+            generation_params(max_tokens=100, temperature=0),
+            ""
+        ))
+        return parse_model_topics(answer), True
+    except Exception as e:
+        print(f"Error tagging note with Bedrock: {e}")
+        return topics, False
+
+def note_metadata(note):
+    """S3 metadata of a note whose content came from a cache, for topic tags the sidecar index lost"""
+    try:
+        return aws.s3.head_object(Bucket=s3_bucket_name, Key=note.key).get('Metadata') or {}
+    except Exception as e:
+        print(f"Error reading metadata of note {note.key}: {e}")
+        return None
+
+def save_indexes():
+    """Persist the local indexes that notes are written through to"""
+    content_index.save()
+    topic_index.save()
+    search_index.save()
+    vector_index.save()
+
+def save_note(key, body, digest=None, text=None, persist=True):
+    """Write a note to S3, compressed and tagged with its topics, and through to the local indexes.
+
+    `body` is text, bytes, or an uploaded file together with the `digest`
+    and `text` scan_upload returned for it (text None when it is not UTF-8).
+    When a note with the same contents is already stored, or is being stored
+    by another request, nothing is written. With `persist=False` the indexes
+    are only updated in memory and the caller saves them once for a whole
+    batch. Returns (key the note is stored under, whether it was a duplicate).
+    """
+    if isinstance(body, str):
+        text = body
+        body = body.encode('utf-8')
+    if isinstance(body, bytes):
+        digest = digest or content_digest(body)
+        if text is None:
+            try:
+                text = body.decode('utf-8')
+            except UnicodeDecodeError:
+                # The corpus loader will report this note as unreadable; nothing to cache or tag
+                text = None
+        body = io.BytesIO(body)
+
+    writer = object()
+
+    def store():
+        existing = content_index.get(digest)
+        if existing is not None:
+            print(f"Note {key} has the same contents as {existing}; not storing it again")
+            return existing, None
+        return write_note(key, body, digest, text, persist), writer
+
+    stored_key, written_by = note_flight.do(digest, store)
+    return stored_key, written_by is not writer
+
+def write_note(key, body, digest, text, persist):
+    """Store a note that is not in the bucket yet under `key` and index it. Returns the key."""
+    topics, from_model = tag_note(text) if text is not None else ({}, False)
+    upload, extra_args = encode_file(body, note_codec)
+    if topics:
+        extra_args.setdefault("Metadata", {}).update(
+            {"topics": format_topics(topics), "topics-source": topics_source(from_model)}
         )
-        
-        bedrock_runtime = boto3.client(
-            service_name='bedrock-runtime',
-            region_name=region,
-            aws_access_key_id=aws_access_key,
-            aws_secret_access_key=aws_secret_key,
-            aws_session_token=aws_session_token
+    try:
+        size = upload.seek(0, io.SEEK_END)
+        upload.seek(0)
+        if size >= multipart_threshold:
+            aws.s3.upload_fileobj(upload, s3_bucket_name, key, ExtraArgs=extra_args, Config=transfer_config)
+            etag = aws.s3.head_object(Bucket=s3_bucket_name, Key=key).get('ETag')
+        else:
+            etag = aws.s3.put_object(Bucket=s3_bucket_name, Key=key, Body=upload.read(), **extra_args).get('ETag')
+    finally:
+        if upload is not body:
+            upload.close()
+
+    version = note_version(etag)
+    content_index.put(key, version, digest)
+    if text is not None:
+        note_cache.put(key, version, text)
+        topic_index.put(key, version, topics)
+        search_index.add(key, version, text)
+        try:
+            vector_index.add_note(key, version, text)
+        except Exception as e:
+            # The note is stored; retrieval mode will index it on its next corpus pass
+            print(f"Error embedding note {key}: {e}")
+    if persist:
+        save_indexes()
+    return key
+
+def flag_enabled(name):
+    """True when a boolean query parameter such as ?refresh=1 is set"""
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+def load_notes():
+    """Load the corpus, sharing one load between concurrent requests"""
+    return corpus_flight.do(s3_bucket_name, load_and_index_notes)
+
+def read_corpus():
+    """Load every note using the configured storage layout"""
+    if storage_layout == 'sharded':
+        corpus, _ = load_sharded_corpus(
+            aws.s3, s3_bucket_name, max_workers=s3_max_workers, cache=note_cache, manifests=shard_manifests
         )
-        print("AWS clients created successfully")
+        return corpus
+    return load_corpus(aws.s3, s3_bucket_name, max_workers=s3_max_workers, cache=note_cache)
+
+def load_and_index_notes():
+    corpus = read_corpus()
+    # Every full load is a chance to bring the search index in line with the bucket
+    search_index.sync(corpus.notes, keep_keys=[error["key"] for error in corpus.errors])
+    search_index.save()
+    content_index.sync(corpus.notes, keep_keys=[error["key"] for error in corpus.errors])
+    content_index.save()
+    return corpus
+
+def generate_text(prompt_template, notes, default, refresh=False):
+    """Fill `prompt_template` with the notes and run it through the model.
+
+    Responses are cached by the notes, model, prompt and generation
+    parameters; `refresh` skips the lookup but still stores the new answer.
+    Returns (text, cached).
+    """
+    params = generation_params()
+    key = cache_key(corpus_hash(notes), bedrock_model_id, prompt_template, params)
+    if not refresh:
+        text = response_cache.get(key)
+        if text is not None:
+            return text, True
+
+    def invoke():
+        # A request that was waiting behind an identical call may find its answer cached by now
+        text = None if refresh else response_cache.peek(key)
+        if text is not None:
+            return text, True
+        prompt = prompt_template.format(notes="\n\n".join(notes))
+        text = bedrock_scheduler.call(
+            lambda: invoke_text(aws.bedrock_runtime, bedrock_model_id, prompt, params, default)
+        )
+        response_cache.put(key, text)
+        return text, False
+
+    return model_flight.do(key, invoke)
+
+def stream_events(prompt_template, notes, default, refresh=False, selection=None, part=None):
+    """Server-Sent Events version of generate_text.
+
+    Yields a message event per piece of generated text, then a "done" event
+    (carrying the note `selection` stats, if any).
+    Cached answers are sent as a single message. Failures after the stream
+    has started are reported as an "error" event, or as a "busy" event when
+    no Bedrock capacity freed up in time. With `part`, every event carries
+    it so several streams can share one connection.
+    """
+    def event(data, name=None):
+        return sse_event(dict(data, part=part) if part else data, event=name)
+
+    params = generation_params()
+    key = cache_key(corpus_hash(notes), bedrock_model_id, prompt_template, params)
+    done_fields = {"selection": selection} if selection else {}
+    text = None if refresh else response_cache.get(key)
+    if text is not None:
+        yield event({"text": text})
+        yield event(dict({"cached": True}, **done_fields), "done")
+        return
+
+    prompt = prompt_template.format(notes="\n\n".join(notes))
+    pieces = []
+    try:
+        for piece in bedrock_scheduler.stream(
+            lambda: stream_text(aws.bedrock_runtime, bedrock_model_id, prompt, params)
+        ):
+            pieces.append(piece)
+            yield event({"text": piece})
+    except QueueTimeout as e:
+        print(f"Bedrock busy: {e}")
+        yield event({"error": str(e), "retry_after": retry_after_seconds()}, "busy")
+        return
     except Exception as e:
-        print(f"Error creating AWS clients: {e}")
+        print(f"Error streaming from Bedrock: {e}")
         traceback.print_exc()
-else:
-    print("WARNING: AWS credentials not available. Set AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, and AWS_REGION environment variables.")
-    s3 = None
-    bedrock_runtime = None
+        yield event({"error": str(e)}, "error")
+        return
+
+    text = "".join(pieces)
+    if not text:
+        text = default
+        yield event({"text": text})
+    response_cache.put(key, text)
+    yield event(dict({"cached": False}, **done_fields), "done")
+
+def merge_streams(streams):
+    """Interleave event generators, each run on its own thread, in the order their events arrive.
+
+    A stream the client stops reading still runs to the end, so its answer
+    lands in the response cache.
+    """
+    events = queue.Queue()
+    priority = current_priority()
+
+    def drain(stream):
+        try:
+            with model_priority(priority):
+                for item in stream:
+                    events.put(item)
+        except Exception as e:
+            print(f"Error in merged event stream: {e}")
+            traceback.print_exc()
+        finally:
+            events.put(None)
+
+    for stream in streams:
+        threading.Thread(target=drain, args=(stream,), name="sse-stream", daemon=True).start()
+    remaining = len(streams)
+    while remaining:
+        item = events.get()
+        if item is None:
+            remaining -= 1
+        else:
+            yield item
+
+def retry_after_seconds():
+    """How long clients are told to wait after a QueueTimeout"""
+    return max(1, int(bedrock_backoff_max))
+
+def sse_event(data, event=None):
+    message = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{message}" if event else message
+
+def sse_response(events):
+    return Response(events, mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        # Stop reverse proxies from buffering the stream
+        "X-Accel-Buffering": "no"
+    })
+
+def budget_chars(max_chars):
+    """`max_chars`, capped at the model's prompt token budget (about four characters per token)"""
+    return min(max_chars, token_budget(bedrock_model_id, prompt_token_budget) * 4)
+
+def prompt_notes(corpus):
+    """Note contents for a full-corpus prompt: duplicates removed, packed into the model's token budget.
+
+    Returns (contents, selection stats). The stats are sent to clients, so
+    they carry only counts; the over-budget keys would grow with the corpus.
+    """
+    topic_counts = None
+    if prompt_priority == 'topic':
+        topic_counts = topic_index.topics_for(corpus.notes, metadata_for=note_metadata)
+    notes, stats = select_notes(
+        corpus.notes,
+        token_budget(bedrock_model_id, prompt_token_budget),
+        priority=prompt_priority,
+        topic_counts=topic_counts,
+        near_duplicate_threshold=near_duplicate_threshold,
+        minhasher=minhasher
+    )
+    print(
+        f"Prompt uses {stats['selected']} of {stats['notes']} notes (~{stats['tokens']} tokens): "
+        f"{stats['duplicates']} duplicates, {stats['near_duplicates']} near-duplicates, "
+        f"{stats['over_budget']} over budget"
+    )
+    stats.pop("over_budget_keys")
+    return [note.content for note in notes], stats
+
+def retrieve_chunks(corpus, queries, k):
+    """Text of the k note chunks most similar to any of the queries, in note order"""
+    vector_index.sync(corpus.notes, keep_keys=[error["key"] for error in corpus.errors])
+    vector_index.save()
+
+    best = {}
+    for results in vector_index.search(queries, k=k):
+        for score, chunk in results:
+            span = (chunk["key"], chunk["start"], chunk["end"])
+            best[span] = max(score, best.get(span, score))
+    top = sorted(best, key=lambda span: -best[span])[:k]
+
+    contents = {note.key: note.content for note in corpus.notes}
+    return [contents[key][start:end] for key, start, end in sorted(top) if key in contents]
+
+# In hierarchical mode this includes the per-note summary calls
+@timed('prompt_build')
+def summary_prompt(corpus, mode):
+    """Prompt template and notes for a summary in the requested mode.
+
+    Returns (template, notes, mode, selection); `selection` holds the
+    full-mode note selection stats and is None in other modes. Auto mode
+    only sends the notes whole when none of them has to be left out.
+    """
+    contents = corpus.contents
+    if mode == 'auto':
+        total_chars = sum(len(content) for content in contents)
+        if total_chars <= budget_chars(summary_direct_max_chars):
+            notes, selection = prompt_notes(corpus)
+            if not selection["over_budget"]:
+                return SUMMARY_PROMPT, notes, 'full', selection
+        mode = 'hierarchical'
+
+    if mode == 'full':
+        notes, selection = prompt_notes(corpus)
+        return SUMMARY_PROMPT, notes, mode, selection
+
+    if mode == 'retrieval':
+        return RETRIEVAL_SUMMARY_PROMPT, retrieve_chunks(corpus, SUMMARY_RETRIEVAL_QUERIES, retrieval_top_k), mode, None
+
+    # The per-note calls run on worker threads, which do not see this request's priority
+    priority = current_priority()
+
+    def summarize(prompt):
+        params = generation_params(max_tokens=300)
+        key = cache_key(corpus_hash([prompt]), bedrock_model_id, "", params)
+        return model_flight.do(key, lambda: bedrock_scheduler.call(
+            lambda: invoke_text(aws.bedrock_runtime, bedrock_model_id, prompt, params, ""), priority=priority
+        ))
+
+    note_summaries = summarize_notes(
+        contents,
+        summarize,
+        summary_store,
+        bedrock_model_id,
+        chunk_chars=budget_chars(summary_chunk_chars),
+        reduce_chars=budget_chars(summary_direct_max_chars),
+        max_workers=summary_max_workers
+    )
+    return SUMMARY_REDUCE_PROMPT, note_summaries, mode, None
+
+def summarize_corpus(corpus, mode, refresh=False):
+    """Summarize the notes in the requested mode. Returns (summary, cached, mode, selection)."""
+    prompt_template, notes, mode, selection = summary_prompt(corpus, mode)
+    summary, cached = generate_text(prompt_template, notes, "No summary provided", refresh=refresh)
+    return summary, cached, mode, selection
 
 # Upload raw text as a .txt file to S3
 @app.route('/api/submit-note', methods=['POST'])
 def submit_note():
-    if not s3:
+    if not aws.configured:
         return jsonify({"error": "AWS credentials not configured"}), 500
         
     data = request.get_json()
@@ -70,126 +659,369 @@ def submit_note():
 
     file_name = f"{uuid.uuid4()}.txt"
     try:
-        s3.put_object(Bucket=s3_bucket_name, Key=file_name, Body=content)
-        return jsonify({"message": "Note submitted successfully"})
+        key, duplicate = save_note(file_name, content)
+        message = "Note already submitted" if duplicate else "Note submitted successfully"
+        return jsonify({"message": message, "key": key, "duplicate": duplicate})
     except Exception as e:
         print(f"Error submitting note: {e}")
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+def parse_batch_notes():
+    """Note contents from a JSON array or an NDJSON body, one entry per item.
+
+    Items are note strings or {"content": ...} objects. Each entry is
+    (content, None), or (None, error) for an item that cannot be used.
+    """
+    def item_content(item):
+        if isinstance(item, dict):
+            item = item.get('content')
+        if not isinstance(item, str):
+            return None, "Each note must be a string or an object with a content string"
+        item = item.strip()
+        if not item:
+            return None, "No content provided"
+        return item, None
+
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        items = []
+        # Read line by line rather than buffering the whole body as one string
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(item_content(json.loads(line)))
+            except ValueError as e:
+                items.append((None, f"Invalid JSON line: {e}"))
+        return items
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('notes')
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON array of notes or an NDJSON body")
+    return [item_content(item) for item in data]
+
+@app.route('/api/submit-notes', methods=['POST'])
+def submit_notes():
+    """Store many notes in one request, writing them to S3 concurrently"""
+    if not aws.configured:
+        return jsonify({"error": "AWS credentials not configured"}), 500
+
+    try:
+        items = parse_batch_notes()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not items:
+        return jsonify({"error": "No notes provided"}), 400
+    if len(items) > submit_batch_max_notes:
+        return jsonify({"error": f"At most {submit_batch_max_notes} notes can be submitted at once"}), 413
+
+    results = [{"index": index} for index in range(len(items))]
+    # Identical notes within the batch are written once; the others point at the first copy
+    first_by_digest = {}
+    pending = []
+    for index, (content, error) in enumerate(items):
+        if error is not None:
+            results[index].update(status="error", error=error)
+            continue
+        digest = content_digest(content)
+        if digest in first_by_digest:
+            results[index]["duplicate_of"] = first_by_digest[digest]
+            continue
+        first_by_digest[digest] = index
+        pending.append((index, content, digest))
+
+    def store(item):
+        index, content, digest = item
+        try:
+            # Topic tagging of batch imports waits behind interactive model calls
+            with model_priority(BATCH):
+                key, duplicate = save_note(f"{uuid.uuid4()}.txt", content, digest=digest, persist=False)
+            return index, {"status": "duplicate" if duplicate else "stored", "key": key}
+        except Exception as e:
+            print(f"Error submitting note {index} of batch: {e}")
+            return index, {"status": "error", "error": str(e)}
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(submit_max_workers, len(pending)))) as executor:
+            for index, outcome in executor.map(store, pending):
+                results[index].update(outcome)
+        save_indexes()
+
+    for result in results:
+        first = result.pop("duplicate_of", None)
+        if first is not None:
+            original = results[first]
+            if original["status"] == "error":
+                result.update(status="error", error=original["error"])
+            else:
+                result.update(status="duplicate", key=original["key"])
+
+    counts = {status: sum(1 for result in results if result["status"] == status)
+              for status in ("stored", "duplicate", "error")}
+    return jsonify({
+        "stored": counts["stored"],
+        "duplicates": counts["duplicate"],
+        "failed": counts["error"],
+        "results": results
+    })
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": f"Upload is larger than {max_upload_bytes} bytes"}), 413
+
+def upload_key(filename):
+    """The S3 key for an uploaded file: its name without any directory part or control characters"""
+    name = filename.replace('\\', '/').rsplit('/', 1)[-1]
+    return ''.join(char for char in name if char.isprintable())
+
 # Upload a file to S3
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    if not s3:
+    if not aws.configured:
         return jsonify({"error": "AWS credentials not configured"}), 500
         
     file = request.files.get('file')
     if not file or not file.filename.endswith('.txt'):
         return jsonify({"error": "Only .txt files are allowed"}), 400
+    key = upload_key(file.filename)
+
+    try:
+        # Werkzeug has spooled the upload already; hash and decode it in place and stream it from there
+        size, digest, text = scan_upload(file.stream, max_upload_bytes)
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
 
     try:
-        s3.upload_fileobj(file, s3_bucket_name, file.filename)
-        return jsonify({"message": "File uploaded successfully"})
+        key, duplicate = save_note(key, file.stream, digest=digest, text=text)
+        message = "File already uploaded" if duplicate else "File uploaded successfully"
+        return jsonify({"message": message, "key": key, "duplicate": duplicate})
     except Exception as e:
         print(f"Error uploading file: {e}")
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
     
-@app.route('/api/summary', methods=['GET'])
-def get_summary():
-    if not s3:
-        return jsonify({"error": "AWS credentials not configured for S3"}), 500
+@timed('prompt_build')
+def recommendation_prompt(corpus, mode):
+    """Prompt template and notes for recommendations in the requested mode.
 
-    try:
-        # Fetch notes from S3
-        response = s3.list_objects_v2(Bucket=s3_bucket_name)
-        contents = []
-
-        for obj in response.get('Contents', []):
-            if obj['Key'].endswith('.txt'):
-                s3_obj = s3.get_object(Bucket=s3_bucket_name, Key=obj['Key'])
-                contents.append(s3_obj['Body'].read().decode('utf-8'))
-
-        if not contents:
-            return jsonify({"error": "No content found in S3"}), 404
-
-        joined_text = "\n\n".join(contents)
-
-        if not bedrock_runtime:
-            return jsonify({
-                "warning": "Bedrock access not configured. Returning raw notes.",
-                "notes": contents
-            })
-
-        model_provider = bedrock_model_id.split('.')[0].lower()
-        prompt = f"Summarize the following notes in a clear and concise way:\n\n{joined_text}"
-
-        # Prepare request body depending on model
-        if "anthropic" in model_provider:
-            body = json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 1000,
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.5
-            })
-        elif "amazon" in model_provider:
-            body = json.dumps({
-                "inputText": prompt,
-                "textGenerationConfig": {
-                    "maxTokenCount": 1000,
-                    "temperature": 0.5,
-                    "topP": 0.9
-                }
-            })
-        elif "ai21" in model_provider:
-            body = json.dumps({
-                "prompt": prompt,
-                "maxTokens": 1000,
-                "temperature": 0.5,
-                "topP": 0.9
-            })
-        elif "cohere" in model_provider:
-            body = json.dumps({
-                "prompt": prompt,
-                "max_tokens": 1000,
-                "temperature": 0.5
-            })
-        elif "meta" in model_provider:
-            body = json.dumps({
-                "prompt": prompt,
-                "max_gen_len": 1000,
-                "temperature": 0.5,
-                "top_p": 0.9
-            })
-        else:
-            body = json.dumps({
-                "prompt": prompt,
-                "max_tokens": 1000,
-                "temperature": 0.5
-            })
-
-        response = bedrock_runtime.invoke_model(
-            modelId=bedrock_model_id,
-            body=body
+    Returns (template, notes, mode, selection) like summary_prompt.
+    """
+    if mode == 'auto':
+        total_chars = sum(len(note.content) for note in corpus.notes)
+        if total_chars <= budget_chars(recommendation_direct_max_chars):
+            notes, selection = prompt_notes(corpus)
+            if not selection["over_budget"]:
+                return RECOMMENDATION_PROMPT, notes, 'full', selection
+        mode = 'topics'
+
+    if mode == 'full':
+        notes, selection = prompt_notes(corpus)
+        return RECOMMENDATION_PROMPT, notes, mode, selection
+
+    if mode == 'retrieval':
+        notes = retrieve_chunks(corpus, RECOMMENDATION_RETRIEVAL_QUERIES, retrieval_top_k)
+        return RETRIEVAL_RECOMMENDATION_PROMPT, notes, mode, None
+
+    topic_counts = topic_index.topics_for(corpus.notes, metadata_for=note_metadata)
+    topic_index.save()
+    notes = topic_digest(corpus.notes, topic_counts, snippets=topic_snippets)
+    return TOPIC_RECOMMENDATION_PROMPT, notes, mode, None
+
+def recommend_delta(corpus, refresh=False):
+    """Recommendations from the notes added or changed since the last delta run.
+
+    The saved student profile stands in for everything already processed.
+    `refresh`, a missing profile or a different model start over from the
+    whole corpus. Returns (recommendation, cached).
+    """
+    with profile_store.lock:
+        state = profile_store.load()
+        rebuild = refresh or not state.get("profile") or state.get("model") != bedrock_model_id
+        processed = {} if rebuild else state.get("processed", {})
+
+        versions = {note.key: note_version(note.etag, note.last_modified) for note in corpus.notes}
+        changed = [note for note in corpus.notes if processed.get(note.key) != versions[note.key]]
+        if not changed and state.get("recommendation"):
+            return state["recommendation"], True
+
+        budget = token_budget(bedrock_model_id, prompt_token_budget)
+        if not rebuild:
+            budget -= len(state["profile"]) // 4
+        with timed('prompt_build'):
+            selected, stats = select_notes(
+                changed, budget, near_duplicate_threshold=near_duplicate_threshold, minhasher=minhasher
+            )
+        print(
+            f"Delta recommendation over {len(selected)} of {len(changed)} new or changed notes "
+            f"({'full rebuild' if rebuild else 'incremental'})"
         )
-        response_stream = response.get('body') or response.get('Body')
-        response_body = json.loads(response_stream.read())
-
-        if "anthropic" in model_provider:
-            summary = response_body.get('content', [{}])[0].get('text', 'No summary provided')
-        elif "amazon" in model_provider:
-            summary = response_body.get('results', [{}])[0].get('outputText', 'No summary provided')
-        elif "ai21" in model_provider:
-            summary = response_body.get('completions', [{}])[0].get('data', {}).get('text', 'No summary provided')
-        elif "cohere" in model_provider:
-            summary = response_body.get('text', 'No summary provided')
-        elif "meta" in model_provider:
-            summary = response_body.get('generation', 'No summary provided')
+        if rebuild:
+            prompt_template, notes = PROFILE_REBUILD_PROMPT, [note.content for note in selected]
         else:
-            summary = str(response_body)
+            prompt_template = PROFILE_UPDATE_PROMPT
+            notes = [f"Current student profile:\n{state['profile']}"] + [note.content for note in selected]
+
+        answer, cached = generate_text(prompt_template, notes, "", refresh=refresh)
+        profile, recommendation = parse_profile_response(answer)
+
+        # Notes left out for lack of budget stay unprocessed and go into the next run;
+        # notes that could not be read this time keep whatever state they had
+        deferred = set(stats["over_budget_keys"])
+        new_processed = {key: version for key, version in versions.items() if key not in deferred}
+        for error in corpus.errors:
+            if error["key"] in processed:
+                new_processed[error["key"]] = processed[error["key"]]
+
+        profile_store.save({
+            "model": bedrock_model_id,
+            "processed": new_processed,
+            "profile": profile or state.get("profile", ""),
+            "recommendation": recommendation or "No recommendation provided",
+            "updated_at": time.time()
+        })
+        return recommendation or "No recommendation provided", cached
+
+def recommend_corpus(corpus, mode, refresh=False):
+    """Recommend topics to study next. Returns (recommendation, cached, mode, selection)."""
+    if mode == 'delta':
+        recommendation, cached = recommend_delta(corpus, refresh=refresh)
+        return recommendation, cached, mode, None
+    prompt_template, notes, mode, selection = recommendation_prompt(corpus, mode)
+    recommendation, cached = generate_text(prompt_template, notes, "No recommendation provided", refresh=refresh)
+    return recommendation, cached, mode, selection
+
+def raw_notes_fallback(warning):
+    """Payload pointing at the first page of /api/notes when no model output is available"""
+    return {
+        "warning": f"{warning} Raw notes are available page by page from notes_url.",
+        "notes_url": "/api/notes",
+        "cursor": None
+    }
+
+def build_insights(mode, rec_mode, refresh=False):
+    """Summary and recommendations from a single corpus load. Returns (payload, status).
+
+    The two model calls run concurrently over the same notes. If one of them
+    fails the other is still returned, with the failure under "errors". A
+    QueueTimeout in either is raised, since a retry gets the other answer
+    from the response cache.
+    """
+    corpus = load_notes()
+    if not corpus.contents:
+        return corpus_error(corpus)
+
+    priority = current_priority()
+
+    def run(fn, *args):
+        with model_priority(priority):
+            return fn(*args)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        summary_future = executor.submit(run, summarize_corpus, corpus, mode, refresh)
+        recommendation_future = executor.submit(run, recommend_corpus, corpus, rec_mode, refresh)
+
+    payload = {"cached": {}, "mode": {}, "selection": {}, "errors": {}}
+    busy = None
+    try:
+        summary, cached, mode, selection = summary_future.result()
+        payload["summary"] = summary
+        payload["cached"]["summary"] = cached
+        payload["mode"]["summary"] = mode
+        if selection:
+            payload["selection"]["summary"] = selection
+    except QueueTimeout as e:
+        busy = e
+    except Exception as e:
+        print(f"Error generating summary: {e}")
+        traceback.print_exc()
+        payload["errors"]["summary"] = str(e)
+    try:
+        recommendation, cached, rec_mode, selection = recommendation_future.result()
+        payload["recommendation"] = recommendation
+        payload["cached"]["recommendation"] = cached
+        payload["mode"]["recommendation"] = rec_mode
+        if selection:
+            payload["selection"]["recommendation"] = selection
+    except QueueTimeout as e:
+        busy = e
+    except Exception as e:
+        print(f"Error generating recommendations: {e}")
+        traceback.print_exc()
+        payload["errors"]["recommendation"] = str(e)
+
+    if busy is not None:
+        raise busy
+    if len(payload["errors"]) == 2:
+        return with_failed_notes({"error": "Bedrock calls failed", "errors": payload["errors"]}, corpus), 502
+    for field in ("selection", "errors"):
+        if not payload[field]:
+            del payload[field]
+    return with_failed_notes(payload, corpus), 200
+
+def build_summary(mode, refresh=False):
+    """Summarize every note in the bucket. Returns (payload, status)."""
+    # Fetch notes from S3
+    corpus = load_notes()
+    if not corpus.contents:
+        return corpus_error(corpus)
+
+    summary, cached, mode, selection = summarize_corpus(corpus, mode, refresh=refresh)
+    payload = {"summary": summary, "cached": cached, "mode": mode}
+    if selection:
+        payload["selection"] = selection
+    return with_failed_notes(payload, corpus), 200
+
+def build_recommendations(mode, refresh=False):
+    """Recommend topics to study next from every note in the bucket. Returns (payload, status)."""
+    # First fetch content from S3
+    print(f"Listing objects from bucket: {s3_bucket_name}")
+    corpus = load_notes()
+    if not corpus.contents:
+        return corpus_error(corpus)
+        
+    try:
+        print(f"Calling Bedrock model: {bedrock_model_id}")
+        recommendation, cached, mode, selection = recommend_corpus(corpus, mode, refresh=refresh)
+        payload = {"recommendation": recommendation, "cached": cached, "mode": mode}
+        if selection:
+            payload["selection"] = selection
+        return with_failed_notes(payload, corpus), 200
+
+    except QueueTimeout:
+        raise
+    except Exception as e:
+        print(f"Error calling Bedrock: {e}")
+        traceback.print_exc()
+        
+        # For debugging: print the model ID
+        print(f"Failed model ID: {bedrock_model_id}")
+        
+        payload = raw_notes_fallback(f"Error using Bedrock model: {str(e)}")
+        payload["modelId"] = bedrock_model_id
+        return with_failed_notes(payload, corpus), 200
 
-        return jsonify({"summary": summary})
+def model_busy(e):
+    """503 response for a model call that timed out waiting for Bedrock capacity"""
+    print(f"Bedrock busy: {e}")
+    return jsonify({"error": str(e)}), 503, {"Retry-After": str(retry_after_seconds())}
 
+@app.route('/api/summary', methods=['GET'])
+def get_summary():
+    if not aws.configured:
+        return jsonify({"error": "AWS credentials not configured for S3"}), 500
+
+    mode = request.args.get('mode', summary_mode)
+    if mode not in SUMMARY_MODES:
+        return jsonify({"error": f"Unknown summary mode: {mode}"}), 400
+
+    try:
+        payload, status = build_summary(mode, refresh=flag_enabled('refresh'))
+        return jsonify(payload), status
+    except QueueTimeout as e:
+        return model_busy(e)
     except Exception as e:
         print(f"Error generating summary: {e}")
         traceback.print_exc()
@@ -199,155 +1031,401 @@ def get_summary():
 # Get topic recommendations from notes in S3
 @app.route('/api/recommendations', methods=['GET'])
 def get_recommendations():
-    if not s3:
+    if not aws.configured:
         return jsonify({"error": "AWS credentials not configured for S3"}), 500
+
+    mode = request.args.get('mode', recommendation_mode)
+    if mode not in RECOMMENDATION_MODES:
+        return jsonify({"error": f"Unknown recommendation mode: {mode}"}), 400
         
     try:
-        # First fetch content from S3
-        print(f"Listing objects from bucket: {s3_bucket_name}")
-        response = s3.list_objects_v2(Bucket=s3_bucket_name)
-        contents = []
+        payload, status = build_recommendations(mode, refresh=flag_enabled('refresh'))
+        return jsonify(payload), status
+    except QueueTimeout as e:
+        return model_busy(e)
+    except Exception as e:
+        print(f"Error in recommendations: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
 
-        for obj in response.get('Contents', []):
-            if obj['Key'].endswith('.txt'):
-                s3_obj = s3.get_object(Bucket=s3_bucket_name, Key=obj['Key'])
-                contents.append(s3_obj['Body'].read().decode('utf-8'))
+# Summary and recommendations in one pass over the notes
+@app.route('/api/insights', methods=['GET'])
+def get_insights():
+    if not aws.configured:
+        return jsonify({"error": "AWS credentials not configured for S3"}), 500
 
-        if not contents:
-            return jsonify({"error": "No content found in S3"}), 404
+    mode = request.args.get('mode', summary_mode)
+    if mode not in SUMMARY_MODES:
+        return jsonify({"error": f"Unknown summary mode: {mode}"}), 400
+    rec_mode = request.args.get('recommendation_mode', recommendation_mode)
+    if rec_mode not in RECOMMENDATION_MODES:
+        return jsonify({"error": f"Unknown recommendation mode: {rec_mode}"}), 400
 
-        joined_text = "\n\n".join(contents)
-        
-        # Now try to use Bedrock if available
-        if not bedrock_runtime:
-            # Fallback to returning raw content if Bedrock not available
-            return jsonify({
-                "warning": "Bedrock access not configured or unavailable. Returning raw notes instead.",
-                "notes": contents
-            })
-            
-        try:
-            # Create request body based on model provider
-            print(f"Preparing request for model: {bedrock_model_id}")
-            model_provider = bedrock_model_id.split('.')[0].lower()
-            
-            if "anthropic" in model_provider:
-                # Claude models (anthropic.claude-*)
-                body = json.dumps({
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 1000,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": f"Based on these notes, what are the next topics I should study?\n\n{joined_text}"
-                        }
-                    ],
-                    "temperature": 0.5
-                })
-                print("Using Anthropic Claude format")
-                
-            elif "amazon" in model_provider:
-                # Amazon Titan models (amazon.titan-*)
-                body = json.dumps({
-                    "inputText": f"Based on these notes, what are the next topics I should study?\n\n{joined_text}",
-                    "textGenerationConfig": {
-                        "maxTokenCount": 1000,
-                        "temperature": 0.5,
-                        "topP": 0.9
-                    }
-                })
-                print("Using Amazon Titan format")
-                
-            elif "ai21" in model_provider:
-                # AI21 Jurassic models (ai21.j2-*)
-                body = json.dumps({
-                    "prompt": f"Based on these notes, what are the next topics I should study?\n\n{joined_text}",
-                    "maxTokens": 1000,
-                    "temperature": 0.5,
-                    "topP": 0.9
-                })
-                print("Using AI21 format")
-                
-            elif "cohere" in model_provider:
-                # Cohere models (cohere.command-*)
-                body = json.dumps({
-                    "prompt": f"Based on these notes, what are the next topics I should study?\n\n{joined_text}",
-                    "max_tokens": 1000,
-                    "temperature": 0.5
-                })
-                print("Using Cohere format")
-                
-            elif "meta" in model_provider:
-                # Meta Llama models (meta.llama-*)
-                body = json.dumps({
-                    "prompt": f"Based on these notes, what are the next topics I should study?\n\n{joined_text}",
-                    "max_gen_len": 1000,
-                    "temperature": 0.5,
-                    "top_p": 0.9
-                })
-                print("Using Meta Llama format")
-                
-            else:
-                # Generic fallback format
-                body = json.dumps({
-                    "prompt": f"Based on these notes, what are the next topics I should study?\n\n{joined_text}",
-                    "max_tokens": 1000,
-                    "temperature": 0.5
-                })
-                print(f"Using generic format for unknown provider: {model_provider}")
-
-            print(f"Calling Bedrock model: {bedrock_model_id}")
-            response = bedrock_runtime.invoke_model(
-                modelId=bedrock_model_id,
-                body=body,
+    try:
+        payload, status = build_insights(mode, rec_mode, refresh=flag_enabled('refresh'))
+        return jsonify(payload), status
+    except QueueTimeout as e:
+        return model_busy(e)
+    except Exception as e:
+        print(f"Error generating insights: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/summary/stream', methods=['GET'])
+def stream_summary():
+    """Streaming version of /api/summary over Server-Sent Events"""
+    if not aws.configured:
+        return jsonify({"error": "AWS credentials not configured"}), 500
+
+    mode = request.args.get('mode', summary_mode)
+    if mode not in SUMMARY_MODES:
+        return jsonify({"error": f"Unknown summary mode: {mode}"}), 400
+
+    try:
+        corpus = load_notes()
+        if not corpus.contents:
+            payload, status = corpus_error(corpus)
+            return jsonify(payload), status
+        prompt_template, notes, mode, selection = summary_prompt(corpus, mode)
+    except QueueTimeout as e:
+        # Hierarchical summaries call the model while preparing the prompt
+        return model_busy(e)
+    except Exception as e:
+        print(f"Error preparing summary stream: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+    return sse_response(stream_events(
+        prompt_template, notes, "No summary provided", refresh=flag_enabled('refresh'), selection=selection
+    ))
+
+@app.route('/api/recommendations/stream', methods=['GET'])
+def stream_recommendations():
+    """Streaming version of /api/recommendations over Server-Sent Events"""
+    if not aws.configured:
+        return jsonify({"error": "AWS credentials not configured"}), 500
+
+    mode = request.args.get('mode', recommendation_mode)
+    if mode not in RECOMMENDATION_MODES:
+        return jsonify({"error": f"Unknown recommendation mode: {mode}"}), 400
+    if mode == 'delta':
+        return jsonify({"error": "Delta recommendations cannot be streamed; use /api/recommendations?mode=delta"}), 400
+
+    try:
+        corpus = load_notes()
+        if not corpus.contents:
+            payload, status = corpus_error(corpus)
+            return jsonify(payload), status
+        prompt_template, notes, mode, selection = recommendation_prompt(corpus, mode)
+    except QueueTimeout as e:
+        return model_busy(e)
+    except Exception as e:
+        print(f"Error preparing recommendation stream: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+    return sse_response(stream_events(
+        prompt_template, notes, "No recommendation provided", refresh=flag_enabled('refresh'), selection=selection
+    ))
+
+@app.route('/api/insights/stream', methods=['GET'])
+def stream_insights():
+    """Streaming version of /api/insights: summary and recommendation text on one Server-Sent Events connection.
+
+    Both answers are generated concurrently from a single load of the notes;
+    every event carries a "part" of "summary" or "recommendation", and each
+    part ends with its own "done", "busy" or "error" event.
+    """
+    if not aws.configured:
+        return jsonify({"error": "AWS credentials not configured"}), 500
+
+    mode = request.args.get('mode', summary_mode)
+    if mode not in SUMMARY_MODES:
+        return jsonify({"error": f"Unknown summary mode: {mode}"}), 400
+    rec_mode = request.args.get('recommendation_mode', recommendation_mode)
+    if rec_mode not in RECOMMENDATION_MODES:
+        return jsonify({"error": f"Unknown recommendation mode: {rec_mode}"}), 400
+    if rec_mode == 'delta':
+        return jsonify({"error": "Delta recommendations cannot be streamed; use /api/insights"}), 400
+
+    try:
+        corpus = load_notes()
+        if not corpus.contents:
+            payload, status = corpus_error(corpus)
+            return jsonify(payload), status
+        summary_template, summary_notes, _, summary_selection = summary_prompt(corpus, mode)
+        rec_template, rec_notes, _, rec_selection = recommendation_prompt(corpus, rec_mode)
+    except QueueTimeout as e:
+        return model_busy(e)
+    except Exception as e:
+        print(f"Error preparing insights stream: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+    refresh = flag_enabled('refresh')
+    return sse_response(merge_streams([
+        stream_events(summary_template, summary_notes, "No summary provided", refresh=refresh,
+                      selection=summary_selection, part="summary"),
+        stream_events(rec_template, rec_notes, "No recommendation provided", refresh=refresh,
+                      selection=rec_selection, part="recommendation")
+    ]))
+
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters for the local caches"""
+    return jsonify({
+        "responses": response_cache.stats(),
+        "notes": note_cache.stats(),
+        "coalesced": {
+            "corpus_loads": corpus_flight.coalesced,
+            "model_calls": model_flight.coalesced
+        },
+        "bedrock_scheduler": bedrock_scheduler.stats()
+    })
+
+job_queue = None
+job_queue_lock = threading.Lock()
+
+def run_in_background(build, *args, **kwargs):
+    """Run a job's analysis with its model calls queued behind interactive requests"""
+    with model_priority(BACKGROUND):
+        return build(*args, **kwargs)
+
+def get_job_queue():
+    """The job queue, created on first use; creating it restarts jobs interrupted by a restart"""
+    global job_queue
+    with job_queue_lock:
+        if job_queue is None:
+            job_queue = JobQueue(
+                {
+                    "summary": lambda params: run_in_background(build_summary, params.get("mode", summary_mode), refresh=params.get("refresh", False)),
+                    "recommendations": lambda params: run_in_background(build_recommendations, params.get("mode", recommendation_mode), refresh=params.get("refresh", False))
+                },
+                max_workers=job_max_workers,
+                directory=job_store_dir,
+                max_pending=job_max_pending,
+                retention_seconds=job_retention_seconds
             )
-            
-            try:
-                response_stream = response.get('body') or response.get('Body')
-                if response_stream:
-                    response_body = json.loads(response_stream.read())
-                else:
-                    raise ValueError(f"No 'Body' or 'body' in response: {response}")
-            except Exception as e:
-                print(f"Failed to parse Bedrock response: {e}")
-                print(f"Raw response: {response}")
-                raise
-
-            print(f"Response structure: {list(response_body.keys())}")
-            
-            # Extract recommendation based on model provider
-            if "anthropic" in model_provider:
-                recommendation = response_body.get('content', [{}])[0].get('text', 'No recommendation provided')
-            elif "amazon" in model_provider:
-                recommendation = response_body.get('results', [{}])[0].get('outputText', 'No recommendation provided')
-            elif "ai21" in model_provider:
-                recommendation = response_body.get('completions', [{}])[0].get('data', {}).get('text', 'No recommendation provided')
-            elif "cohere" in model_provider:
-                recommendation = response_body.get('text', 'No recommendation provided')
-            elif "meta" in model_provider:
-                recommendation = response_body.get('generation', 'No recommendation provided')
-            else:
-                # Generic fallback
-                recommendation = str(response_body)
-                
-            return jsonify({"recommendation": recommendation})
-            
+        return job_queue
+
+def submit_job(kind, params):
+    try:
+        job = get_job_queue().submit(kind, params)
+    except QueueFull as e:
+        return jsonify({"error": f"Too many pending jobs: {e}"}), 503
+    return jsonify({"job_id": job["id"], "status": job["status"], "status_url": f"/api/jobs/{job['id']}"}), 202
+
+@app.route('/api/jobs/summary', methods=['POST'])
+def submit_summary_job():
+    if not aws.configured:
+        return jsonify({"error": "AWS credentials not configured for S3"}), 500
+
+    mode = request.args.get('mode', summary_mode)
+    if mode not in SUMMARY_MODES:
+        return jsonify({"error": f"Unknown summary mode: {mode}"}), 400
+    return submit_job("summary", {"mode": mode, "refresh": flag_enabled('refresh')})
+
+@app.route('/api/jobs/recommendations', methods=['POST'])
+def submit_recommendations_job():
+    if not aws.configured:
+        return jsonify({"error": "AWS credentials not configured for S3"}), 500
+
+    mode = request.args.get('mode', recommendation_mode)
+    if mode not in RECOMMENDATION_MODES:
+        return jsonify({"error": f"Unknown recommendation mode: {mode}"}), 400
+    return submit_job("recommendations", {"mode": mode, "refresh": flag_enabled('refresh')})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_job_queue().get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+def note_text(key, version):
+    """Contents of one note revision, from the local cache when possible"""
+    text = note_cache.get(key, version)
+    if text is None:
+        if storage_layout == 'sharded':
+            manifest = shard_manifests.get(aws.s3, s3_bucket_name)
+            text = read_sharded_note(aws.s3, s3_bucket_name, key, manifest)
+        else:
+            text = read_note(aws.s3, s3_bucket_name, key)
+        note_cache.put(key, version, text)
+    return text
+
+# Full-text search over notes
+@app.route('/api/search', methods=['GET'])
+def search_notes():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "No query provided"}), 400
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(100, max(1, int(request.args.get('limit', 10))))
+    except ValueError:
+        return jsonify({"error": "offset and limit must be integers"}), 400
+
+    total, matches = search_index.search(query, offset=offset, limit=limit)
+    terms = list(dict.fromkeys(tokenize(query)))
+    results = []
+    for key, version, score in matches:
+        result = {"key": key, "score": round(score, 4)}
+        try:
+            result["snippet"] = make_snippet(note_text(key, version), terms)
         except Exception as e:
-            print(f"Error calling Bedrock: {e}")
-            traceback.print_exc()
-            
-            # For debugging: print the model ID and request body
-            print(f"Failed model ID: {bedrock_model_id}")
-            print(f"Request body sample (first 100 chars): {body[:100]}...")
-            
-            return jsonify({
-                "warning": f"Error using Bedrock model: {str(e)}",
-                "notes": contents,
-                "modelId": bedrock_model_id
-            })
+            print(f"Error loading snippet for {key}: {e}")
+            result["snippet"] = None
+        results.append(result)
 
+    next_offset = offset + len(results)
+    return jsonify({
+        "query": query,
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "next_offset": next_offset if next_offset < total else None,
+        "results": results
+    })
+
+@app.route('/api/search/rebuild', methods=['POST'])
+def rebuild_search_index():
+    """Bring the search index in line with the bucket"""
+    if not aws.configured:
+        return jsonify({"error": "AWS credentials not configured for S3"}), 500
+    try:
+        corpus = read_corpus()
+        added, removed = search_index.sync(corpus.notes, keep_keys=[error["key"] for error in corpus.errors])
+        search_index.save(force=True)
+        return jsonify(with_failed_notes({
+            "message": "Search index rebuilt",
+            "indexed": added,
+            "removed": removed,
+            "notes": len(search_index)
+        }, corpus))
     except Exception as e:
-        print(f"Error in recommendations: {e}")
+        print(f"Error rebuilding search index: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    try:
+        return base64.b64decode(cursor.encode('ascii'), altchars=b'-_', validate=True).decode('utf-8')
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+def page_contents(items):
+    """Contents of one page of notes, keyed by note key, with errors as {"error": ...} entries.
+
+    Notes are fetched concurrently; notes that live in the same shard are
+    read with one ranged GET.
+    """
+    contents = {}
+    by_shard = {}
+    objects = []
+    for item in items:
+        version = note_version(item.get('ETag'), item.get('LastModified'))
+        text = note_cache.get(item['Key'], version)
+        if text is not None:
+            contents[item['Key']] = text
+        elif item.get('Shard'):
+            by_shard.setdefault(item['Shard']['shard'], {})[item['Key']] = item['Shard']
+        else:
+            objects.append((item['Key'], version))
+
+    shard_info = shard_manifests.get(aws.s3, s3_bucket_name)["shards"] if by_shard else {}
+
+    def fetch_shard(shard_key):
+        entries = by_shard[shard_key]
+        try:
+            texts = read_shard_notes(aws.s3, s3_bucket_name, shard_key, shard_info.get(shard_key, {}), entries)
+        except Exception as e:
+            return {key: {"error": str(e)} for key in entries}
+        for key, entry in entries.items():
+            note_cache.put(key, note_version(entry.get("etag"), entry.get("last_modified")), texts[key])
+        return texts
+
+    def fetch_object(item):
+        key, version = item
+        try:
+            return {key: note_text(key, version)}
+        except Exception as e:
+            return {key: {"error": str(e)}}
+
+    tasks = [(fetch_shard, shard_key) for shard_key in by_shard] + [(fetch_object, item) for item in objects]
+    if tasks:
+        with ThreadPoolExecutor(max_workers=max(1, min(s3_max_workers, len(tasks)))) as executor:
+            for result in executor.map(lambda task: task[0](task[1]), tasks):
+                contents.update(result)
+    return contents
+
+@app.route('/api/notes', methods=['GET'])
+def list_notes():
+    """One page of raw notes as NDJSON, one note per line in key order.
+
+    Pass the X-Next-Cursor response header back as ?cursor= for the next
+    page; it is absent on the last page. ?metadata_only=1 skips the note
+    contents.
+    """
+    if not aws.configured:
+        return jsonify({"error": "AWS credentials not configured for S3"}), 500
+    try:
+        limit = min(notes_page_max, max(1, int(request.args.get('limit', 100))))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    cursor = request.args.get('cursor')
+    try:
+        start_after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    metadata_only = flag_enabled('metadata_only')
+
+    try:
+        if storage_layout == 'sharded':
+            manifest = shard_manifests.get(aws.s3, s3_bucket_name)
+            items, more = list_sharded_page(aws.s3, s3_bucket_name, manifest, start_after, limit)
+        else:
+            items, more = list_note_page(aws.s3, s3_bucket_name, start_after, limit, exclude_prefix=SHARD_PREFIX)
+    except Exception as e:
+        print(f"Error listing notes: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        contents = {} if metadata_only else page_contents(items)
+        for item in items:
+            last_modified = item.get('LastModified')
+            line = {
+                "key": item['Key'],
+                "etag": note_version(item.get('ETag')),
+                "last_modified": last_modified.isoformat() if hasattr(last_modified, 'isoformat') else last_modified,
+                "size": item.get('Size', 0)
+            }
+            if not metadata_only:
+                content = contents.get(item['Key'])
+                if isinstance(content, dict):
+                    line["error"] = content["error"]
+                else:
+                    line["content"] = content
+            yield json.dumps(line) + "\n"
+
+    headers = {"X-Next-Cursor": encode_cursor(items[-1]['Key'])} if more and items else {}
+    return Response(generate(), mimetype='application/x-ndjson', headers=headers)
+
+@app.route('/api/compact', methods=['POST'])
+def compact_notes():
+    """Pack small note objects into shards now instead of waiting for the background compactor"""
+    if not aws.configured:
+        return jsonify({"error": "AWS credentials not configured for S3"}), 500
+    if storage_layout != 'sharded':
+        return jsonify({"error": "Compaction needs STORAGE_LAYOUT=sharded"}), 400
+    try:
+        return jsonify(compactor.compact(force=True))
+    except Exception as e:
+        print(f"Error compacting notes: {e}")
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
@@ -356,84 +1434,132 @@ def get_recommendations():
 def index():
     return send_from_directory('.', 'index.html')
 
-@app.route('/api/check-config', methods=['GET'])
-def check_config():
-    """Endpoint to check if AWS configuration is working"""
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Stage latencies, S3 bytes read, token counts and AWS call outcomes in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+def probe_aws(deep=False):
+    """Check S3 and Bedrock access.
+
+    The regular probe makes one cheap call per service. The deep probe also
+    lists the available models and, if that is not permitted, tries a tiny
+    call to the configured model through the scheduler.
+    """
     config_status = {
         "s3": {"configured": False, "message": "Not initialized"},
         "bedrock": {"configured": False, "message": "Not initialized"},
         "region": region
     }
-    
+    if not aws.configured:
+        return config_status
+
     # Check S3 configuration
-    if s3:
+    try:
+        aws.s3.head_bucket(Bucket=s3_bucket_name)
+        config_status["s3"] = {
+            "configured": True,
+            "message": "S3 access confirmed",
+            "bucket": s3_bucket_name
+        }
+    except Exception as e:
+        config_status["s3"] = {
+            "configured": False,
+            "message": f"S3 error: {str(e)}"
+        }
+
+    # Check Bedrock configuration
+    if not deep:
         try:
-            s3.list_buckets()
-            config_status["s3"] = {
+            aws.bedrock.get_foundation_model(modelIdentifier=bedrock_model_id)
+            config_status["bedrock"] = {
                 "configured": True,
-                "message": "S3 access confirmed",
-                "bucket": s3_bucket_name
+                "message": "Bedrock access confirmed",
+                "requested_model": bedrock_model_id,
+                "model_access": True
             }
         except Exception as e:
-            config_status["s3"] = {
+            config_status["bedrock"] = {
                 "configured": False,
-                "message": f"S3 error: {str(e)}"
+                "message": f"Bedrock error: {str(e)}",
+                "model": bedrock_model_id
             }
-    
-    # Check Bedrock configuration
-    if bedrock_runtime:
+        return config_status
+
+    try:
+        # Try listing foundation models
         try:
-            # List available models
-            bedrock_client = boto3.client(
-                'bedrock',
-                region_name=region,
-                aws_access_key_id=aws_access_key,
-                aws_secret_access_key=aws_secret_key,
-                aws_session_token=aws_session_token
-            )
-            
-            # Try listing foundation models
+            models = aws.bedrock.list_foundation_models()
+            available_models = [model['modelId'] for model in models.get('modelSummaries', [])]
+
+            config_status["bedrock"] = {
+                "configured": True,
+                "message": "Bedrock access confirmed",
+                "requested_model": bedrock_model_id,
+                "available_models": available_models,
+                "model_access": bedrock_model_id in available_models
+            }
+        except Exception as e:
+            # Fallback to just checking if the specific model is accessible
             try:
-                models = bedrock_client.list_foundation_models()
-                available_models = [model['modelId'] for model in models.get('modelSummaries', [])]
-                
+                params = generation_params(max_tokens=10, temperature=0)
+                bedrock_scheduler.call(
+                    lambda: invoke_text(aws.bedrock_runtime, bedrock_model_id, "Hello", params, "")
+                )
                 config_status["bedrock"] = {
                     "configured": True,
-                    "message": "Bedrock access confirmed",
-                    "requested_model": bedrock_model_id,
-                    "available_models": available_models,
-                    "model_access": bedrock_model_id in available_models
+                    "message": "Bedrock model access confirmed",
+                    "model": bedrock_model_id
                 }
-            except Exception as e:
-                # Fallback to just checking if the specific model is accessible
-                try:
-                    bedrock_runtime.invoke_model(
-                        modelId=bedrock_model_id,
-                        body=json.dumps({
-                            "anthropic_version": "bedrock-2023-05-31",
-                            "max_tokens": 10,
-                            "messages": [{"role": "user", "content": "Hello"}],
-                            "temperature": 0.5
-                        })
-                    )
-                    config_status["bedrock"] = {
-                        "configured": True,
-                        "message": "Bedrock model access confirmed",
-                        "model": bedrock_model_id
-                    }
-                except Exception as model_error:
-                    config_status["bedrock"] = {
-                        "configured": False,
-                        "message": f"Bedrock model error: {str(model_error)}",
-                        "model": bedrock_model_id
-                    }
-        except Exception as e:
-            config_status["bedrock"] = {
-                "configured": False,
-                "message": f"Bedrock error: {str(e)}"
-            }
-    
-    return jsonify(config_status)
+            except Exception as model_error:
+                config_status["bedrock"] = {
+                    "configured": False,
+                    "message": f"Bedrock model error: {str(model_error)}",
+                    "model": bedrock_model_id
+                }
+    except Exception as e:
+        config_status["bedrock"] = {
+            "configured": False,
+            "message": f"Bedrock error: {str(e)}"
+        }
+    return config_status
+
+config_probe = CachedProbe(probe_aws, ttl_seconds=config_check_ttl)
+
+@app.route('/api/check-config', methods=['GET'])
+def check_config():
+    """Endpoint to check if AWS configuration is working.
+
+    Answers from the last probe, refreshing it in the background once it is
+    older than CONFIG_CHECK_TTL_SECONDS. ?deep=1 runs the detailed probe now.
+    """
+    deep = flag_enabled('deep')
+    config_status, age = config_probe.get(deep=deep)
+    return jsonify(dict(config_status, checked_seconds_ago=round(age, 1)))
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness check for load balancers; answers from cached state and never calls AWS"""
+    payload = {"status": "ok", "aws_configured": aws.configured}
+    config_status, age = config_probe.peek()
+    if config_status is not None:
+        payload["s3"] = config_status["s3"]["configured"]
+        payload["bedrock"] = config_status["bedrock"]["configured"]
+        payload["checked_seconds_ago"] = round(age, 1)
+    return jsonify(payload)
+
+def start_background_work():
+    """Resume jobs interrupted by a restart and start background compaction"""
+    if aws.configured:
+        get_job_queue()
+    start_background_compaction()
+
+if __name__ != '__main__':
+    start_background_work()
 
 if __name__ == '__main__':
+    # The reloader runs this file in a watcher process and again in the process that serves
+    # requests (WERKZEUG_RUN_MAIN is set there); only the latter should resume jobs or compact
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_work()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,84 @@
+"""Shared AWS clients, created on first use.
+
+Building a boto3 client loads endpoint and service models, so clients are
+only created when an endpoint first needs them and are then shared by every
+request and background thread (boto3 clients are thread-safe). They all use
+one botocore Config: a connection pool large enough for our worker pools
+(the default of 10 connections throttles parallel S3 reads), TCP keep-alive,
+and adaptive retries, which back off client-side when AWS starts throttling.
+"""
+import threading
+
+import boto3
+from botocore.config import Config
+
+from metrics import count_aws_call
+
+
+class AwsClients:
+    def __init__(self, region, access_key=None, secret_key=None, session_token=None, max_pool_connections=32,
+                 max_attempts=8, connect_timeout=5, read_timeout=60, bedrock_read_timeout=300, bedrock_max_attempts=None):
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.session_token = session_token
+        self.max_pool_connections = max_pool_connections
+        self.max_attempts = max_attempts
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # Model calls can run for minutes while a long answer is generated
+        self.bedrock_read_timeout = bedrock_read_timeout
+        # Throttled model calls are retried by the Bedrock scheduler, so botocore should not also retry them
+        self.bedrock_max_attempts = bedrock_max_attempts or max_attempts
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @property
+    def configured(self):
+        """True when credentials and a region are set, so clients can be created"""
+        return bool(self.access_key and self.secret_key and self.region)
+
+    def client(self, service_name):
+        """The shared client for `service_name`, created on first use"""
+        client = self._clients.get(service_name)
+        if client is not None:
+            return client
+        with self._lock:
+            if service_name not in self._clients:
+                if not self.configured:
+                    raise RuntimeError("AWS credentials not configured")
+                runtime = service_name == 'bedrock-runtime'
+                read_timeout = self.bedrock_read_timeout if runtime else self.read_timeout
+                max_attempts = self.bedrock_max_attempts if runtime else self.max_attempts
+                config = Config(
+                    max_pool_connections=self.max_pool_connections,
+                    retries={"mode": "adaptive", "total_max_attempts": max_attempts},
+                    tcp_keepalive=True,
+                    connect_timeout=self.connect_timeout,
+                    read_timeout=read_timeout
+                )
+                client = boto3.client(
+                    service_name,
+                    region_name=self.region,
+                    aws_access_key_id=self.access_key,
+                    aws_secret_access_key=self.secret_key,
+                    aws_session_token=self.session_token,
+                    config=config
+                )
+                # Counts every attempt, so throttled calls that were retried still show up
+                client.meta.events.register('needs-retry', count_aws_call(service_name))
+                self._clients[service_name] = client
+                print(f"Created AWS {service_name} client")
+            return self._clients[service_name]
+
+    @property
+    def s3(self):
+        return self.client('s3')
+
+    @property
+    def bedrock_runtime(self):
+        return self.client('bedrock-runtime')
+
+    @property
+    def bedrock(self):
+        return self.client('bedrock')
@@ -0,0 +1,202 @@
+"""Request and response formats for the Bedrock text models we support.
+
+Each provider on Bedrock expects a slightly different request body and
+returns the generated text under a different field. The provider is the
+part of the model ID before the first dot (e.g. "anthropic" in
+"anthropic.claude-v2").
+"""
+import json
+import time
+
+from metrics import BEDROCK_ERRORS, STAGE_SECONDS, error_code, record_tokens, timed
+
+DEFAULT_MAX_TOKENS = 1000
+DEFAULT_TEMPERATURE = 0.5
+DEFAULT_TOP_P = 0.9
+
+
+def model_provider(model_id):
+    return model_id.split('.')[0].lower()
+
+
+def generation_params(max_tokens=DEFAULT_MAX_TOKENS, temperature=DEFAULT_TEMPERATURE, top_p=DEFAULT_TOP_P):
+    return {"max_tokens": max_tokens, "temperature": temperature, "top_p": top_p}
+
+
+def build_request_body(model_id, prompt, params):
+    """Serialize `prompt` into the request body format of the model's provider"""
+    provider = model_provider(model_id)
+
+    if "anthropic" in provider:
+        # Claude models (anthropic.claude-*)
+        body = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": params["max_tokens"],
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": params["temperature"]
+        }
+    elif "amazon" in provider:
+        # Amazon Titan models (amazon.titan-*)
+        body = {
+            "inputText": prompt,
+            "textGenerationConfig": {
+                "maxTokenCount": params["max_tokens"],
+                "temperature": params["temperature"],
+                "topP": params["top_p"]
+            }
+        }
+    elif "ai21" in provider:
+        # AI21 Jurassic models (ai21.j2-*)
+        body = {
+            "prompt": prompt,
+            "maxTokens": params["max_tokens"],
+            "temperature": params["temperature"],
+            "topP": params["top_p"]
+        }
+    elif "cohere" in provider:
+        # Cohere models (cohere.command-*)
+        body = {
+            "prompt": prompt,
+            "max_tokens": params["max_tokens"],
+            "temperature": params["temperature"]
+        }
+    elif "meta" in provider:
+        # Meta Llama models (meta.llama-*)
+        body = {
+            "prompt": prompt,
+            "max_gen_len": params["max_tokens"],
+            "temperature": params["temperature"],
+            "top_p": params["top_p"]
+        }
+    else:
+        # Generic fallback format
+        print(f"Using generic format for unknown provider: {provider}")
+        body = {
+            "prompt": prompt,
+            "max_tokens": params["max_tokens"],
+            "temperature": params["temperature"]
+        }
+    return json.dumps(body)
+
+
+def extract_text(model_id, response_body, default):
+    """Pull the generated text out of a parsed invoke_model response body"""
+    provider = model_provider(model_id)
+
+    if "anthropic" in provider:
+        return response_body.get('content', [{}])[0].get('text', default)
+    elif "amazon" in provider:
+        return response_body.get('results', [{}])[0].get('outputText', default)
+    elif "ai21" in provider:
+        return response_body.get('completions', [{}])[0].get('data', {}).get('text', default)
+    elif "cohere" in provider:
+        return response_body.get('text', default)
+    elif "meta" in provider:
+        return response_body.get('generation', default)
+    # Generic fallback
+    return str(response_body)
+
+
+def _header_tokens(response, direction):
+    headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    try:
+        return int(headers.get(f'x-amzn-bedrock-{direction}-token-count', 0))
+    except ValueError:
+        return 0
+
+
+def invoke_text(bedrock_runtime, model_id, prompt, params, default):
+    """Run `prompt` through the model and return the generated text"""
+    provider = model_provider(model_id)
+    body = build_request_body(model_id, prompt, params)
+    try:
+        with timed('model_invoke'):
+            response = bedrock_runtime.invoke_model(modelId=model_id, body=body)
+    except Exception as e:
+        BEDROCK_ERRORS.inc(provider=provider, error=error_code(e))
+        raise
+    record_tokens(provider, _header_tokens(response, 'input'), _header_tokens(response, 'output'))
+
+    with timed('response_parse'):
+        response_stream = response.get('body') or response.get('Body')
+        if not response_stream:
+            raise ValueError(f"No 'Body' or 'body' in response: {response}")
+        try:
+            response_body = json.loads(response_stream.read())
+        except Exception as e:
+            print(f"Failed to parse Bedrock response: {e}")
+            print(f"Raw response: {response}")
+            raise
+
+        return extract_text(model_id, response_body, default)
+
+
+def invoke_embedding(bedrock_runtime, model_id, body):
+    """Send an embedding request body to the model and return the parsed response"""
+    provider = model_provider(model_id)
+    try:
+        with timed('model_embed'):
+            response = bedrock_runtime.invoke_model(modelId=model_id, body=json.dumps(body))
+    except Exception as e:
+        BEDROCK_ERRORS.inc(provider=provider, error=error_code(e))
+        raise
+    record_tokens(provider, _header_tokens(response, 'input'), _header_tokens(response, 'output'))
+    response_stream = response.get('body') or response.get('Body')
+    return json.loads(response_stream.read())
+
+
+def extract_stream_text(model_id, chunk):
+    """Pull the next piece of generated text out of one parsed response-stream chunk"""
+    provider = model_provider(model_id)
+
+    if "anthropic" in provider:
+        # Messages API streams content_block_delta events; other event types carry no text
+        if chunk.get('type') == 'content_block_delta':
+            return chunk.get('delta', {}).get('text', '')
+        return chunk.get('completion', '')
+    elif "amazon" in provider:
+        return chunk.get('outputText', '')
+    elif "ai21" in provider:
+        return chunk.get('completions', [{}])[0].get('data', {}).get('text', '')
+    elif "cohere" in provider:
+        return chunk.get('text', '')
+    elif "meta" in provider:
+        return chunk.get('generation', '')
+    # Generic fallback
+    return str(chunk)
+
+
+def stream_text(bedrock_runtime, model_id, prompt, params):
+    """Run `prompt` through the model, yielding generated text as it arrives"""
+    provider = model_provider(model_id)
+    body = build_request_body(model_id, prompt, params)
+    start = time.perf_counter()
+    try:
+        response = bedrock_runtime.invoke_model_with_response_stream(modelId=model_id, body=body)
+    except Exception as e:
+        BEDROCK_ERRORS.inc(provider=provider, error=error_code(e))
+        raise
+
+    first = True
+    try:
+        # botocore raises EventStreamError for errors sent inside the stream (throttling, validation, ...)
+        for event in response.get('body'):
+            chunk = event.get('chunk')
+            if not chunk:
+                continue
+            data = json.loads(chunk['bytes'])
+            # The last chunk of every provider carries the token counts for the whole call
+            invocation_metrics = data.get('amazon-bedrock-invocationMetrics')
+            if invocation_metrics:
+                record_tokens(provider, invocation_metrics.get('inputTokenCount', 0),
+                              invocation_metrics.get('outputTokenCount', 0))
+            text = extract_stream_text(model_id, data)
+            if text:
+                if first:
+                    STAGE_SECONDS.observe(time.perf_counter() - start, stage='model_first_token')
+                    first = False
+                yield text
+    except Exception as e:
+        BEDROCK_ERRORS.inc(provider=provider, error=error_code(e))
+        raise
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage='model_stream')
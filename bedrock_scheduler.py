@@ -0,0 +1,194 @@
+"""Process-wide scheduling of Bedrock model calls.
+
+Bedrock throttles an account once too many calls are in flight. Sending
+every request straight to the model turns a burst into a retry storm: each
+throttled call retries at once, and throughput collapses just when it is
+needed most. Instead, model calls go through one scheduler:
+
+- At most `limit` calls are in flight. The limit adapts AIMD-style: it grows
+  by about one for each `limit` successful calls and halves on a throttle, so
+  it settles just below the account's quota.
+- Calls beyond the limit wait in a priority queue, so interactive requests
+  go ahead of background jobs and batch imports. A call that waits longer
+  than `queue_timeout` fails with QueueTimeout.
+- Throttled calls give up their slot and retry after a jittered exponential
+  backoff.
+"""
+import contextvars
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import BEDROCK_QUEUE_SECONDS, BEDROCK_SCHEDULER_EVENTS, BEDROCK_SCHEDULER_STATE, is_throttle
+
+INTERACTIVE = 0
+BACKGROUND = 1
+BATCH = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background", BATCH: "batch"}
+
+_priority = contextvars.ContextVar('bedrock_priority', default=INTERACTIVE)
+
+
+class QueueTimeout(Exception):
+    pass
+
+
+@contextmanager
+def model_priority(priority):
+    """Run model calls made by the enclosed block, on this thread, at `priority`"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    """Priority of model calls made on this thread; worker threads should be handed it explicitly"""
+    return _priority.get()
+
+
+class BedrockScheduler:
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=16, queue_timeout=120, max_retries=6,
+                 backoff_base=0.5, backoff_max=20.0, decrease_factor=0.5):
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError("Bedrock concurrency limits must satisfy 1 <= min <= initial <= max")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.decrease_factor = decrease_factor
+        self.limit = float(initial_limit)
+        self._in_flight = 0
+        self._queue = []    # heap of [priority, sequence]
+        self._sequence = itertools.count()
+        # Throttles of calls that started before the last decrease belong to the same overload and are not counted again
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        self.throttles = 0
+        self.retries = 0
+        self.timeouts = 0
+        self._publish()
+
+    def call(self, fn, priority=None):
+        """Run fn() in a concurrency slot, retrying with backoff while Bedrock throttles it"""
+        priority = current_priority() if priority is None else priority
+        for attempt in itertools.count():
+            started = self._acquire(priority)
+            outcome = "error"
+            try:
+                result = fn()
+                outcome = "ok"
+                return result
+            except Exception as e:
+                if not is_throttle(e):
+                    raise
+                outcome = "throttled"
+                if attempt >= self.max_retries:
+                    raise
+            finally:
+                self._release(outcome, started)
+            self._backoff(attempt)
+
+    def stream(self, start, priority=None):
+        """Yield from the iterator start() returns, holding a slot until it is exhausted or closed.
+
+        A throttle before the first item is retried like in call(); once
+        items have been yielded the error is passed on.
+        """
+        priority = current_priority() if priority is None else priority
+        for attempt in itertools.count():
+            started = self._acquire(priority)
+            outcome = "error"
+            received = False
+            try:
+                for item in start():
+                    received = True
+                    yield item
+                outcome = "ok"
+                return
+            except Exception as e:
+                if not is_throttle(e):
+                    raise
+                outcome = "throttled"
+                if received or attempt >= self.max_retries:
+                    raise
+            finally:
+                self._release(outcome, started)
+            self._backoff(attempt)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self._in_flight,
+                "queued": len(self._queue),
+                "throttles": self.throttles,
+                "retries": self.retries,
+                "timeouts": self.timeouts
+            }
+
+    def _allowed(self):
+        return max(self.min_limit, int(self.limit))
+
+    def _acquire(self, priority):
+        """Wait for a free slot, in priority then arrival order. Returns when the slot was granted."""
+        entry = [priority, next(self._sequence)]
+        enqueued = time.monotonic()
+        deadline = enqueued + self.queue_timeout
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            self._publish()
+            while not (self._queue[0] is entry and self._in_flight < self._allowed()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    self.timeouts += 1
+                    BEDROCK_SCHEDULER_EVENTS.inc(event="timed_out")
+                    self._publish()
+                    # The call behind this one may be able to go now
+                    self._condition.notify_all()
+                    raise QueueTimeout(
+                        f"Timed out after {self.queue_timeout}s waiting for Bedrock capacity "
+                        f"({self._in_flight} calls in flight, {len(self._queue)} queued); try again later"
+                    )
+                self._condition.wait(remaining)
+            heapq.heappop(self._queue)
+            self._in_flight += 1
+            self._publish()
+            self._condition.notify_all()
+        waited = time.monotonic() - enqueued
+        BEDROCK_QUEUE_SECONDS.observe(waited, priority=PRIORITY_NAMES.get(priority, str(priority)))
+        return time.monotonic()
+
+    def _release(self, outcome, started):
+        with self._condition:
+            self._in_flight -= 1
+            if outcome == "ok":
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif outcome == "throttled":
+                self.throttles += 1
+                if started > self._last_decrease:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = time.monotonic()
+                    print(f"Bedrock throttled; lowering the concurrency limit to {self._allowed()}")
+            self._publish()
+            self._condition.notify_all()
+
+    def _backoff(self, attempt):
+        """Sleep for a random time up to an exponentially growing cap ("full jitter")"""
+        with self._condition:
+            self.retries += 1
+        BEDROCK_SCHEDULER_EVENTS.inc(event="retried")
+        time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+
+    def _publish(self):
+        BEDROCK_SCHEDULER_STATE.set(self._allowed(), state="limit")
+        BEDROCK_SCHEDULER_STATE.set(self._in_flight, state="in_flight")
+        BEDROCK_SCHEDULER_STATE.set(len(self._queue), state="queued")
@@ -0,0 +1,575 @@
+"""Offline benchmark of the API endpoints.
+
+Runs the Flask app in process against in-memory stand-ins for S3 and
+bedrock-runtime, so it needs no network access or AWS account. The fake
+Bedrock answers in the request/response format of every provider the app
+supports, takes a configurable time per generated token and can throttle a
+share of calls or anything above a concurrency limit.
+
+For each corpus size and concurrency level it drives /api/summary,
+/api/recommendations, /api/submit-note and /api/upload and reports
+p50/p95/p99 latency, throughput, errors and peak traced memory.
+
+    python benchmark.py --sizes 100,1000 --concurrency 1,8 --requests 20
+    python benchmark.py --check-providers
+"""
+import argparse
+import contextlib
+import datetime
+import hashlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from ingest import ContentIndex
+from note_cache import NoteCache
+from prompt_builder import MinHasher
+from response_cache import ResponseCache
+from search_index import SearchIndex
+from shards import ManifestCache
+from study_profile import ProfileStore
+from summarize import SummaryStore
+from topics import TopicIndex
+from vector_index import VectorIndex
+
+PROVIDER_MODELS = {
+    "anthropic": "anthropic.claude-3-haiku-20240307-v1:0",
+    "amazon": "amazon.titan-text-express-v1",
+    "ai21": "ai21.j2-ultra-v1",
+    "cohere": "cohere.command-r-v1:0",
+    "meta": "meta.llama3-8b-instruct-v1:0",
+}
+
+WORDS = ("graph dfs bfs dijkstra heap segment tree fenwick prefix sum dp knapsack memo greedy sort binary "
+         "search two pointers sliding window union find trie string hashing bitmask modulo gcd sieve").split()
+
+
+def client_error(code, operation, status=400):
+    return ClientError({"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}},
+                       operation)
+
+
+class FakeBody(io.BytesIO):
+    pass
+
+
+class FakeS3:
+    """Thread-safe in-memory bucket with a fixed latency per request and per MiB transferred"""
+
+    def __init__(self, request_latency=0.0, latency_per_mib=0.0):
+        self.request_latency = request_latency
+        self.latency_per_mib = latency_per_mib
+        self.objects = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _call(self, name, size=0):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        delay = self.request_latency + self.latency_per_mib * size / (1024 * 1024)
+        if delay:
+            time.sleep(delay)
+
+    def _store(self, key, data, metadata=None, content_encoding=None):
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        with self._lock:
+            self.objects[key] = {
+                "data": data,
+                "etag": etag,
+                "last_modified": datetime.datetime.now(datetime.timezone.utc),
+                "metadata": metadata or {},
+                "content_encoding": content_encoding
+            }
+        return etag
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, ContentEncoding=None, **kwargs):
+        data = Body.encode('utf-8') if isinstance(Body, str) else Body if isinstance(Body, bytes) else Body.read()
+        self._call('put_object', len(data))
+        return {"ETag": self._store(Key, data, Metadata, ContentEncoding)}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None, **kwargs):
+        data = Fileobj.read()
+        self._call('upload_fileobj', len(data))
+        extra = ExtraArgs or {}
+        self._store(Key, data, extra.get('Metadata'), extra.get('ContentEncoding'))
+
+    def _get(self, key, operation):
+        with self._lock:
+            obj = self.objects.get(key)
+        if obj is None:
+            raise client_error('NoSuchKey', operation, 404)
+        return obj
+
+    def _head(self, obj, length):
+        response = {
+            "ETag": obj["etag"],
+            "LastModified": obj["last_modified"],
+            "ContentLength": length,
+            "Metadata": dict(obj["metadata"])
+        }
+        if obj["content_encoding"]:
+            response["ContentEncoding"] = obj["content_encoding"]
+        return response
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        obj = self._get(Key, 'GetObject')
+        data = obj["data"]
+        if Range:
+            start, end = Range.split('=', 1)[1].split('-')
+            data = data[int(start):int(end) + 1]
+        self._call('get_object', len(data))
+        return dict(self._head(obj, len(data)), Body=FakeBody(data))
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call('head_object')
+        obj = self._get(Key, 'HeadObject')
+        return self._head(obj, len(obj["data"]))
+
+    def head_bucket(self, Bucket, **kwargs):
+        self._call('head_bucket')
+        return {}
+
+    def list_buckets(self):
+        self._call('list_buckets')
+        return {"Buckets": []}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call('delete_object')
+        with self._lock:
+            self.objects.pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self._call('delete_objects')
+        with self._lock:
+            for item in Delete["Objects"]:
+                self.objects.pop(item["Key"], None)
+        return {}
+
+    def list_objects_v2(self, Bucket, MaxKeys=1000, ContinuationToken=None, StartAfter=None, Prefix='', **kwargs):
+        self._call('list_objects_v2')
+        with self._lock:
+            keys = sorted(key for key in self.objects if key.startswith(Prefix))
+            start = ContinuationToken or StartAfter
+            if start:
+                keys = [key for key in keys if key > start]
+            page = keys[:MaxKeys]
+            contents = [{
+                "Key": key,
+                "ETag": self.objects[key]["etag"],
+                "LastModified": self.objects[key]["last_modified"],
+                "Size": len(self.objects[key]["data"])
+            } for key in page]
+        response = {"Contents": contents, "KeyCount": len(page), "IsTruncated": len(keys) > MaxKeys}
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = page[-1]
+        return response
+
+
+class FakeBedrockRuntime:
+    """Bedrock stand-in answering in each provider's format.
+
+    Every call takes `input_token_latency` per prompt token plus
+    `token_latency` per generated token. A `throttle_rate` share of calls,
+    and any call beyond `max_concurrency` in flight, fail with a
+    ThrottlingException.
+    """
+
+    def __init__(self, token_latency=0.0, input_token_latency=0.0, output_tokens=200, throttle_rate=0.0,
+                 max_concurrency=0, seed=1):
+        self.token_latency = token_latency
+        self.input_token_latency = input_token_latency
+        self.output_tokens = output_tokens
+        self.throttle_rate = throttle_rate
+        self.max_concurrency = max_concurrency
+        self.calls = 0
+        self.throttled = 0
+        self._in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _admit(self, operation):
+        with self._lock:
+            self.calls += 1
+            throttled = (self._random.random() < self.throttle_rate
+                         or (self.max_concurrency and self._in_flight >= self.max_concurrency))
+            if throttled:
+                self.throttled += 1
+            else:
+                self._in_flight += 1
+        if throttled:
+            raise client_error('ThrottlingException', operation, 429)
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    @staticmethod
+    def _prompt(model_id, request):
+        if "anthropic" in model_id:
+            return request["messages"][0]["content"]
+        if "titan-embed" in model_id or "amazon" in model_id:
+            return request.get("inputText", "")
+        if "embed" in model_id:
+            return " ".join(request.get("texts", []))
+        return request.get("prompt", "")
+
+    def _text(self, prompt):
+        words = [self._random.choice(WORDS) for _ in range(self.output_tokens)]
+        return f"Summary of {len(prompt)} characters: " + " ".join(words)
+
+    @staticmethod
+    def _body(model_id, text):
+        if "anthropic" in model_id:
+            return {"content": [{"type": "text", "text": text}]}
+        if "amazon" in model_id:
+            return {"results": [{"outputText": text}]}
+        if "ai21" in model_id:
+            return {"completions": [{"data": {"text": text}}]}
+        if "cohere" in model_id:
+            return {"text": text}
+        if "meta" in model_id:
+            return {"generation": text}
+        return {"completion": text}
+
+    @staticmethod
+    def _chunk(model_id, text):
+        if "anthropic" in model_id:
+            return {"type": "content_block_delta", "delta": {"type": "text_delta", "text": text}}
+        if "amazon" in model_id:
+            return {"outputText": text}
+        if "ai21" in model_id:
+            return {"completions": [{"data": {"text": text}}]}
+        if "cohere" in model_id:
+            return {"text": text}
+        if "meta" in model_id:
+            return {"generation": text}
+        return {"completion": text}
+
+    @staticmethod
+    def _headers(input_tokens, output_tokens):
+        return {"HTTPHeaders": {
+            "x-amzn-bedrock-input-token-count": str(input_tokens),
+            "x-amzn-bedrock-output-token-count": str(output_tokens)
+        }}
+
+    def invoke_model(self, modelId, body, **kwargs):
+        self._admit('InvokeModel')
+        try:
+            request = json.loads(body)
+            prompt = self._prompt(modelId, request)
+            input_tokens = max(1, len(prompt) // 4)
+            if "embed" in modelId:
+                time.sleep(self.input_token_latency * input_tokens)
+                if "cohere" in modelId:
+                    response_body = {"embeddings": [[self._random.random() for _ in range(64)] for _ in request["texts"]]}
+                else:
+                    response_body = {"embedding": [self._random.random() for _ in range(64)]}
+                return {"body": FakeBody(json.dumps(response_body).encode('utf-8')),
+                        "ResponseMetadata": self._headers(input_tokens, 0)}
+            time.sleep(self.input_token_latency * input_tokens + self.token_latency * self.output_tokens)
+            text = self._text(prompt)
+            return {"body": FakeBody(json.dumps(self._body(modelId, text)).encode('utf-8')),
+                    "ResponseMetadata": self._headers(input_tokens, self.output_tokens)}
+        finally:
+            self._release()
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        self._admit('InvokeModelWithResponseStream')
+        request = json.loads(body)
+        prompt = self._prompt(modelId, request)
+        input_tokens = max(1, len(prompt) // 4)
+
+        def events():
+            try:
+                time.sleep(self.input_token_latency * input_tokens)
+                for word in self._text(prompt).split(" "):
+                    time.sleep(self.token_latency)
+                    yield {"chunk": {"bytes": json.dumps(self._chunk(modelId, word + " ")).encode('utf-8')}}
+                yield {"chunk": {"bytes": json.dumps({"amazon-bedrock-invocationMetrics": {
+                    "inputTokenCount": input_tokens, "outputTokenCount": self.output_tokens}}).encode('utf-8')}}
+            finally:
+                self._release()
+
+        return {"body": events()}
+
+
+class FakeBedrock:
+    """Control-plane stand-in for the configuration check"""
+
+    def get_foundation_model(self, modelIdentifier):
+        return {"modelDetails": {"modelId": modelIdentifier}}
+
+    def list_foundation_models(self):
+        return {"modelSummaries": [{"modelId": model_id} for model_id in PROVIDER_MODELS.values()]}
+
+
+def make_note(rng, words=150):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def load_app(data_dir, model_id):
+    """Import the app against a scratch data directory with credentials that never leave the process"""
+    os.environ.update({
+        "AWS_ACCESS_KEY_ID": "benchmark",
+        "AWS_SECRET_ACCESS_KEY": "benchmark",
+        "AWS_REGION": "us-east-1",
+        "S3_BUCKET_NAME": "benchmark-notes",
+        "BEDROCK_MODEL_ID": model_id,
+        "DATA_DIR": data_dir
+    })
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+    return app
+
+
+def install(app, s3, bedrock_runtime, model_id):
+    app.aws._clients = {"s3": s3, "bedrock-runtime": bedrock_runtime, "bedrock": FakeBedrock()}
+    app.bedrock_model_id = model_id
+
+
+def reset_local_state(app, data_dir):
+    """Replace the app's local caches and indexes with empty ones, configured as app.py builds them.
+
+    Their files go in a new directory under `data_dir`, so nothing a
+    previous run saved is loaded back.
+    """
+    state_dir = tempfile.mkdtemp(dir=data_dir)
+    app.note_cache = NoteCache(
+        app.note_cache_max_bytes,
+        disk_dir=os.path.join(state_dir, "note-cache") if app.note_cache_dir else None,
+        disk_max_bytes=app.note_cache_disk_max_bytes
+    )
+    app.response_cache = ResponseCache(app.response_cache_max_entries, app.response_cache_ttl)
+    app.summary_store = SummaryStore(
+        os.path.join(state_dir, "summaries") if app.summary_store_dir else None,
+        max_entries=app.summary_store_max_entries
+    )
+    app.topic_index = TopicIndex(os.path.join(state_dir, "topics.json"))
+    app.search_index = SearchIndex(os.path.join(state_dir, "search.json"))
+    app.content_index = ContentIndex(os.path.join(state_dir, "content_hashes.json"))
+    app.vector_index = VectorIndex(app.embedder, os.path.join(state_dir, "vectors"))
+    app.minhasher = MinHasher()
+    app.profile_store = ProfileStore(os.path.join(state_dir, "profile.json"))
+    app.shard_manifests = ManifestCache()
+    app.compactor.manifests = app.shard_manifests
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def run_load(app, make_request, requests, concurrency, trace_memory=False):
+    """Send `requests` requests from `concurrency` threads.
+
+    Returns latencies, errors, wall time and, with `trace_memory`, the peak
+    traced bytes (None otherwise). Tracing slows every allocation down, so
+    latencies from a traced run should not be reported.
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def one(index):
+        nonlocal errors
+        if not hasattr(local, 'client'):
+            local.client = app.app.test_client()
+        start = time.perf_counter()
+        try:
+            response = make_request(local.client, index)
+            # Read streamed bodies completely so the whole response is timed
+            response.get_data()
+            ok = response.status_code < 400
+        except Exception as e:
+            print(f"Request failed: {e}", file=sys.stderr)
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    peak = None
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    wall = time.perf_counter() - start
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return latencies, errors, wall, peak
+
+
+def endpoint_requests(rng):
+    """Name -> function sending one request with a Flask test client"""
+    def summary(client, index):
+        return client.get('/api/summary?refresh=1')
+
+    def recommendations(client, index):
+        return client.get('/api/recommendations?refresh=1')
+
+    def submit_note(client, index):
+        return client.post('/api/submit-note', json={"content": f"{index} {time.time_ns()} {make_note(rng, 80)}"})
+
+    def upload(client, index):
+        data = f"{index} {time.time_ns()} {make_note(rng, 400)}".encode('utf-8')
+        return client.post('/api/upload', data={"file": (io.BytesIO(data), f"bench-{index}-{time.time_ns()}.txt")},
+                           content_type='multipart/form-data')
+
+    return {
+        "summary": summary,
+        "recommendations": recommendations,
+        "submit-note": submit_note,
+        "upload": upload
+    }
+
+
+def seed_bucket(s3, size, rng):
+    s3.objects.clear()
+    for index in range(size):
+        s3.put_object(Bucket="benchmark-notes", Key=f"seed-{index:06d}.txt", Body=make_note(rng).encode('utf-8'))
+    s3.calls.clear()
+
+
+def format_row(columns, widths):
+    return "  ".join(str(column).rjust(width) for column, width in zip(columns, widths))
+
+
+def benchmark(args):
+    rng = random.Random(args.seed)
+    model_id = PROVIDER_MODELS.get(args.model, args.model)
+    with tempfile.TemporaryDirectory() as data_dir:
+        app = load_app(data_dir, model_id)
+        bedrock_runtime = FakeBedrockRuntime(
+            token_latency=args.token_latency,
+            input_token_latency=args.input_token_latency,
+            output_tokens=args.output_tokens,
+            throttle_rate=args.throttle_rate,
+            max_concurrency=args.bedrock_max_concurrency,
+            seed=args.seed
+        )
+        s3 = FakeS3(request_latency=args.s3_latency, latency_per_mib=args.s3_latency_per_mib)
+        install(app, s3, bedrock_runtime, model_id)
+        requests_by_name = endpoint_requests(rng)
+        endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+
+        headers = ["endpoint", "notes", "conc", "reqs", "errors", "p50 ms", "p95 ms", "p99 ms", "mean ms",
+                   "req/s", "peak MiB", "S3 GETs", "model calls", "throttled"]
+        widths = [16, 7, 5, 5, 6, 9, 9, 9, 9, 8, 9, 8, 11, 9]
+        lines = [
+            f"model={model_id} token_latency={args.token_latency}s output_tokens={args.output_tokens} "
+            f"throttle_rate={args.throttle_rate} s3_latency={args.s3_latency}s",
+            format_row(headers, widths)
+        ]
+        print("\n".join(lines))
+        for size in [int(value) for value in args.sizes.split(',')]:
+            for concurrency in [int(value) for value in args.concurrency.split(',')]:
+                for name in endpoints:
+                    def run(trace_memory):
+                        # Every run starts from the same bucket and cold local caches
+                        seed_bucket(s3, size, rng)
+                        reset_local_state(app, data_dir)
+                        bedrock_runtime.calls = bedrock_runtime.throttled = 0
+                        # The app logs every step; keep it out of the results unless asked for
+                        with open(os.devnull, 'w') as devnull, \
+                                contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+                            return run_load(app, requests_by_name[name], args.requests, concurrency, trace_memory)
+
+                    # Latencies come from an untraced run; peak memory from a second, traced one
+                    latencies, errors, wall, _ = run(trace_memory=False)
+                    s3_gets, model_calls, throttled = (
+                        s3.calls.get('get_object', 0), bedrock_runtime.calls, bedrock_runtime.throttled)
+                    peak = None if args.skip_memory else run(trace_memory=True)[3]
+                    row = format_row([
+                        name, size, concurrency, len(latencies), errors,
+                        f"{percentile(latencies, 0.50) * 1000:.1f}",
+                        f"{percentile(latencies, 0.95) * 1000:.1f}",
+                        f"{percentile(latencies, 0.99) * 1000:.1f}",
+                        f"{statistics.mean(latencies) * 1000:.1f}",
+                        f"{len(latencies) / wall:.1f}",
+                        "-" if peak is None else f"{peak / (1024 * 1024):.1f}",
+                        s3_gets,
+                        model_calls,
+                        throttled
+                    ], widths)
+                    lines.append(row)
+                    print(row)
+
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+
+
+def check_providers(args):
+    """Run a summary and a streamed recommendation once per provider format"""
+    rng = random.Random(args.seed)
+    failures = 0
+    with tempfile.TemporaryDirectory() as data_dir:
+        app = load_app(data_dir, PROVIDER_MODELS["anthropic"])
+        s3 = FakeS3()
+        seed_bucket(s3, 20, rng)
+        client = app.app.test_client()
+        for provider, model_id in PROVIDER_MODELS.items():
+            install(app, s3, FakeBedrockRuntime(output_tokens=20, seed=args.seed), model_id)
+            summary = client.get('/api/summary?refresh=1&mode=full')
+            stream = client.get('/api/recommendations/stream?refresh=1&mode=full')
+            summary_text = (summary.get_json() or {}).get('summary', '')
+            events = stream.get_data(as_text=True)
+            stream_text = "".join(json.loads(line[len("data: "):]).get('text', '')
+                                  for line in events.splitlines() if line.startswith("data: "))
+            ok = (summary.status_code == 200 and summary_text.startswith("Summary of")
+                  and 'event: done' in events and stream_text.startswith("Summary of"))
+            failures += not ok
+            print(f"{provider:10} {model_id:42} {'ok' if ok else 'FAILED'}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,1000', help='comma-separated corpus sizes (notes in the bucket)')
+    parser.add_argument('--concurrency', default='1,8', help='comma-separated numbers of concurrent clients')
+    parser.add_argument('--requests', type=int, default=20, help='requests per endpoint, size and concurrency')
+    parser.add_argument('--endpoints', default='summary,recommendations,submit-note,upload')
+    parser.add_argument('--model', default='anthropic',
+                        help=f"provider ({', '.join(PROVIDER_MODELS)}) or a full model ID")
+    parser.add_argument('--token-latency', type=float, default=0.0005, help='seconds per generated token')
+    parser.add_argument('--input-token-latency', type=float, default=0.0, help='seconds per prompt token')
+    parser.add_argument('--output-tokens', type=int, default=200, help='tokens generated per model call')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of model calls throttled at random')
+    parser.add_argument('--bedrock-max-concurrency', type=int, default=0,
+                        help='throttle model calls beyond this many in flight (0 for no limit)')
+    parser.add_argument('--s3-latency', type=float, default=0.002, help='seconds per S3 request')
+    parser.add_argument('--s3-latency-per-mib', type=float, default=0.01, help='seconds per MiB transferred')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the results table to this file (e.g. bench_output.txt)')
+    parser.add_argument('--skip-memory', action='store_true',
+                        help='skip the second, memory-traced run of each configuration')
+    parser.add_argument('--verbose', action='store_true', help="show the app's own log output")
+    parser.add_argument('--check-providers', action='store_true',
+                        help='only check that every provider format round-trips through the app')
+    args = parser.parse_args()
+
+    if args.check_providers:
+        sys.exit(1 if check_providers(args) else 0)
+    benchmark(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""Shared pytest fixtures.
+
+The tests run the app against the in-memory S3 and Bedrock stand-ins from
+benchmark.py, so they need no network access or AWS account.
+"""
+import random
+
+import pytest
+
+import benchmark
+
+# test_bedrock_model.py is a manual check against a live Bedrock account, not a pytest test
+collect_ignore = ["test_bedrock_model.py"]
+
+MODEL_ID = benchmark.PROVIDER_MODELS["anthropic"]
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    return benchmark.load_app(str(tmp_path_factory.mktemp("data")), MODEL_ID)
+
+
+@pytest.fixture
+def fake_s3():
+    return benchmark.FakeS3()
+
+
+@pytest.fixture
+def client(app_module, fake_s3):
+    """Test client for the app, backed by a fresh fake bucket"""
+    benchmark.install(app_module, fake_s3, benchmark.FakeBedrockRuntime(), MODEL_ID)
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def rng():
+    return random.Random(7)
@@ -0,0 +1,134 @@
+"""Shared loading of the note corpus from S3.
+
+Both the summary and the recommendation endpoints need every note in the
+bucket. This module lists the bucket page by page (so we are not capped at
+the 1,000 keys a single list_objects_v2 call returns) and downloads the
+notes in parallel on a bounded thread pool.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from metrics import record_s3_read, timed
+from note_cache import note_version
+from note_codec import read_body
+
+NOTE_SUFFIX = '.txt'
+
+
+@dataclass
+class Note:
+    key: str
+    content: str
+    etag: str = None
+    last_modified: object = None
+    size: int = 0
+    # User metadata stored with the note; None when its content came from a cache
+    metadata: dict = None
+
+
+@dataclass
+class Corpus:
+    notes: list = field(default_factory=list)
+    # One {"key": ..., "error": ...} entry per note that could not be read
+    errors: list = field(default_factory=list)
+
+    @property
+    def contents(self):
+        return [note.content for note in self.notes]
+
+
+def list_note_objects(s3, bucket, suffix=NOTE_SUFFIX):
+    """Return the summaries of every object ending in `suffix`, following continuation tokens"""
+    objects = []
+    kwargs = {"Bucket": bucket}
+    while True:
+        with timed('s3_list'):
+            response = s3.list_objects_v2(**kwargs)
+        for obj in response.get('Contents', []):
+            if obj['Key'].endswith(suffix):
+                objects.append(obj)
+        if not response.get('IsTruncated'):
+            return objects
+        kwargs["ContinuationToken"] = response['NextContinuationToken']
+
+
+def list_note_page(s3, bucket, start_after=None, limit=100, suffix=NOTE_SUFFIX, exclude_prefix=None):
+    """Up to `limit` note object summaries with keys after `start_after`. Returns (objects, more)."""
+    objects = []
+    kwargs = {"Bucket": bucket, "MaxKeys": limit}
+    if start_after:
+        kwargs["StartAfter"] = start_after
+    while True:
+        with timed('s3_list'):
+            response = s3.list_objects_v2(**kwargs)
+        for obj in response.get('Contents', []):
+            if not obj['Key'].endswith(suffix) or (exclude_prefix and obj['Key'].startswith(exclude_prefix)):
+                continue
+            objects.append(obj)
+            if len(objects) == limit:
+                # More may follow; at worst the next page comes back empty
+                return objects, obj is not response['Contents'][-1] or bool(response.get('IsTruncated'))
+        if not response.get('IsTruncated'):
+            return objects, False
+        kwargs.pop("StartAfter", None)
+        kwargs["ContinuationToken"] = response['NextContinuationToken']
+
+
+def read_note(s3, bucket, key):
+    """Download a single note, decompressing it if it was stored with a codec, and decode it as UTF-8"""
+    return read_note_object(s3, bucket, key)[0]
+
+
+def read_note_object(s3, bucket, key):
+    """Like read_note, but returns (content, user metadata)"""
+    with timed('s3_get'):
+        s3_obj = s3.get_object(Bucket=bucket, Key=key)
+        content = read_body(s3_obj).decode('utf-8')
+    record_s3_read(s3_obj.get('ContentLength'))
+    return content, s3_obj.get('Metadata') or {}
+
+
+def load_corpus(s3, bucket, max_workers=16, cache=None):
+    """List and download every note in the bucket.
+
+    Notes come back in listing order (S3 lists keys lexicographically), so
+    the same bucket always yields the same corpus. A note that fails to
+    download is reported in `Corpus.errors` instead of failing the load.
+    When a NoteCache is given, only new or changed notes are downloaded.
+    """
+    objects = list_note_objects(s3, bucket)
+    corpus = Corpus()
+    if not objects:
+        return corpus
+
+    def fetch(obj):
+        version = note_version(obj.get('ETag'), obj.get('LastModified'))
+        if cache:
+            content = cache.get(obj['Key'], version)
+            if content is not None:
+                return content, None, None
+        try:
+            content, metadata = read_note_object(s3, bucket, obj['Key'])
+        except Exception as e:
+            return None, None, str(e)
+        if cache:
+            cache.put(obj['Key'], version, content)
+        return content, metadata, None
+
+    workers = max(1, min(max_workers, len(objects)))
+    with timed('s3_fetch'), ThreadPoolExecutor(max_workers=workers) as executor:
+        # map() yields results in submission order, which keeps the corpus stable
+        for obj, (content, metadata, error) in zip(objects, executor.map(fetch, objects)):
+            if error is not None:
+                print(f"Error reading note {obj['Key']}: {error}")
+                corpus.errors.append({"key": obj['Key'], "error": error})
+                continue
+            corpus.notes.append(Note(
+                key=obj['Key'],
+                content=content,
+                etag=obj.get('ETag'),
+                last_modified=obj.get('LastModified'),
+                size=obj.get('Size', 0),
+                metadata=metadata
+            ))
+    return corpus
@@ -0,0 +1,74 @@
+"""Cached results of the AWS configuration probe.
+
+Probing S3 and Bedrock takes several round trips, too slow and too costly
+to repeat every time a load balancer or the page polls. The last result is
+kept for `ttl_seconds`; once it is older, the next caller still gets it
+immediately while a background thread runs a fresh probe.
+
+Deep probes always run on request and are not cached, so they never reset
+the regular result's age or replace what /healthz reports.
+"""
+import threading
+import time
+
+from singleflight import SingleFlight
+
+
+class CachedProbe:
+    def __init__(self, probe, ttl_seconds=60):
+        """`probe` takes a `deep` flag and returns a JSON-serializable status dict"""
+        self.probe = probe
+        self.ttl_seconds = ttl_seconds
+        self._result = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._refreshing = False
+
+    def peek(self):
+        """(last result, seconds since it was taken), or (None, None) before the first probe"""
+        with self._lock:
+            if self._checked_at is None:
+                return None, None
+            return self._result, time.time() - self._checked_at
+
+    def get(self, deep=False):
+        """The probe result and its age in seconds.
+
+        Only the first call, and deep probes, wait for the probe to run; a
+        stale result is returned as is and refreshed in the background.
+        """
+        if deep:
+            return self._flight.do('deep', lambda: self._run(True)), 0.0
+        result, age = self.peek()
+        if result is None:
+            return self._flight.do('probe', lambda: self._run(False)), 0.0
+        if age > self.ttl_seconds:
+            self._refresh_in_background()
+        return result, age
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self._run(False)
+            except Exception as e:
+                print(f"Error refreshing configuration check: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="config-probe", daemon=True).start()
+
+    def _run(self, deep):
+        result = self.probe(deep)
+        if deep:
+            return result
+        with self._lock:
+            self._result = result
+            self._checked_at = time.time()
+        return result
@@ -0,0 +1,138 @@
+"""Bounded, streaming intake of uploaded notes and content-hash deduplication.
+
+Werkzeug already spools each uploaded file (in memory while small, on disk
+when large). scan_upload reads that file once in chunks, hashing and
+decoding it on the way and rejecting it as soon as it passes the size
+limit; the same file is then streamed to S3 without another copy.
+
+Students often submit the same note more than once. ContentIndex maps the
+SHA-256 of each stored note's text to its key so a repeat can be answered
+with the existing key instead of another object in the bucket.
+"""
+import codecs
+import hashlib
+import json
+import os
+import threading
+
+from local_state import SaveSchedule, atomic_write
+from note_cache import note_version
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def content_digest(data):
+    """SHA-256 of a note's UTF-8 bytes"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def scan_upload(stream, max_bytes, chunk_size=1024 * 1024):
+    """Hash and decode an already spooled upload in one pass.
+
+    Returns (size, sha256 hex digest, text, or None if the file is not valid
+    UTF-8) and leaves `stream` at the start. Raises UploadTooLarge as soon
+    as more than `max_bytes` have been read.
+    """
+    digest = hashlib.sha256()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pieces = []
+    size = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(f"Upload is larger than {max_bytes} bytes")
+        digest.update(chunk)
+        if pieces is not None:
+            try:
+                pieces.append(decoder.decode(chunk))
+            except UnicodeDecodeError:
+                pieces = None
+    if pieces is not None:
+        try:
+            pieces.append(decoder.decode(b'', final=True))
+        except UnicodeDecodeError:
+            pieces = None
+    stream.seek(0)
+    return size, digest.hexdigest(), None if pieces is None else ''.join(pieces)
+
+
+class ContentIndex:
+    def __init__(self, path=None, save_interval=30):
+        self.path = path
+        self._saves = SaveSchedule(save_interval)
+        self._keys = {}      # digest -> keys holding that text, the first being the canonical copy
+        self._digests = {}   # key -> (version, digest)
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def get(self, digest):
+        with self._lock:
+            keys = self._keys.get(digest)
+            return keys[0] if keys else None
+
+    def put(self, key, version, digest):
+        with self._lock:
+            self._remove(key)
+            self._digests[key] = (version, digest)
+            self._keys.setdefault(digest, []).append(key)
+            self._saves.mark()
+
+    def sync(self, notes, keep_keys=()):
+        """Hash new or changed notes and forget notes no longer in the bucket. Returns (added, removed)."""
+        present = set(keep_keys)
+        added = 0
+        for note in notes:
+            present.add(note.key)
+            version = note_version(note.etag, note.last_modified)
+            with self._lock:
+                entry = self._digests.get(note.key)
+            if not entry or entry[0] != version:
+                self.put(note.key, version, content_digest(note.content))
+                added += 1
+        with self._lock:
+            stale = [key for key in self._digests if key not in present]
+            for key in stale:
+                self._remove(key)
+            if stale:
+                self._saves.mark()
+        return added, len(stale)
+
+    def save(self, force=False):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._saves.due(force):
+                return
+            data = json.dumps({key: list(entry) for key, entry in self._digests.items()})
+        try:
+            atomic_write(self.path, data)
+        except OSError as e:
+            print(f"Error saving content index: {e}")
+
+    def _remove(self, key):
+        entry = self._digests.pop(key, None)
+        if not entry:
+            return
+        keys = self._keys[entry[1]]
+        keys.remove(key)
+        if not keys:
+            del self._keys[entry[1]]
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable content index {self.path}: {e}")
+            return
+        for key, (version, digest) in entries.items():
+            self._digests[key] = (version, digest)
+            self._keys.setdefault(digest, []).append(key)
@@ -0,0 +1,157 @@
+"""Background jobs for long-running analyses.
+
+A job is submitted with a kind ("summary", "recommendations", ...) and
+JSON-serializable parameters, and runs on a bounded worker pool. Callers
+poll for its status and result. Every state change is written to the job
+directory, so finished results survive a restart and jobs that were still
+queued or running when the process stopped are queued again on startup.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    def __init__(self, handlers, max_workers=2, directory=None, max_pending=100, retention_seconds=86400):
+        """`handlers` maps a job kind to a function taking the job parameters and returning (result, status)"""
+        self.handlers = handlers
+        self.directory = directory
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._restore()
+
+    def submit(self, kind, params):
+        """Queue a job and return its record. Raises QueueFull when too many jobs are pending."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self._expire()
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if job["status"] in (QUEUED, RUNNING))
+            if pending >= self.max_pending:
+                raise QueueFull(f"{pending} jobs are already pending")
+            job = {
+                "id": uuid.uuid4().hex,
+                "kind": kind,
+                "params": params,
+                "status": QUEUED,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "http_status": None,
+                "result": None,
+                "error": None
+            }
+            self._jobs[job["id"]] = job
+        self._save(job)
+        self._executor.submit(self._run, job["id"])
+        return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def stats(self):
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    def _run(self, job_id):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = RUNNING
+            job["started_at"] = time.time()
+        self._save(job)
+
+        try:
+            result, http_status = self.handlers[job["kind"]](job["params"])
+            update = {"status": SUCCEEDED, "result": result, "http_status": http_status}
+        except Exception as e:
+            print(f"Error running {job['kind']} job {job_id}: {e}")
+            traceback.print_exc()
+            update = {"status": FAILED, "error": str(e), "http_status": 500}
+
+        with self._lock:
+            job.update(update)
+            job["finished_at"] = time.time()
+        self._save(job)
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _save(self, job):
+        if not self.directory:
+            return
+        with self._lock:
+            data = json.dumps(job)
+        path = self._path(job["id"])
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error saving job {job['id']}: {e}")
+
+    def _restore(self):
+        interrupted = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Skipping unreadable job file {name}: {e}")
+                continue
+            self._jobs[job["id"]] = job
+            if job["status"] in (QUEUED, RUNNING):
+                interrupted.append(job)
+
+        # Jobs cut off by a restart start over from the beginning
+        for job in sorted(interrupted, key=lambda job: job["created_at"]):
+            if job["kind"] not in self.handlers:
+                job.update({"status": FAILED, "error": f"Unknown job kind: {job['kind']}", "finished_at": time.time()})
+                self._save(job)
+                continue
+            job.update({"status": QUEUED, "started_at": None})
+            self._save(job)
+            self._executor.submit(self._run, job["id"])
+        self._expire()
+
+    def _expire(self):
+        """Forget finished jobs older than the retention period"""
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job["status"] in (SUCCEEDED, FAILED) and job["finished_at"] < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+        for job_id in expired:
+            if self.directory:
+                try:
+                    os.remove(self._path(job_id))
+                except OSError:
+                    pass
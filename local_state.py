@@ -0,0 +1,43 @@
+"""Saving the local indexes to disk.
+
+The content, topic, search and vector indexes change on every stored note
+but only need to reach disk now and then. Each one marks itself dirty on a
+change and saves at most once every `save_interval` seconds (and once more
+at exit), writing through a temporary file so a crash never leaves a
+half-written index behind.
+"""
+import os
+import time
+
+
+class SaveSchedule:
+    """Dirty flag and minimum interval between saves of one index"""
+
+    def __init__(self, save_interval=30):
+        self.save_interval = save_interval
+        self.dirty = False
+        self._last_save = 0
+
+    def mark(self):
+        self.dirty = True
+
+    def due(self, force=False):
+        """Whether to save now; if so the index counts as clean from here on. Call under the index's lock."""
+        if not self.dirty or (not force and time.monotonic() - self._last_save < self.save_interval):
+            return False
+        self.dirty = False
+        self._last_save = time.monotonic()
+        return True
+
+
+def atomic_write(path, data):
+    """Replace `path` with `data` (str or bytes) in one step"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    if isinstance(data, str):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+    else:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+    os.replace(tmp_path, path)
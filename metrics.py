@@ -0,0 +1,251 @@
+"""In-process metrics, exposed in the Prometheus text format.
+
+Counters and histograms are kept in memory and rendered on demand by the
+/metrics endpoint. `timed(stage)` records how long a stage of request
+handling took (listing, fetching, prompt building, model calls, ...), both
+in a histogram and, for stages that run on the request thread, in a
+per-request list that becomes the Server-Timing response header.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _label_text(self.labelnames, key), value) for key, value in items]
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _label_text(self.labelnames, key), value) for key, value in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}   # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        samples = []
+        for key, state in items:
+            for bound, count in zip(self.buckets, state):
+                labels = _label_text(self.labelnames, key, [("le", _number(bound))])
+                samples.append((f"{self.name}_bucket", labels, count))
+            samples.append((f"{self.name}_sum", _label_text(self.labelnames, key), state[-2]))
+            samples.append((f"{self.name}_count", _label_text(self.labelnames, key), state[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "algonotes_stage_duration_seconds", "Time spent in each stage of handling a request", ("stage",)))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "algonotes_request_duration_seconds", "HTTP request handling time until the response starts",
+    ("endpoint", "status")))
+S3_BYTES_READ = REGISTRY.register(Counter(
+    "algonotes_s3_bytes_read_total", "Bytes downloaded from S3, as stored (before decompression)"))
+S3_OBJECT_BYTES = REGISTRY.register(Histogram(
+    "algonotes_s3_object_bytes", "Size of each S3 object or range read", buckets=BYTE_BUCKETS))
+AWS_CALLS = REGISTRY.register(Counter(
+    "algonotes_aws_calls_total", "AWS API attempts, retries included, by outcome (ok, throttled or error)",
+    ("service", "operation", "outcome")))
+BEDROCK_TOKENS = REGISTRY.register(Counter(
+    "algonotes_bedrock_tokens_total", "Tokens sent to and generated by Bedrock models", ("provider", "direction")))
+BEDROCK_COST = REGISTRY.register(Counter(
+    "algonotes_bedrock_estimated_cost_dollars_total",
+    "Estimated Bedrock spend from token counts and the configured per-1K-token prices", ("provider",)))
+BEDROCK_ERRORS = REGISTRY.register(Counter(
+    "algonotes_bedrock_errors_total",
+    "Failed Bedrock model calls by error code, each throttled call the scheduler retries included", ("provider", "error")))
+BEDROCK_QUEUE_SECONDS = REGISTRY.register(Histogram(
+    "algonotes_bedrock_queue_wait_seconds", "Time model calls waited for a Bedrock concurrency slot", ("priority",)))
+BEDROCK_SCHEDULER_EVENTS = REGISTRY.register(Counter(
+    "algonotes_bedrock_scheduler_events_total",
+    "Model calls retried after throttling or timed out waiting for a slot", ("event",)))
+BEDROCK_SCHEDULER_STATE = REGISTRY.register(Gauge(
+    "algonotes_bedrock_scheduler", "Adaptive concurrency limit, calls in flight and calls queued", ("state",)))
+
+# Dollars per 1,000 tokens, set from configuration; zero leaves the cost counter alone
+token_prices = {"input": 0.0, "output": 0.0}
+
+THROTTLING_CODES = ('ThrottlingException', 'TooManyRequestsException', 'Throttling', 'SlowDown',
+                    'RequestLimitExceeded', 'ServiceUnavailableException')
+# Errors inside a Bedrock response stream use lowerCamel codes, e.g. throttlingException
+_THROTTLING_CODES_LOWER = {code.lower() for code in THROTTLING_CODES}
+
+
+@contextmanager
+def timed(stage):
+    """Record the duration of the enclosed block under `stage` (usable as a decorator too)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, duration))
+
+
+def start_request_timings():
+    """Begin collecting stage timings for the current request"""
+    _request_timings.set([])
+
+
+def server_timing_header():
+    """Server-Timing header value for the stages recorded during the current request"""
+    totals = {}
+    for stage, duration in _request_timings.get() or []:
+        totals[stage] = totals.get(stage, 0.0) + duration
+    return ", ".join(f"{stage};dur={duration * 1000:.1f}" for stage, duration in totals.items())
+
+
+def record_s3_read(size):
+    S3_BYTES_READ.inc(size or 0)
+    S3_OBJECT_BYTES.observe(size or 0)
+
+
+def record_tokens(provider, input_tokens, output_tokens):
+    BEDROCK_TOKENS.inc(input_tokens, provider=provider, direction="input")
+    BEDROCK_TOKENS.inc(output_tokens, provider=provider, direction="output")
+    cost = (input_tokens * token_prices["input"] + output_tokens * token_prices["output"]) / 1000
+    if cost:
+        BEDROCK_COST.inc(cost, provider=provider)
+
+
+def error_code(error):
+    """The AWS error code of a botocore ClientError, or the exception class name"""
+    return getattr(error, 'response', {}).get('Error', {}).get('Code') or type(error).__name__
+
+
+def is_throttle_code(code):
+    return bool(code) and code.lower() in _THROTTLING_CODES_LOWER
+
+
+def is_throttle(error):
+    return is_throttle_code(error_code(error))
+
+
+def count_aws_call(service):
+    """botocore 'needs-retry' handler counting every attempt of every call made by a client.
+
+    botocore emits 'needs-retry' after each attempt, including the ones its
+    own retry logic absorbs ('after-call' only fires once per call). The
+    handler returns None so it never affects the retry decision.
+    """
+    def handler(response=None, operation=None, caught_exception=None, **kwargs):
+        if caught_exception is not None or response is None:
+            outcome = "error"
+        else:
+            http_response, parsed = response
+            code = (parsed or {}).get('Error', {}).get('Code')
+            status = getattr(http_response, 'status_code', 200)
+            if is_throttle_code(code) or status == 429:
+                outcome = "throttled"
+            elif code or status >= 400:
+                outcome = "error"
+            else:
+                outcome = "ok"
+        AWS_CALLS.inc(service=service, operation=getattr(operation, 'name', ''), outcome=outcome)
+    return handler
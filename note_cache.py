@@ -0,0 +1,151 @@
+"""Local cache of decoded note contents.
+
+Entries are keyed by the S3 key plus the object's version (its ETag, or its
+LastModified timestamp when no ETag is known), so a changed object is never
+served stale. Recently used notes live in memory under a byte budget with
+LRU eviction; an optional on-disk tier keeps notes warm across restarts.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def note_version(etag=None, last_modified=None):
+    """Version string identifying one revision of an S3 object"""
+    if etag:
+        return etag.strip('"')
+    if last_modified is not None:
+        return last_modified.isoformat() if hasattr(last_modified, 'isoformat') else str(last_modified)
+    return None
+
+
+class NoteCache:
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()  # key -> (version, content, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def get(self, key, version):
+        """Return the cached content for this revision of `key`, or None"""
+        if version is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        content = self._read_disk(key, version)
+        with self._lock:
+            if content is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._put_memory(key, version, content)
+        return content
+
+    def put(self, key, version, content):
+        """Cache `content` as the current revision of `key`"""
+        if version is None:
+            return
+        self._put_memory(key, version, content)
+        self._write_disk(key, version, content)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+    def _put_memory(self, key, version, content):
+        size = len(content.encode('utf-8'))
+        if size > self.max_bytes:
+            # Too big to ever fit; leave it to the disk tier
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._bytes -= old[2]
+            self._entries[key] = (version, content, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def _disk_path(self, key, version):
+        digest = hashlib.sha256(f"{key}\0{version}".encode('utf-8')).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.txt")
+
+    def _read_disk(self, key, version):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key, version)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            # Touch the file so disk eviction is least-recently-used too
+            os.utime(path)
+            return content
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"Error reading cached note {key}: {e}")
+            return None
+
+    def _write_disk(self, key, version, content):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key, version)
+        if os.path.exists(path):
+            return
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        data = content.encode('utf-8')
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error caching note {key} on disk: {e}")
+            return
+        with self._lock:
+            self._disk_bytes += len(data)
+            over_budget = self.disk_max_bytes and self._disk_bytes > self.disk_max_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _disk_files(self):
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file() and entry.name.endswith('.txt'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _evict_disk(self):
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
@@ -0,0 +1,66 @@
+"""Optional compression of note objects in S3.
+
+Notes are plain text and compress several times over, which cuts the bytes
+moved on every corpus load. The codec is recorded in both the object's
+Content-Encoding and its "codec" metadata, so objects written with any codec
+(or none, as all notes written before this existed) can be read back.
+"""
+import gzip
+import shutil
+import tempfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ('none', 'gzip', 'zstd')
+
+
+def available_codec(codec):
+    """`codec`, or gzip when zstd was asked for but the zstandard package is not installed"""
+    if codec not in CODECS:
+        raise ValueError(f"Unknown note codec: {codec}")
+    if codec == 'zstd' and zstandard is None:
+        print("zstandard is not installed; compressing notes with gzip instead")
+        return 'gzip'
+    return codec
+
+
+def encode_file(source, codec, chunk_size=1024 * 1024):
+    """Compress the file `source` chunk by chunk into a spooled temporary file.
+
+    Returns (file positioned at the start, extra put/upload arguments). With
+    no codec `source` itself is returned.
+    """
+    if codec == 'none':
+        return source, {}
+    spool = tempfile.SpooledTemporaryFile(max_size=chunk_size)
+    if codec == 'gzip':
+        with gzip.GzipFile(fileobj=spool, mode='wb', compresslevel=6) as stream:
+            shutil.copyfileobj(source, stream, chunk_size)
+    else:
+        with zstandard.ZstdCompressor(level=3).stream_writer(spool, closefd=False) as stream:
+            shutil.copyfileobj(source, stream, chunk_size)
+    spool.seek(0)
+    return spool, {"ContentEncoding": codec, "Metadata": {"codec": codec}}
+
+
+def object_codec(response):
+    """Codec of a get_object/head_object response; objects without one are uncompressed"""
+    return (response.get('Metadata') or {}).get('codec') or response.get('ContentEncoding') or 'none'
+
+
+def read_body(response):
+    """The decoded bytes of a get_object response, decompressed while streaming from S3"""
+    body = response['Body']
+    codec = object_codec(response)
+    if codec == 'gzip':
+        with gzip.GzipFile(fileobj=body) as stream:
+            return stream.read()
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Note is zstd-compressed but the zstandard package is not installed")
+        with zstandard.ZstdDecompressor().stream_reader(body) as stream:
+            return stream.read()
+    return body.read()
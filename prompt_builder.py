@@ -0,0 +1,157 @@
+"""Token-budgeted assembly of notes into a prompt.
+
+Students upload the same notes again and again, so before notes are packed
+into a prompt:
+
+1. exact duplicates are dropped by content hash,
+2. near-duplicates are dropped with MinHash signatures over word shingles
+   (candidates are found with LSH banding, then checked against a Jaccard
+   threshold),
+3. the remaining notes are packed, in a deterministic priority order, into
+   the model's token budget.
+"""
+import hashlib
+import re
+import zlib
+
+import numpy as np
+
+from bedrock_models import model_provider
+
+# Rough prompt budgets (tokens) per provider, leaving room for the response
+PROVIDER_TOKEN_BUDGETS = {
+    "anthropic": 150000,
+    "amazon": 6000,
+    "ai21": 6000,
+    "cohere": 3000,
+    "meta": 3000,
+}
+DEFAULT_TOKEN_BUDGET = 4000
+
+WORD_RE = re.compile(r"\w+")
+# Largest prime below 2**32: with shingle hashes and coefficients under it, a * x + b fits in 64 bits
+_HASH_PRIME = 4294967291
+
+
+def estimate_tokens(text):
+    """Cheap token estimate: about four characters per token for English text and code"""
+    return max(1, (len(text) + 3) // 4)
+
+
+def token_budget(model_id, override=None):
+    if override:
+        return override
+    return PROVIDER_TOKEN_BUDGETS.get(model_provider(model_id), DEFAULT_TOKEN_BUDGET)
+
+
+class MinHasher:
+    def __init__(self, permutations=64, bands=16, shingle_size=5, seed=1, cache_size=100000):
+        assert permutations % bands == 0
+        self.cache_size = cache_size
+        # Signatures of unchanged notes are reused across requests, keyed by content hash
+        self._signatures = {}
+        self.bands = bands
+        self.rows = permutations // bands
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _HASH_PRIME, size=permutations, dtype=np.int64).astype(np.uint64)
+        self._b = rng.randint(0, _HASH_PRIME, size=permutations, dtype=np.int64).astype(np.uint64)
+
+    def signature(self, text, digest=None):
+        if digest is not None:
+            signature = self._signatures.get(digest)
+            if signature is not None:
+                return signature
+        words = WORD_RE.findall(text.lower())
+        size = min(self.shingle_size, max(1, len(words)))
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode('utf-8')) % _HASH_PRIME for s in shingles), dtype=np.uint64, count=len(shingles)
+        )
+        # One universal hash (a * x + b) mod p per permutation
+        permuted = (np.outer(hashes, self._a) + self._b) % np.uint64(_HASH_PRIME)
+        signature = permuted.min(axis=0).astype(np.uint32)
+        if digest is not None:
+            if len(self._signatures) >= self.cache_size:
+                self._signatures.clear()
+            self._signatures[digest] = signature
+        return signature
+
+    def band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+
+def priority_order(notes, priority, topic_counts=None):
+    """Indices of `notes` in packing order.
+
+    "recent" puts the most recently modified notes first. "topic" puts notes
+    about the least covered topics first (a note counts by its rarest
+    topic), so a handful of rare topics are not crowded out by a popular one.
+    Ties fall back to recency and then key, so the order is deterministic.
+    """
+    def recency(index):
+        last_modified = notes[index].last_modified
+        return -last_modified.timestamp() if hasattr(last_modified, 'timestamp') else 0
+
+    if priority == "topic" and topic_counts is not None:
+        coverage = {}
+        for counts in topic_counts:
+            for topic in counts:
+                coverage[topic] = coverage.get(topic, 0) + 1
+
+        def rarity(index):
+            topics = topic_counts[index]
+            return min(coverage[topic] for topic in topics) if topics else float('inf')
+
+        return sorted(range(len(notes)), key=lambda i: (rarity(i), recency(i), notes[i].key))
+    return sorted(range(len(notes)), key=lambda i: (recency(i), notes[i].key))
+
+
+def select_notes(notes, budget_tokens, priority="recent", topic_counts=None, near_duplicate_threshold=0.85,
+                 minhasher=None):
+    """Pick the notes that go into a prompt. Returns (selected notes in corpus order, stats).
+
+    `stats` counts the notes dropped at each step; the keys of notes left out
+    only for lack of budget are listed under "over_budget_keys".
+    """
+    minhasher = minhasher or MinHasher()
+    order = priority_order(notes, priority, topic_counts)
+    stats = {"notes": len(notes), "duplicates": 0, "near_duplicates": 0, "over_budget": 0, "tokens": 0,
+             "over_budget_keys": []}
+
+    seen_hashes = set()
+    buckets = {}     # LSH band key -> indices of kept notes
+    signatures = {}
+    selected = []
+    remaining = budget_tokens
+    for index in order:
+        content = notes[index].content
+        digest = hashlib.sha256(" ".join(content.split()).encode('utf-8')).hexdigest()
+        if digest in seen_hashes:
+            stats["duplicates"] += 1
+            continue
+        seen_hashes.add(digest)
+
+        # Check the budget first so notes that cannot fit never need a signature
+        tokens = estimate_tokens(content) + 1
+        if tokens > remaining:
+            stats["over_budget"] += 1
+            stats["over_budget_keys"].append(notes[index].key)
+            continue
+
+        signature = minhasher.signature(content, digest)
+        band_keys = minhasher.band_keys(signature)
+        candidates = {other for key in band_keys for other in buckets.get(key, ())}
+        if any(np.mean(signatures[other] == signature) >= near_duplicate_threshold for other in candidates):
+            stats["near_duplicates"] += 1
+            continue
+
+        remaining -= tokens
+        stats["tokens"] += tokens
+        signatures[index] = signature
+        for key in band_keys:
+            buckets.setdefault(key, []).append(index)
+        selected.append(index)
+
+    stats["selected"] = len(selected)
+    return [notes[index] for index in sorted(selected)], stats
@@ -0,0 +1,83 @@
+"""Content-addressed cache of model responses.
+
+A response is keyed by a hash of everything that determines it: the ordered
+notes that went into the prompt, the model ID, the prompt template and the
+generation parameters. Identical requests against an unchanged bucket are
+answered without calling Bedrock again.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def corpus_hash(contents):
+    """Stable hash of an ordered list of note contents"""
+    digest = hashlib.sha256()
+    for content in contents:
+        data = content.encode('utf-8')
+        # Length-prefix each note so ["ab", "c"] and ["a", "bc"] hash differently
+        digest.update(len(data).to_bytes(8, 'big'))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def cache_key(corpus_digest, model_id, prompt_template, params):
+    key = json.dumps({
+        "corpus": corpus_digest,
+        "model": model_id,
+        "prompt": prompt_template,
+        "params": params
+    }, sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value for `key`, or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def peek(self, key):
+        """Like get, but without counting a hit or miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            return None
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,169 @@
+"""Local full-text search over note contents.
+
+An inverted index (term -> {note key: term frequency}) is kept in memory and
+ranked with BM25. It is updated as notes are stored, can be brought in line
+with the bucket from any loaded corpus, and is saved to a local JSON file so
+it does not have to be rebuilt from S3 on every start.
+"""
+import heapq
+import html
+import json
+import math
+import os
+import re
+import threading
+
+from local_state import SaveSchedule, atomic_write
+from note_cache import note_version
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def make_snippet(text, terms, width=200):
+    """HTML-escaped excerpt around the first query term, with every term wrapped in <mark>"""
+    if not terms:
+        return html.escape(text[:width])
+    pattern = re.compile(r"\b(" + "|".join(re.escape(term) for term in terms) + r")\b", re.IGNORECASE)
+    match = pattern.search(text)
+    start = max(0, match.start() - width // 4) if match else 0
+    end = min(len(text), start + width)
+    excerpt = text[start:end]
+
+    parts = []
+    last = 0
+    for term_match in pattern.finditer(excerpt):
+        parts.append(html.escape(excerpt[last:term_match.start()]))
+        parts.append(f"<mark>{html.escape(term_match.group(0))}</mark>")
+        last = term_match.end()
+    parts.append(html.escape(excerpt[last:]))
+    prefix = "..." if start > 0 else ""
+    suffix = "..." if end < len(text) else ""
+    return prefix + "".join(parts).strip() + suffix
+
+
+class SearchIndex:
+    def __init__(self, path=None, k1=1.2, b=0.75, save_interval=30):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._saves = SaveSchedule(save_interval)
+        self._docs = {}      # key -> {"version": ..., "length": ..., "terms": {term: tf}}
+        self._postings = {}  # term -> {key: tf}
+        self._total_length = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._docs)
+
+    def version(self, key):
+        with self._lock:
+            doc = self._docs.get(key)
+            return doc["version"] if doc else None
+
+    def add(self, key, version, text):
+        """Index (or re-index) one note"""
+        terms = {}
+        for term in tokenize(text):
+            terms[term] = terms.get(term, 0) + 1
+        with self._lock:
+            self._remove(key)
+            self._insert(key, {"version": version, "length": sum(terms.values()), "terms": terms})
+            self._saves.mark()
+
+    def remove(self, key):
+        with self._lock:
+            if self._remove(key):
+                self._saves.mark()
+
+    def sync(self, notes, keep_keys=()):
+        """Index new or changed notes and drop notes no longer in the bucket.
+
+        `keep_keys` are notes that still exist but could not be read this
+        time; their existing entries are left alone. Returns (added, removed).
+        """
+        present = set(keep_keys)
+        added = 0
+        for note in notes:
+            present.add(note.key)
+            version = note_version(note.etag, note.last_modified)
+            if self.version(note.key) != version:
+                self.add(note.key, version, note.content)
+                added += 1
+        with self._lock:
+            stale = [key for key in self._docs if key not in present]
+            for key in stale:
+                self._remove(key)
+            if stale:
+                self._saves.mark()
+        return added, len(stale)
+
+    def search(self, query, offset=0, limit=10):
+        """BM25-ranked matches for `query`. Returns (total, [(key, version, score), ...])."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            doc_count = len(self._docs)
+            if not terms or not doc_count:
+                return 0, []
+            average_length = self._total_length / doc_count
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, tf in postings.items():
+                    length_norm = 1 - self.b + self.b * self._docs[key]["length"] / average_length
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+
+            top = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], item[0]))
+            results = [(key, self._docs[key]["version"], score) for key, score in top[offset:]]
+        return len(scores), results
+
+    def save(self, force=False):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._saves.due(force):
+                return
+            data = json.dumps({key: doc for key, doc in self._docs.items()})
+        try:
+            atomic_write(self.path, data)
+        except OSError as e:
+            print(f"Error saving search index: {e}")
+
+    def _insert(self, key, doc):
+        self._docs[key] = doc
+        self._total_length += doc["length"]
+        for term, tf in doc["terms"].items():
+            self._postings.setdefault(term, {})[key] = tf
+
+    def _remove(self, key):
+        doc = self._docs.pop(key, None)
+        if not doc:
+            return False
+        self._total_length -= doc["length"]
+        for term in doc["terms"]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+        return True
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                docs = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable search index {self.path}: {e}")
+            return
+        # Only documents are saved; the postings are rebuilt from them
+        for key, doc in docs.items():
+            self._insert(key, doc)
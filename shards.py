@@ -0,0 +1,477 @@
+"""Sharded storage layout: small note objects packed into a few large shards.
+
+Every submitted note is its own small object, so reading the corpus costs a
+paginated LIST plus one GET per note. A compaction pass packs those objects
+into JSONL shard objects under SHARD_PREFIX and records where each note lives
+in a manifest object:
+
+    {"shards": {shard key: {"size": ..., "compression": ...}},
+     "notes": {note key: {"shard", "offset", "length", "etag", "last_modified", "size",
+                          "topics", "topics_source"}}}
+
+Readers fetch the manifest, then one GET per shard (a ranged GET covering just
+the notes they need when the shard is uncompressed), plus the handful of small
+objects written since the last compaction. A small object always wins over
+the manifest, so new writes need no coordination with the compactor.
+"""
+import datetime
+import gzip
+import heapq
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from corpus import Corpus, Note, list_note_objects, list_note_page, read_note, read_note_object
+from metrics import record_s3_read, timed
+from note_cache import note_version
+from note_codec import read_body
+
+SHARD_PREFIX = '_shards/'
+MANIFEST_KEY = SHARD_PREFIX + 'manifest.json'
+# Held by the process that is compacting, so compactors in other processes skip their pass
+LEASE_KEY = SHARD_PREFIX + 'compaction.lease'
+COMPRESSIONS = ('none', 'gzip')
+
+
+def is_shard_key(key):
+    return key.startswith(SHARD_PREFIX)
+
+
+def _missing(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code') in ('NoSuchKey', 'NotFound', '404')
+
+
+def _get_manifest(s3, bucket):
+    """(manifest, ETag) of the manifest object; an empty manifest and None when nothing has been compacted yet"""
+    try:
+        with timed('s3_get'):
+            response = s3.get_object(Bucket=bucket, Key=MANIFEST_KEY)
+            data = response['Body'].read()
+    except Exception as e:
+        if not _missing(e):
+            raise
+        return {"shards": {}, "notes": {}}, None
+    record_s3_read(len(data))
+    return json.loads(data.decode('utf-8')), response.get('ETag')
+
+
+def load_manifest(s3, bucket):
+    """The current manifest, or an empty one when nothing has been compacted yet"""
+    return _get_manifest(s3, bucket)[0]
+
+
+class ManifestCache:
+    """The last manifest read, checked against the manifest object's ETag before each use.
+
+    A HEAD is much cheaper than downloading the manifest again, and checking
+    it means a compaction by any process, which deletes the small objects it
+    packed, is seen by the next reader.
+    """
+
+    def __init__(self):
+        self._manifest = None
+        self._etag = None
+        self._lock = threading.Lock()
+
+    def get(self, s3, bucket):
+        try:
+            etag = s3.head_object(Bucket=bucket, Key=MANIFEST_KEY).get('ETag')
+        except Exception as e:
+            if not _missing(e):
+                raise
+            etag = None
+        with self._lock:
+            if self._manifest is not None and etag == self._etag:
+                return self._manifest
+        manifest, etag = _get_manifest(s3, bucket)
+        self.publish(manifest, etag)
+        return manifest
+
+    def publish(self, manifest, etag):
+        """Remember a manifest just read or written"""
+        with self._lock:
+            self._manifest = manifest
+            self._etag = etag
+
+
+def _parse_timestamp(value):
+    try:
+        return datetime.datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def _parse_records(data, base_offset, entries):
+    """Pull the notes described by `entries` (key -> manifest entry) out of a slice of shard bytes"""
+    contents = {}
+    for key, entry in entries.items():
+        start = entry["offset"] - base_offset
+        record = json.loads(data[start:start + entry["length"]].decode('utf-8'))
+        contents[key] = record["content"]
+    return contents
+
+
+def read_shard_notes(s3, bucket, shard_key, shard, entries):
+    """Contents of the given notes from one shard, in a single GET.
+
+    Uncompressed shards are read with a ranged GET covering only the needed
+    records; compressed shards have to be fetched whole.
+    """
+    if shard.get("compression", "none") == "none":
+        start = min(entry["offset"] for entry in entries.values())
+        end = max(entry["offset"] + entry["length"] for entry in entries.values())
+        with timed('s3_get'):
+            data = s3.get_object(Bucket=bucket, Key=shard_key, Range=f"bytes={start}-{end - 1}")['Body'].read()
+        record_s3_read(len(data))
+        return _parse_records(data, start, entries)
+    with timed('s3_get'):
+        data = s3.get_object(Bucket=bucket, Key=shard_key)['Body'].read()
+    record_s3_read(len(data))
+    return _parse_records(gzip.decompress(data), 0, entries)
+
+
+def read_sharded_note(s3, bucket, key, manifest):
+    """One note, from its small object when it has one and otherwise from its shard"""
+    try:
+        return read_note(s3, bucket, key)
+    except Exception:
+        entry = manifest["notes"].get(key)
+        if entry is None:
+            raise
+    shard = manifest["shards"][entry["shard"]]
+    return read_shard_notes(s3, bucket, entry["shard"], shard, {key: entry})[key]
+
+
+def list_sharded_page(s3, bucket, manifest, start_after=None, limit=100):
+    """One page of notes, in key order, from the manifest and the small objects together.
+
+    Returns (items, more). Items are object summaries as from list_objects_v2;
+    notes read from a shard also carry their manifest entry under "Shard".
+    """
+    objects, more_objects = list_note_page(s3, bucket, start_after, limit, exclude_prefix=SHARD_PREFIX)
+    listed = {obj['Key']: obj for obj in objects}
+    sharded_keys = sorted(key for key in manifest["notes"] if not start_after or key > start_after)
+
+    items = []
+    for key in heapq.merge(sharded_keys, sorted(listed)):
+        if items and items[-1]['Key'] == key:
+            continue
+        # Past the last listed object, S3 may hold small objects this page has not seen
+        if more_objects and key > objects[-1]['Key']:
+            break
+        if len(items) == limit:
+            return items, True
+        obj = listed.get(key)
+        entry = manifest["notes"].get(key)
+        if obj is not None and (entry is None or note_version(obj.get('ETag')) != note_version(entry.get("etag"))):
+            items.append(obj)
+        else:
+            items.append({
+                "Key": key,
+                "ETag": entry.get("etag"),
+                "LastModified": _parse_timestamp(entry.get("last_modified")),
+                "Size": entry.get("size", 0),
+                "Shard": entry
+            })
+    return items, more_objects
+
+
+def load_sharded_corpus(s3, bucket, max_workers=16, cache=None, manifests=None):
+    """Load every note from the manifest's shards plus any small objects not yet compacted.
+
+    Returns (corpus, manifest). Notes are ordered by key, matching the order
+    the objects layout lists them in.
+    """
+    # List before reading the manifest: a compaction finishing in between only
+    # deletes small objects the newer manifest already covers
+    objects = [obj for obj in list_note_objects(s3, bucket) if not is_shard_key(obj['Key'])]
+    manifest = manifests.get(s3, bucket) if manifests else load_manifest(s3, bucket)
+
+    listed = {obj['Key']: obj for obj in objects}
+    sharded = {}
+    for key, entry in manifest["notes"].items():
+        obj = listed.get(key)
+        if obj is None or note_version(obj.get('ETag')) == note_version(entry.get("etag")):
+            sharded[key] = entry
+            listed.pop(key, None)
+
+    contents = {}
+    metadatas = {}
+    errors = {}
+    by_shard = {}
+    for key, entry in sharded.items():
+        version = note_version(entry.get("etag"), entry.get("last_modified"))
+        content = cache.get(key, version) if cache else None
+        if content is not None:
+            contents[key] = content
+        else:
+            by_shard.setdefault(entry["shard"], {})[key] = entry
+
+    def fetch_shard(item):
+        shard_key, entries = item
+        try:
+            return read_shard_notes(s3, bucket, shard_key, manifest["shards"][shard_key], entries), None
+        except Exception as e:
+            return None, str(e)
+
+    def fetch_object(obj):
+        version = note_version(obj.get('ETag'), obj.get('LastModified'))
+        content = cache.get(obj['Key'], version) if cache else None
+        if content is not None:
+            return content, None, None
+        try:
+            content, metadata = read_note_object(s3, bucket, obj['Key'])
+        except Exception as e:
+            return None, None, str(e)
+        if cache:
+            cache.put(obj['Key'], version, content)
+        return content, metadata, None
+
+    workers = max(1, min(max_workers, len(by_shard) + len(listed)))
+    with timed('s3_fetch'), ThreadPoolExecutor(max_workers=workers) as executor:
+        shard_results = executor.map(fetch_shard, list(by_shard.items()))
+        object_results = executor.map(fetch_object, list(listed.values()))
+        for (shard_key, entries), (shard_contents, error) in zip(list(by_shard.items()), shard_results):
+            for key, entry in entries.items():
+                if error is not None:
+                    errors[key] = error
+                    continue
+                contents[key] = shard_contents[key]
+                if cache:
+                    cache.put(key, note_version(entry.get("etag"), entry.get("last_modified")), contents[key])
+        for obj, (content, metadata, error) in zip(list(listed.values()), object_results):
+            if error is not None:
+                errors[obj['Key']] = error
+            else:
+                contents[obj['Key']] = content
+                metadatas[obj['Key']] = metadata
+
+    corpus = Corpus()
+    for key in sorted(set(sharded) | set(listed)):
+        if key in errors:
+            print(f"Error reading note {key}: {errors[key]}")
+            corpus.errors.append({"key": key, "error": errors[key]})
+            continue
+        if key in listed:
+            obj = listed[key]
+            corpus.notes.append(Note(
+                key=key,
+                content=contents[key],
+                etag=obj.get('ETag'),
+                last_modified=obj.get('LastModified'),
+                size=obj.get('Size', 0),
+                metadata=metadatas.get(key)
+            ))
+        else:
+            entry = sharded[key]
+            corpus.notes.append(Note(
+                key=key,
+                content=contents[key],
+                etag=entry.get("etag"),
+                last_modified=_parse_timestamp(entry.get("last_modified")),
+                size=entry.get("size", 0),
+                # The manifest keeps the metadata the compacted object carried
+                metadata={"topics": entry.get("topics", ""), "topics-source": entry.get("topics_source", "")}
+            ))
+    return corpus, manifest
+
+
+def _merge_manifest(manifest, compacted, new_shards):
+    """Add freshly packed notes to `manifest` (the latest one in S3), dropping shards nothing points at.
+
+    A note another compactor packed from a newer revision keeps that entry.
+    Returns the shard keys that are no longer referenced.
+    """
+    for key, entry in compacted.items():
+        existing = manifest["notes"].get(key)
+        if (existing and existing.get("etag") != entry["etag"]
+                and (existing.get("last_modified") or "") > (entry["last_modified"] or "")):
+            continue
+        manifest["notes"][key] = entry
+    manifest["shards"].update(new_shards)
+    live_shards = {entry["shard"] for entry in manifest["notes"].values()}
+    dead_shards = [key for key in manifest["shards"] if key not in live_shards]
+    for key in dead_shards:
+        del manifest["shards"][key]
+    return dead_shards
+
+
+class Compactor:
+    """Packs small note objects into shards and keeps the manifest up to date.
+
+    Several processes may run a compactor against the same bucket (one per
+    WSGI worker, or the dev server's reloader). A lease object keeps all but
+    one of them from compacting at a time, and the manifest is re-read and
+    merged right before it is written.
+    """
+
+    def __init__(self, s3_getter, bucket, shard_max_bytes=8 * 1024 * 1024, compression='none',
+                 min_objects=50, max_workers=16, manifests=None, lease_seconds=900, lease_settle_seconds=1.0):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown shard compression: {compression}")
+        self.s3_getter = s3_getter
+        self.bucket = bucket
+        self.shard_max_bytes = shard_max_bytes
+        self.compression = compression
+        self.min_objects = min_objects
+        self.max_workers = max_workers
+        # Readers sharing this cache see each new manifest as soon as it is written
+        self.manifests = manifests
+        # A lease older than this is taken to belong to a compactor that died
+        self.lease_seconds = lease_seconds
+        self.lease_settle_seconds = lease_settle_seconds
+        self.owner = uuid.uuid4().hex
+        self.last_result = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def compact(self, force=False):
+        """Run one compaction pass. Returns a summary of what was packed and deleted."""
+        with self._lock:
+            self.last_result = self._compact(force)
+            return self.last_result
+
+    def start(self, interval_seconds):
+        """Compact in a background thread every `interval_seconds`"""
+        if self._thread or interval_seconds <= 0:
+            return
+
+        def run():
+            while not self._stop.wait(interval_seconds):
+                try:
+                    result = self.compact()
+                    if result["compacted"]:
+                        print(f"Compacted {result['compacted']} notes into {result['shards_written']} shards")
+                except Exception as e:
+                    print(f"Error compacting notes: {e}")
+
+        self._thread = threading.Thread(target=run, name="note-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _read_lease(self, s3):
+        try:
+            response = s3.get_object(Bucket=self.bucket, Key=LEASE_KEY)
+            return json.loads(response['Body'].read().decode('utf-8'))
+        except Exception as e:
+            if not _missing(e):
+                raise
+            return None
+
+    def _acquire_lease(self, s3):
+        """Take the compaction lease unless another live compactor holds it. Returns True on success."""
+        lease = self._read_lease(s3)
+        if lease and lease.get("owner") != self.owner and lease.get("expires_at", 0) > time.time():
+            return False
+        body = json.dumps({"owner": self.owner, "expires_at": time.time() + self.lease_seconds})
+        s3.put_object(Bucket=self.bucket, Key=LEASE_KEY, Body=body.encode('utf-8'), ContentType='application/json')
+        # The last writer wins; wait for a compactor that raced us to write its lease, then see who that was
+        time.sleep(self.lease_settle_seconds)
+        lease = self._read_lease(s3)
+        return bool(lease) and lease.get("owner") == self.owner
+
+    def _release_lease(self, s3):
+        try:
+            lease = self._read_lease(s3)
+            if lease and lease.get("owner") == self.owner:
+                s3.delete_object(Bucket=self.bucket, Key=LEASE_KEY)
+        except Exception as e:
+            print(f"Error releasing the compaction lease: {e}")
+
+    def _compact(self, force):
+        s3 = self.s3_getter()
+        objects = [obj for obj in list_note_objects(s3, self.bucket) if not is_shard_key(obj['Key'])]
+        empty = {"compacted": 0, "shards_written": 0, "objects_deleted": 0, "shards_deleted": 0,
+                 "pending": len(objects)}
+        if not objects or (not force and len(objects) < self.min_objects):
+            return empty
+        if not self._acquire_lease(s3):
+            print("Another process is compacting the notes; skipping this pass")
+            return dict(empty, skipped=True)
+        try:
+            return self._pack(s3, objects)
+        finally:
+            self._release_lease(s3)
+
+    def _pack(self, s3, objects):
+        def fetch(obj):
+            try:
+                response = s3.get_object(Bucket=self.bucket, Key=obj['Key'])
+                return read_body(response).decode('utf-8'), response.get('Metadata', {}), None
+            except Exception as e:
+                return None, None, str(e)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(objects)))) as executor:
+            fetched = list(executor.map(fetch, objects))
+
+        # Pack the readable notes into shards of at most shard_max_bytes (before compression)
+        shards = []
+        current, size = [], 0
+        for obj, (content, metadata, error) in zip(objects, fetched):
+            if error is not None:
+                print(f"Skipping {obj['Key']} during compaction: {error}")
+                continue
+            line = (json.dumps({"key": obj['Key'], "content": content}) + "\n").encode('utf-8')
+            if current and size + len(line) > self.shard_max_bytes:
+                shards.append(current)
+                current, size = [], 0
+            current.append((obj, metadata, line))
+            size += len(line)
+        if current:
+            shards.append(current)
+
+        compacted = {}
+        new_shards = {}
+        for records in shards:
+            shard_key = f"{SHARD_PREFIX}{uuid.uuid4()}.jsonl"
+            data = b"".join(line for _, _, line in records)
+            offset = 0
+            for obj, metadata, line in records:
+                last_modified = obj.get('LastModified')
+                compacted[obj['Key']] = {
+                    "shard": shard_key,
+                    "offset": offset,
+                    "length": len(line),
+                    "etag": obj.get('ETag'),
+                    "last_modified": last_modified.isoformat() if hasattr(last_modified, 'isoformat') else last_modified,
+                    "size": obj.get('Size', 0),
+                    "topics": (metadata or {}).get("topics", ""),
+                    "topics_source": (metadata or {}).get("topics-source", "")
+                }
+                offset += len(line)
+            body = gzip.compress(data) if self.compression == 'gzip' else data
+            s3.put_object(Bucket=self.bucket, Key=shard_key, Body=body, ContentType='application/x-ndjson')
+            new_shards[shard_key] = {"size": len(data), "compression": self.compression}
+
+        # Shards are written before the manifest that points at them, and the
+        # manifest before the small objects it replaces are deleted. Merging
+        # into the latest manifest keeps whatever another compactor added.
+        manifest = load_manifest(s3, self.bucket)
+        dead_shards = _merge_manifest(manifest, compacted, new_shards)
+        response = s3.put_object(Bucket=self.bucket, Key=MANIFEST_KEY, Body=json.dumps(manifest).encode('utf-8'),
+                                 ContentType='application/json')
+        if self.manifests:
+            self.manifests.publish(manifest, response.get('ETag'))
+
+        # Only delete objects the manifest now in S3 covers at the same revision,
+        # and that were not rewritten while we were packing them
+        written = load_manifest(s3, self.bucket)["notes"]
+        current_etags = {obj['Key']: obj.get('ETag') for obj in list_note_objects(s3, self.bucket)}
+        deletable = [key for key, entry in compacted.items()
+                     if current_etags.get(key) == entry["etag"] and written.get(key, {}).get("etag") == entry["etag"]]
+        if len(deletable) < len(compacted):
+            print(f"Keeping {len(compacted) - len(deletable)} small objects that changed or that the manifest does not cover")
+        dead_shards = [key for key in dead_shards if key not in {entry["shard"] for entry in written.values()}]
+        for start in range(0, len(deletable), 1000):
+            batch = deletable[start:start + 1000]
+            s3.delete_objects(Bucket=self.bucket, Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True})
+        for key in dead_shards:
+            s3.delete_object(Bucket=self.bucket, Key=key)
+
+        return {"compacted": len(compacted), "shards_written": len(shards), "objects_deleted": len(deletable),
+                "shards_deleted": len(dead_shards), "pending": len(objects) - len(compacted)}
@@ -0,0 +1,70 @@
+"""Saved state for incremental (delta) recommendations.
+
+After each delta run we keep which note revisions the model has already
+seen, the distilled "student profile" it wrote, and its latest
+recommendation. Later runs only send new or changed notes plus that
+profile, so per-request tokens grow with the delta rather than with the
+whole corpus.
+"""
+import json
+import os
+import re
+import threading
+
+PROFILE_REBUILD_PROMPT = (
+    "You are tracking a student's competitive programming progress. From the notes below, write a "
+    "concise student profile (topics covered, strengths, weaknesses, recurring mistakes) and then "
+    "recommend the next topics they should study.\n\n"
+    "Respond in exactly this format:\nPROFILE:\n<profile>\nRECOMMENDATIONS:\n<recommendations>\n\n{notes}"
+)
+PROFILE_UPDATE_PROMPT = (
+    "You are tracking a student's competitive programming progress. Below is their current student "
+    "profile followed by notes they have added since it was written. Update the profile (topics "
+    "covered, strengths, weaknesses, recurring mistakes) to reflect the new notes and then recommend "
+    "the next topics they should study.\n\n"
+    "Respond in exactly this format:\nPROFILE:\n<profile>\nRECOMMENDATIONS:\n<recommendations>\n\n{notes}"
+)
+
+_SECTION_RE = re.compile(r"^\s*(PROFILE|RECOMMENDATIONS)\s*:\s*", re.MULTILINE | re.IGNORECASE)
+
+
+def parse_profile_response(text):
+    """Split a model answer into (profile, recommendation); either may be empty if a section is missing"""
+    sections = {}
+    matches = list(_SECTION_RE.finditer(text))
+    for match, following in zip(matches, matches[1:] + [None]):
+        end = following.start() if following else len(text)
+        sections[match.group(1).upper()] = text[match.end():end].strip()
+    if not matches:
+        # No structure at all: treat the whole answer as the recommendation
+        return "", text.strip()
+    return sections.get("PROFILE", ""), sections.get("RECOMMENDATIONS", "")
+
+
+class ProfileStore:
+    def __init__(self, path):
+        self.path = path
+        # Held for a whole delta run so two runs cannot both process the same new notes
+        self.lock = threading.Lock()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable recommendation state {self.path}: {e}")
+            return {}
+
+    def save(self, state):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error saving recommendation state: {e}")
@@ -0,0 +1,152 @@
+"""Hierarchical (map-reduce) summarization of the note corpus.
+
+Instead of sending every note to the model in one prompt, each note (or each
+chunk of a large note) is summarized once and the result is memoized by a
+hash of its content. Only the compact per-note summaries are then reduced
+into the final answer, so adding a note costs one small model call plus the
+reduce step rather than a pass over the whole corpus.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+NOTE_SUMMARY_PROMPT = (
+    "Summarize this competitive programming note in a few sentences. "
+    "Keep the problem, the key technique and any pitfalls:\n\n{notes}"
+)
+PARTIAL_REDUCE_PROMPT = "Combine these note summaries into one concise summary:\n\n{notes}"
+
+
+class SummaryStore:
+    """Per-note summaries keyed by content hash, optionally persisted to a directory.
+
+    At most `max_entries` summaries are kept in memory, least recently used
+    first out; evicted ones are read back from the directory when needed.
+    """
+
+    def __init__(self, directory=None, max_entries=4096):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, digest):
+        with self._lock:
+            summary = self._summaries.get(digest)
+            if summary is not None:
+                self._summaries.move_to_end(digest)
+        if summary is not None or not self.directory:
+            return summary
+        try:
+            with open(os.path.join(self.directory, f"{digest}.txt"), 'r', encoding='utf-8') as f:
+                summary = f.read()
+        except FileNotFoundError:
+            return None
+        self._remember(digest, summary)
+        return summary
+
+    def put(self, digest, summary):
+        self._remember(digest, summary)
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"{digest}.txt")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(summary)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error saving note summary {digest}: {e}")
+
+    def _remember(self, digest, summary):
+        with self._lock:
+            self._summaries.pop(digest, None)
+            self._summaries[digest] = summary
+            while len(self._summaries) > self.max_entries:
+                self._summaries.popitem(last=False)
+
+
+def summary_digest(model_id, prompt_template, text):
+    """Memoization key for one summarized piece of text"""
+    digest = hashlib.sha256()
+    for part in (model_id, prompt_template, text):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def chunk_text(text, max_chars):
+    """Split text into chunks of at most `max_chars`, preferring paragraph breaks"""
+    if len(text) <= max_chars:
+        return [text]
+    chunks = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > max_chars:
+            # A single paragraph that is too long gets a hard split
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + 2 + len(paragraph) > max_chars:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def group_texts(texts, max_chars):
+    """Pack consecutive texts into groups whose joined length stays under `max_chars`"""
+    groups = []
+    current = []
+    size = 0
+    for text in texts:
+        if current and size + len(text) + 2 > max_chars:
+            groups.append(current)
+            current = []
+            size = 0
+        current.append(text)
+        size += len(text) + 2
+    if current:
+        groups.append(current)
+    return groups
+
+
+def summarize_notes(contents, summarize, store, model_id, chunk_chars=12000, reduce_chars=24000, max_workers=4):
+    """Return the memoized per-note summaries for `contents`, ready for the final reduce.
+
+    `summarize(prompt)` runs one prompt through the model. Every note is
+    summarized chunk by chunk; when the resulting summaries are still longer
+    than `reduce_chars` they are reduced in groups until they fit.
+    """
+    def summarize_memoized(template, text):
+        digest = summary_digest(model_id, template, text)
+        summary = store.get(digest)
+        if summary is None:
+            summary = summarize(template.format(notes=text))
+            store.put(digest, summary)
+        return summary
+
+    def summarize_note(content):
+        return "\n".join(summarize_memoized(NOTE_SUMMARY_PROMPT, chunk) for chunk in chunk_text(content, chunk_chars))
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        summaries = list(executor.map(summarize_note, contents))
+
+        while sum(len(summary) + 2 for summary in summaries) > reduce_chars and len(summaries) > 1:
+            groups = group_texts(summaries, reduce_chars)
+            if len(groups) == len(summaries):
+                # Every summary is already as large as a group; reducing further cannot help
+                break
+            summaries = list(executor.map(
+                lambda group: summarize_memoized(PARTIAL_REDUCE_PROMPT, "\n\n".join(group)), groups
+            ))
+    return summaries
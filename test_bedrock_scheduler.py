@@ -0,0 +1,207 @@
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from benchmark import client_error
+from bedrock_scheduler import BATCH, INTERACTIVE, BedrockScheduler, QueueTimeout, model_priority
+
+
+def throttle():
+    return client_error("ThrottlingException", "InvokeModel", 429)
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the scheduler"
+        time.sleep(0.005)
+
+
+def hold_slot(scheduler):
+    """Occupy one slot until the returned event is set"""
+    release = threading.Event()
+    thread = threading.Thread(target=scheduler.call, args=(release.wait,))
+    thread.start()
+    wait_for(lambda: scheduler.stats()["in_flight"] == 1)
+    return release, thread
+
+
+def test_waiting_calls_run_in_priority_order():
+    scheduler = BedrockScheduler(initial_limit=1, max_limit=1, backoff_base=0)
+    release, holder = hold_slot(scheduler)
+    order = []
+
+    def submit(name, priority):
+        thread = threading.Thread(target=scheduler.call, args=(lambda: order.append(name),),
+                                  kwargs={"priority": priority})
+        thread.start()
+        return thread
+
+    threads = [submit("batch", BATCH)]
+    wait_for(lambda: scheduler.stats()["queued"] == 1)
+    threads.append(submit("interactive", INTERACTIVE))
+    wait_for(lambda: scheduler.stats()["queued"] == 2)
+    release.set()
+    for thread in [holder] + threads:
+        thread.join()
+
+    assert order == ["interactive", "batch"]
+
+
+def test_model_priority_sets_the_default_priority():
+    scheduler = BedrockScheduler(initial_limit=1, max_limit=1, backoff_base=0)
+    release, holder = hold_slot(scheduler)
+    order = []
+
+    def submit_batch():
+        with model_priority(BATCH):
+            scheduler.call(lambda: order.append("batch"))
+
+    batch = threading.Thread(target=submit_batch)
+    batch.start()
+    wait_for(lambda: scheduler.stats()["queued"] == 1)
+    interactive = threading.Thread(target=scheduler.call, args=(lambda: order.append("interactive"),))
+    interactive.start()
+    wait_for(lambda: scheduler.stats()["queued"] == 2)
+    release.set()
+    for thread in (holder, batch, interactive):
+        thread.join()
+
+    assert order == ["interactive", "batch"]
+
+
+def test_queue_timeout():
+    scheduler = BedrockScheduler(initial_limit=1, max_limit=1, queue_timeout=0.05)
+    release, holder = hold_slot(scheduler)
+    try:
+        with pytest.raises(QueueTimeout):
+            scheduler.call(lambda: "never")
+    finally:
+        release.set()
+        holder.join()
+
+    stats = scheduler.stats()
+    assert stats["timeouts"] == 1
+    assert stats["queued"] == 0
+    assert scheduler.call(lambda: "ok") == "ok"
+
+
+def test_limit_grows_additively_on_success():
+    scheduler = BedrockScheduler(initial_limit=4, max_limit=16)
+    for _ in range(4):
+        scheduler.call(lambda: None)
+    assert 4.9 < scheduler.limit < 5.0
+
+
+def test_limit_is_capped_at_the_maximum():
+    scheduler = BedrockScheduler(initial_limit=2, max_limit=2)
+    for _ in range(10):
+        scheduler.call(lambda: None)
+    assert scheduler.limit == 2
+
+
+def test_throttle_halves_the_limit_and_retries():
+    scheduler = BedrockScheduler(initial_limit=8, max_limit=16, backoff_base=0)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise throttle()
+        return "ok"
+
+    assert scheduler.call(flaky) == "ok"
+    stats = scheduler.stats()
+    assert len(attempts) == 2
+    assert stats["throttles"] == 1
+    assert stats["retries"] == 1
+    # Halved to 4 by the throttle, then 4 + 1/4 for the retry's success
+    assert scheduler.limit == pytest.approx(4.25)
+
+
+def test_throttles_from_one_overload_lower_the_limit_once():
+    scheduler = BedrockScheduler(initial_limit=8, max_limit=16, backoff_base=0, max_retries=0)
+    started = threading.Barrier(3)
+
+    def throttled():
+        started.wait()
+        time.sleep(0.05)
+        raise throttle()
+
+    def call():
+        with pytest.raises(ClientError):
+            scheduler.call(throttled)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert scheduler.stats()["throttles"] == 3
+    assert scheduler.limit == 4
+
+
+def test_gives_up_after_max_retries():
+    scheduler = BedrockScheduler(backoff_base=0, max_retries=2)
+    attempts = []
+
+    def always_throttled():
+        attempts.append(1)
+        raise throttle()
+
+    with pytest.raises(ClientError):
+        scheduler.call(always_throttled)
+    assert len(attempts) == 3
+    assert scheduler.limit == scheduler.min_limit
+
+
+def test_other_errors_are_not_retried():
+    scheduler = BedrockScheduler(initial_limit=4, backoff_base=0)
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise client_error("ValidationException", "InvokeModel")
+
+    with pytest.raises(ClientError):
+        scheduler.call(broken)
+    assert len(attempts) == 1
+    assert scheduler.limit == 4
+
+
+def test_stream_retries_a_throttle_before_the_first_item():
+    scheduler = BedrockScheduler(backoff_base=0)
+    attempts = []
+
+    def start():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise throttle()
+        yield "a"
+        yield "b"
+
+    assert list(scheduler.stream(start)) == ["a", "b"]
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_stream_passes_on_a_throttle_after_items_were_sent():
+    scheduler = BedrockScheduler(backoff_base=0)
+
+    def start():
+        yield "a"
+        raise throttle()
+
+    received = []
+    with pytest.raises(ClientError):
+        for item in scheduler.stream(start):
+            received.append(item)
+    assert received == ["a"]
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_rejects_inconsistent_limits():
+    with pytest.raises(ValueError):
+        BedrockScheduler(initial_limit=8, max_limit=4)
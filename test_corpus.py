@@ -0,0 +1,48 @@
+from benchmark import client_error
+from corpus import list_note_objects, load_corpus
+
+BUCKET = "benchmark-notes"
+
+
+def put_notes(s3, count):
+    notes = {f"note-{index:04d}.txt": f"note {index}" for index in range(count)}
+    for key, text in notes.items():
+        s3.put_object(Bucket=BUCKET, Key=key, Body=text)
+    return notes
+
+
+def test_listing_follows_continuation_tokens(fake_s3):
+    notes = put_notes(fake_s3, 2500)
+    fake_s3.put_object(Bucket=BUCKET, Key="image.png", Body=b"not a note")
+
+    objects = list_note_objects(fake_s3, BUCKET)
+
+    assert [obj['Key'] for obj in objects] == sorted(notes)
+    assert fake_s3.calls['list_objects_v2'] == 3
+
+
+def test_corpus_keeps_listing_order(fake_s3):
+    notes = put_notes(fake_s3, 40)
+    corpus = load_corpus(fake_s3, BUCKET, max_workers=8)
+    assert [note.key for note in corpus.notes] == sorted(notes)
+    assert corpus.contents == [notes[key] for key in sorted(notes)]
+    assert corpus.errors == []
+
+
+def test_unreadable_note_is_reported_without_failing_the_load(fake_s3, monkeypatch):
+    notes = put_notes(fake_s3, 5)
+    get_object = fake_s3.get_object
+
+    def flaky_get_object(Bucket, Key, **kwargs):
+        if Key == "note-0002.txt":
+            raise client_error("AccessDenied", "GetObject", 403)
+        return get_object(Bucket=Bucket, Key=Key, **kwargs)
+
+    monkeypatch.setattr(fake_s3, "get_object", flaky_get_object)
+
+    corpus = load_corpus(fake_s3, BUCKET)
+
+    assert [note.key for note in corpus.notes] == [key for key in sorted(notes) if key != "note-0002.txt"]
+    assert [error["key"] for error in corpus.errors] == ["note-0002.txt"]
+    assert "AccessDenied" in corpus.errors[0]["error"]
+
@@ -0,0 +1,78 @@
+import pytest
+
+from corpus import load_corpus
+from study_profile import PROFILE_REBUILD_PROMPT, PROFILE_UPDATE_PROMPT, ProfileStore, parse_profile_response
+
+BUCKET = "benchmark-notes"
+
+
+@pytest.fixture
+def prompts(app_module, client, monkeypatch, tmp_path):
+    """Give the app its own profile state file and a model that records every prompt it is sent"""
+    prompts = []
+
+    def generate_text(prompt_template, notes, fallback, refresh=False):
+        prompts.append((prompt_template, list(notes)))
+        return f"PROFILE:\nprofile {len(prompts)}\nRECOMMENDATIONS:\nstudy {len(prompts)}", False
+
+    monkeypatch.setattr(app_module, "profile_store", ProfileStore(str(tmp_path / "profile.json")))
+    monkeypatch.setattr(app_module, "generate_text", generate_text)
+    return prompts
+
+
+def recommend(app_module, s3, refresh=False):
+    return app_module.recommend_delta(load_corpus(s3, BUCKET), refresh=refresh)
+
+
+def test_parse_profile_response():
+    assert parse_profile_response("PROFILE:\nknows graphs\nRECOMMENDATIONS:\ntry flows") == ("knows graphs", "try flows")
+    assert parse_profile_response("just advice") == ("", "just advice")
+
+
+def test_state_round_trip_sends_only_new_notes(app_module, prompts, fake_s3):
+    for key in ("a.txt", "b.txt"):
+        fake_s3.put_object(Bucket=BUCKET, Key=key, Body=f"notes about {key}")
+
+    assert recommend(app_module, fake_s3) == ("study 1", False)
+    assert prompts[-1] == (PROFILE_REBUILD_PROMPT, ["notes about a.txt", "notes about b.txt"])
+
+    # The saved state reads back from disk in a fresh store
+    state = ProfileStore(app_module.profile_store.path).load()
+    assert state["profile"] == "profile 1"
+    assert state["recommendation"] == "study 1"
+    assert state["model"] == app_module.bedrock_model_id
+    assert set(state["processed"]) == {"a.txt", "b.txt"}
+
+    # Nothing new: the saved recommendation is served without calling the model
+    assert recommend(app_module, fake_s3) == ("study 1", True)
+    assert len(prompts) == 1
+
+    fake_s3.put_object(Bucket=BUCKET, Key="c.txt", Body="notes about c.txt")
+    assert recommend(app_module, fake_s3) == ("study 2", False)
+    assert prompts[-1] == (PROFILE_UPDATE_PROMPT, ["Current student profile:\nprofile 1", "notes about c.txt"])
+    assert set(app_module.profile_store.load()["processed"]) == {"a.txt", "b.txt", "c.txt"}
+
+
+def test_changed_note_is_sent_again(app_module, prompts, fake_s3):
+    fake_s3.put_object(Bucket=BUCKET, Key="a.txt", Body="first draft")
+    fake_s3.put_object(Bucket=BUCKET, Key="b.txt", Body="unchanged")
+    recommend(app_module, fake_s3)
+
+    fake_s3.put_object(Bucket=BUCKET, Key="a.txt", Body="second draft")
+    recommend(app_module, fake_s3)
+
+    assert prompts[-1][1] == ["Current student profile:\nprofile 1", "second draft"]
+
+
+def test_refresh_and_model_change_rebuild_from_every_note(app_module, prompts, fake_s3, monkeypatch):
+    for key in ("a.txt", "b.txt"):
+        fake_s3.put_object(Bucket=BUCKET, Key=key, Body=f"notes about {key}")
+    recommend(app_module, fake_s3)
+
+    recommend(app_module, fake_s3, refresh=True)
+    assert prompts[-1] == (PROFILE_REBUILD_PROMPT, ["notes about a.txt", "notes about b.txt"])
+
+    monkeypatch.setattr(app_module, "bedrock_model_id", "meta.llama3-8b-instruct-v1:0")
+    recommend(app_module, fake_s3)
+    assert prompts[-1][0] == PROFILE_REBUILD_PROMPT
+    assert len(prompts) == 3
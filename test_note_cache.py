@@ -0,0 +1,63 @@
+from corpus import load_corpus
+from note_cache import NoteCache, note_version
+
+BUCKET = "benchmark-notes"
+
+
+def test_a_new_version_invalidates_the_cached_content():
+    cache = NoteCache(max_bytes=1024)
+    cache.put("a.txt", "etag-1", "old")
+
+    assert cache.get("a.txt", "etag-1") == "old"
+    assert cache.get("a.txt", "etag-2") is None
+
+    cache.put("a.txt", "etag-2", "new")
+    assert cache.get("a.txt", "etag-2") == "new"
+    assert cache.get("a.txt", "etag-1") is None
+    assert cache.stats()["entries"] == 1
+
+
+def test_version_prefers_the_etag():
+    assert note_version('"abc"', "2024-01-01") == "abc"
+    assert note_version(None, "2024-01-01") == "2024-01-01"
+    assert note_version() is None
+
+
+def test_least_recently_used_notes_are_evicted_to_stay_in_budget():
+    cache = NoteCache(max_bytes=10)
+    cache.put("a.txt", "1", "aaaa")
+    cache.put("b.txt", "1", "bbbb")
+    cache.get("a.txt", "1")
+    cache.put("c.txt", "1", "cccc")
+
+    assert cache.get("a.txt", "1") == "aaaa"
+    assert cache.get("b.txt", "1") is None
+    assert cache.get("c.txt", "1") == "cccc"
+    assert cache.stats()["bytes"] == 8
+
+
+def test_note_larger_than_the_budget_is_not_kept_in_memory():
+    cache = NoteCache(max_bytes=4)
+    cache.put("a.txt", "1", "too long")
+    assert cache.get("a.txt", "1") is None
+    assert cache.stats()["bytes"] == 0
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    NoteCache(max_bytes=1024, disk_dir=str(tmp_path)).put("a.txt", "1", "kept")
+    cache = NoteCache(max_bytes=1024, disk_dir=str(tmp_path))
+    assert cache.get("a.txt", "1") == "kept"
+    assert cache.get("a.txt", "2") is None
+
+
+def test_corpus_load_only_downloads_changed_notes(fake_s3):
+    for index in range(10):
+        fake_s3.put_object(Bucket=BUCKET, Key=f"note-{index}.txt", Body=f"note {index}")
+    cache = NoteCache(max_bytes=1 << 20)
+
+    load_corpus(fake_s3, BUCKET, cache=cache)
+    fake_s3.put_object(Bucket=BUCKET, Key="note-3.txt", Body="changed")
+    corpus = load_corpus(fake_s3, BUCKET, cache=cache)
+
+    assert fake_s3.calls['get_object'] == 11
+    assert corpus.notes[3].content == "changed"
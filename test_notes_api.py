@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+from shards import ManifestCache, list_sharded_page, load_manifest
+from test_shards import BUCKET, compactor_for, put_notes
+
+
+def all_pages(s3, manifest, limit):
+    keys = []
+    start_after = None
+    while True:
+        items, more = list_sharded_page(s3, BUCKET, manifest, start_after, limit)
+        keys.extend(item['Key'] for item in items)
+        if not more:
+            return keys
+        start_after = items[-1]['Key']
+
+
+def list_via_api(client, limit=5):
+    notes = {}
+    cursor = None
+    while True:
+        query = f"/api/notes?limit={limit}" + (f"&cursor={cursor}" if cursor else "")
+        response = client.get(query)
+        assert response.status_code == 200
+        for line in response.get_data(as_text=True).splitlines():
+            note = json.loads(line)
+            notes[note["key"]] = note["content"]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return notes
+
+
+@pytest.fixture
+def sharded_app(app_module, client, monkeypatch):
+    manifests = ManifestCache()
+    monkeypatch.setattr(app_module, "storage_layout", "sharded")
+    monkeypatch.setattr(app_module, "shard_manifests", manifests)
+    monkeypatch.setattr(app_module.compactor, "manifests", manifests)
+    monkeypatch.setattr(app_module.compactor, "min_objects", 1)
+    monkeypatch.setattr(app_module.compactor, "lease_settle_seconds", 0)
+    return app_module
+
+
+def test_cursor_round_trip(app_module):
+    for key in ("note.txt", "ünïcode key.txt", "a/b?c=d&e.txt"):
+        assert app_module.decode_cursor(app_module.encode_cursor(key)) == key
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "//8=", "é"])
+def test_invalid_cursor_is_rejected(app_module, cursor):
+    with pytest.raises(ValueError):
+        app_module.decode_cursor(cursor)
+
+
+def test_api_pages_through_every_note(client, fake_s3, rng):
+    notes = put_notes(fake_s3, rng, [f"note-{index:03d}.txt" for index in range(12)])
+    assert list_via_api(client) == notes
+
+
+def test_pages_merge_shards_and_small_objects(fake_s3, rng):
+    put_notes(fake_s3, rng, [f"note-{index:03d}.txt" for index in range(0, 20, 2)])
+    compactor_for(fake_s3).compact(force=True)
+    put_notes(fake_s3, rng, [f"note-{index:03d}.txt" for index in range(1, 20, 2)])
+    manifest = load_manifest(fake_s3, BUCKET)
+
+    for limit in (1, 3, 7, 100):
+        assert all_pages(fake_s3, manifest, limit) == [f"note-{index:03d}.txt" for index in range(20)]
+
+
+def test_page_prefers_a_newer_small_object_over_its_shard_copy(fake_s3, rng):
+    put_notes(fake_s3, rng, ["a.txt", "b.txt"])
+    compactor_for(fake_s3).compact(force=True)
+    fake_s3.put_object(Bucket=BUCKET, Key="a.txt", Body=b"rewritten")
+    manifest = load_manifest(fake_s3, BUCKET)
+
+    items, more = list_sharded_page(fake_s3, BUCKET, manifest)
+
+    assert not more
+    assert [item['Key'] for item in items] == ["a.txt", "b.txt"]
+    assert "Shard" not in items[0]
+    assert "Shard" in items[1]
+
+
+def test_api_lists_every_note_after_compaction(sharded_app, client, fake_s3, rng):
+    notes = put_notes(fake_s3, rng, [f"note-{index:03d}.txt" for index in range(15)])
+    assert list_via_api(client) == notes
+
+    sharded_app.compactor.compact(force=True)
+    assert list_via_api(client) == notes
+
+    notes.update(put_notes(fake_s3, rng, [f"late-{index:03d}.txt" for index in range(6)]))
+    assert list_via_api(client) == notes
+
+
+def test_api_sees_a_compaction_by_another_process(sharded_app, client, fake_s3, rng):
+    notes = put_notes(fake_s3, rng, [f"note-{index:03d}.txt" for index in range(10)])
+    assert list_via_api(client) == notes
+
+    # A compactor in another process writes a new manifest this process has not seen
+    compactor_for(fake_s3).compact(force=True)
+
+    assert list_via_api(client) == notes
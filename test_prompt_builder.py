@@ -0,0 +1,69 @@
+import datetime
+
+from corpus import Note
+from prompt_builder import estimate_tokens, select_notes, token_budget
+
+BASE_TIME = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def note(key, content, age_days=0):
+    return Note(key=key, content=content, last_modified=BASE_TIME - datetime.timedelta(days=age_days))
+
+
+def words(rng, count):
+    return " ".join(rng.choice(["graph", "dp", "heap", "trie", "sort", "gcd", "bfs", "dfs", "sieve", "fenwick"]) +
+                    str(rng.randrange(1000)) for _ in range(count))
+
+
+def test_exact_duplicates_are_dropped(rng):
+    text = words(rng, 50)
+    notes = [note("a.txt", text), note("b.txt", "  " + text.replace(" ", "\n"), age_days=1)]
+    selected, stats = select_notes(notes, 10000)
+    assert [n.key for n in selected] == ["a.txt"]
+    assert stats["duplicates"] == 1
+
+
+def test_near_duplicates_are_dropped(rng):
+    text = words(rng, 80)
+    edited = text.rsplit(" ", 1)[0] + " typo"
+    notes = [note("a.txt", text), note("b.txt", edited, age_days=1), note("c.txt", words(rng, 80), age_days=2)]
+    selected, stats = select_notes(notes, 10000)
+    assert [n.key for n in selected] == ["a.txt", "c.txt"]
+    assert stats["near_duplicates"] == 1
+
+
+def test_budget_keeps_the_most_recent_notes(rng):
+    notes = [note(f"{index}.txt", words(rng, 40), age_days=index) for index in range(5)]
+    per_note = estimate_tokens(notes[0].content) + 1
+    budget = per_note * 2 + per_note // 2
+
+    selected, stats = select_notes(notes, budget)
+
+    assert stats["selected"] == len(selected) <= 2
+    assert stats["over_budget"] == 5 - len(selected)
+    assert stats["tokens"] <= budget
+    assert set(stats["over_budget_keys"]) == {n.key for n in notes} - {n.key for n in selected}
+    # The newest note always fits and nothing older is picked ahead of it
+    assert selected[0].key == "0.txt"
+
+
+def test_selected_notes_keep_corpus_order(rng):
+    notes = [note(f"{index}.txt", words(rng, 20), age_days=-index) for index in range(4)]
+    selected, _ = select_notes(notes, 10000)
+    assert [n.key for n in selected] == [n.key for n in notes]
+
+
+def test_topic_priority_puts_rare_topics_first(rng):
+    notes = [note(f"{index}.txt", words(rng, 40)) for index in range(3)]
+    topic_counts = [{"graphs": 1}, {"graphs": 1}, {"strings": 1}]
+    budget = estimate_tokens(notes[0].content) + 1
+
+    selected, stats = select_notes(notes, budget, priority="topic", topic_counts=topic_counts)
+
+    assert [n.key for n in selected] == ["2.txt"]
+    assert stats["over_budget"] == 2
+
+
+def test_token_budget_defaults_by_provider():
+    assert token_budget("anthropic.claude-3-haiku-20240307-v1:0") > token_budget("meta.llama3-8b-instruct-v1:0")
+    assert token_budget("meta.llama3-8b-instruct-v1:0", override=1234) == 1234
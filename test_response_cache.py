@@ -0,0 +1,53 @@
+import time
+
+from response_cache import ResponseCache, cache_key, corpus_hash
+
+
+def test_corpus_hash_depends_on_note_boundaries_and_order():
+    assert corpus_hash(["ab", "c"]) != corpus_hash(["a", "bc"])
+    assert corpus_hash(["a", "b"]) != corpus_hash(["b", "a"])
+    assert corpus_hash(["a", "b"]) == corpus_hash(["a", "b"])
+
+
+def test_cache_key_covers_model_prompt_and_params():
+    base = cache_key("corpus", "model", "prompt {notes}", {"max_tokens": 10})
+    assert base == cache_key("corpus", "model", "prompt {notes}", {"max_tokens": 10})
+    assert base != cache_key("other", "model", "prompt {notes}", {"max_tokens": 10})
+    assert base != cache_key("corpus", "other", "prompt {notes}", {"max_tokens": 10})
+    assert base != cache_key("corpus", "model", "other {notes}", {"max_tokens": 10})
+    assert base != cache_key("corpus", "model", "prompt {notes}", {"max_tokens": 20})
+
+
+def test_hits_and_misses_are_counted():
+    cache = ResponseCache(max_entries=4, ttl_seconds=60)
+    assert cache.get("key") is None
+    cache.put("key", "value")
+    assert cache.get("key") == "value"
+    assert cache.peek("key") == "value"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_entries_expire():
+    cache = ResponseCache(max_entries=4, ttl_seconds=0.01)
+    cache.put("key", "value")
+    time.sleep(0.02)
+    assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.peek("a") == 1
+    assert cache.peek("b") is None
+    assert cache.peek("c") == 3
+
+
+def test_zero_entries_disables_the_cache():
+    cache = ResponseCache(max_entries=0, ttl_seconds=60)
+    cache.put("key", "value")
+    assert cache.get("key") is None
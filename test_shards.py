@@ -0,0 +1,39 @@
+from benchmark import make_note
+from shards import SHARD_PREFIX, Compactor, load_sharded_corpus
+
+BUCKET = "benchmark-notes"
+
+
+def put_notes(s3, rng, keys):
+    notes = {key: make_note(rng, words=30) for key in keys}
+    for key, text in notes.items():
+        s3.put_object(Bucket=BUCKET, Key=key, Body=text.encode('utf-8'))
+    return notes
+
+
+def compactor_for(s3, manifests=None):
+    return Compactor(lambda: s3, BUCKET, shard_max_bytes=2048, min_objects=1, max_workers=4, manifests=manifests,
+                     lease_settle_seconds=0)
+
+
+def test_compaction_packs_small_objects_into_shards(fake_s3, rng):
+    notes = put_notes(fake_s3, rng, [f"note-{index:03d}.txt" for index in range(12)])
+
+    result = compactor_for(fake_s3).compact(force=True)
+
+    assert result["compacted"] == 12
+    assert result["shards_written"] > 1
+    assert all(key.startswith(SHARD_PREFIX) for key in fake_s3.objects)
+    corpus, _ = load_sharded_corpus(fake_s3, BUCKET)
+    assert {note.key: note.content for note in corpus.notes} == notes
+
+
+def test_concurrent_compactor_skips_while_the_lease_is_held(fake_s3, rng):
+    put_notes(fake_s3, rng, ["a.txt", "b.txt"])
+    first, second = compactor_for(fake_s3), compactor_for(fake_s3)
+    assert first._acquire_lease(fake_s3)
+    try:
+        assert second.compact(force=True).get("skipped")
+    finally:
+        first._release_lease(fake_s3)
+    assert second.compact(force=True)["compacted"] == 2
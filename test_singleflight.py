@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def run_concurrently(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    calls = []
+    results = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.1)
+        return "result"
+
+    run_concurrently(5, lambda: results.append(flight.do("key", work)))
+
+    assert calls == [1]
+    assert results == ["result"] * 5
+    assert flight.coalesced == 4
+
+
+def test_waiters_receive_the_same_exception():
+    flight = SingleFlight()
+    errors = []
+
+    def work():
+        time.sleep(0.1)
+        raise RuntimeError("boom")
+
+    def call():
+        try:
+            flight.do("key", work)
+        except RuntimeError as e:
+            errors.append(e)
+
+    run_concurrently(3, call)
+
+    assert len(errors) == 3
+    assert len({id(error) for error in errors}) == 1
+
+
+def test_key_is_forgotten_once_the_call_finishes():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+    with pytest.raises(ValueError):
+        flight.do("key", lambda: int("x"))
+    assert flight.do("key", lambda: 3) == 3
+    assert flight.coalesced == 0
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    calls = []
+    run_concurrently(2, lambda: flight.do(threading.current_thread().name, lambda: calls.append(1)))
+    assert calls == [1, 1]
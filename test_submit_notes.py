@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from benchmark import client_error
+from ingest import ContentIndex
+
+
+@pytest.fixture
+def batch_app(app_module, client, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, "content_index", ContentIndex(str(tmp_path / "content_hashes.json")))
+    return app_module
+
+
+def statuses(response):
+    return [result["status"] for result in response.get_json()["results"]]
+
+
+def test_each_item_gets_its_own_status(batch_app, client, fake_s3):
+    client.post("/api/submit-note", json={"content": "already stored"})
+
+    response = client.post("/api/submit-notes", json=[
+        "union find", {"content": "kmp"}, "  ", 5, "union find", "already stored"
+    ])
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert statuses(response) == ["stored", "stored", "error", "error", "duplicate", "duplicate"]
+    assert [result["index"] for result in body["results"]] == list(range(6))
+    assert (body["stored"], body["duplicates"], body["failed"]) == (2, 2, 2)
+    assert body["results"][4]["key"] == body["results"][0]["key"]
+    assert body["results"][2]["error"] == "No content provided"
+    assert len(fake_s3.objects) == 3
+
+
+def test_ndjson_body_reports_bad_lines(batch_app, client):
+    body = "\n".join([json.dumps("dp on trees"), "{not json", json.dumps({"content": "sieve"})])
+
+    response = client.post("/api/submit-notes", data=body, content_type="application/x-ndjson")
+
+    assert statuses(response) == ["stored", "error", "stored"]
+    assert response.get_json()["results"][1]["error"].startswith("Invalid JSON line")
+
+
+def test_failed_write_fails_only_its_item_and_its_copies(batch_app, client, fake_s3, monkeypatch):
+    write_note = batch_app.write_note
+
+    def flaky_write_note(key, body, digest, text, persist):
+        if text.startswith("bad"):
+            raise client_error("InternalError", "PutObject", 500)
+        return write_note(key, body, digest, text, persist)
+
+    monkeypatch.setattr(batch_app, "write_note", flaky_write_note)
+
+    response = client.post("/api/submit-notes", json=["good note", "bad note", "bad note"])
+
+    assert statuses(response) == ["stored", "error", "error"]
+    assert len(fake_s3.objects) == 1
+
+
+def test_too_many_notes_are_rejected(batch_app, client, monkeypatch):
+    monkeypatch.setattr(batch_app, "submit_batch_max_notes", 2)
+    response = client.post("/api/submit-notes", json=["a", "b", "c"])
+    assert response.status_code == 413
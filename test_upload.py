@@ -0,0 +1,64 @@
+import io
+
+import pytest
+
+from corpus import read_note
+from ingest import ContentIndex, UploadTooLarge, content_digest, scan_upload
+
+BUCKET = "benchmark-notes"
+
+
+@pytest.fixture
+def upload_app(app_module, client, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, "content_index", ContentIndex(str(tmp_path / "content_hashes.json")))
+    return app_module
+
+
+def upload(client, filename, data):
+    return client.post("/api/upload", data={"file": (io.BytesIO(data), filename)}, content_type="multipart/form-data")
+
+
+def test_scan_hashes_and_decodes_in_chunks():
+    data = "héllo wörld ".encode('utf-8') * 100
+    stream = io.BytesIO(data)
+
+    size, digest, text = scan_upload(stream, max_bytes=len(data), chunk_size=7)
+
+    assert (size, digest, text) == (len(data), content_digest(data), data.decode('utf-8'))
+    assert stream.tell() == 0
+
+
+def test_scan_reports_non_utf8_as_no_text():
+    assert scan_upload(io.BytesIO(b"\xff\xfe"), max_bytes=10)[2] is None
+
+
+def test_scan_stops_at_the_size_limit():
+    with pytest.raises(UploadTooLarge):
+        scan_upload(io.BytesIO(b"x" * 11), max_bytes=10, chunk_size=4)
+
+
+def test_oversized_upload_is_rejected_with_413(upload_app, client, fake_s3, monkeypatch):
+    monkeypatch.setattr(upload_app, "max_upload_bytes", 10)
+
+    response = upload(client, "big.txt", b"x" * 11)
+
+    assert response.status_code == 413
+    assert "10 bytes" in response.get_json()["error"]
+    assert fake_s3.objects == {}
+
+
+def test_identical_contents_are_stored_once(upload_app, client, fake_s3):
+    first = upload(client, "first.txt", b"dijkstra with a binary heap")
+    second = upload(client, "second.txt", b"dijkstra with a binary heap")
+
+    assert first.get_json() == {"message": "File uploaded successfully", "key": "first.txt", "duplicate": False}
+    assert second.get_json() == {"message": "File already uploaded", "key": "first.txt", "duplicate": True}
+    assert list(fake_s3.objects) == ["first.txt"]
+    assert read_note(fake_s3, BUCKET, "first.txt") == "dijkstra with a binary heap"
+
+
+def test_upload_key_keeps_the_name_but_drops_directories_and_control_characters(upload_app, client, fake_s3):
+    response = upload(client, "..\\notes/My Notes\x07 (1).txt", b"segment trees")
+
+    assert response.get_json()["key"] == "My Notes (1).txt"
+    assert list(fake_s3.objects) == ["My Notes (1).txt"]
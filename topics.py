@@ -0,0 +1,209 @@
+"""Fast, local tagging of notes with competitive-programming topics.
+
+Notes are tagged with keyword/regex rules when they are stored, so topic
+recommendations can be built from a compact topic histogram instead of the
+full text of every note. Tags are written to the object's S3 metadata and
+to a local sidecar index that maps each note revision to its topic counts.
+When the sidecar has no entry for a revision, the tags saved with the object
+are used if the current rules (or the model) produced them; otherwise the
+note is classified again.
+"""
+import json
+import os
+import re
+import threading
+
+from local_state import SaveSchedule, atomic_write
+from note_cache import note_version
+
+# topic -> patterns that suggest a note is about it. Generic words ("tree",
+# "edge", "string") are anchored so they do not fire on phrases that belong
+# to another topic or mean something else ("Fenwick tree", "edge case").
+TOPIC_RULES = {
+    "dynamic-programming": [r"\bdynamic programming\b", r"\bdp\b", r"\bmemoi[sz]", r"\bknapsack\b", r"\btabulation\b",
+                            r"\blongest (?:common|increasing) sub"],
+    "graphs": [r"\bgraphs?\b", r"\bbfs\b", r"\bdfs\b", r"\bbreadth[- ]first\b", r"\bdepth[- ]first\b", r"\badjacency\b",
+               r"\btopological\b", r"\bvertices\b", r"\bedges?\b(?![- ]cases?\b)"],
+    "shortest-paths": [r"\bdijkstra\b", r"\bbellman[- ]ford\b", r"\bfloyd[- ]warshall\b", r"\bshortest path"],
+    "trees": [r"(?<!\bsegment )(?<!\bfenwick )(?<!\bindexed )(?<!\bprefix )(?<!\bsuffix )\btrees?\b", r"\blowest common ancestor\b", r"\blca\b", r"\bsubtrees?\b",
+              r"\binorder\b", r"\bpostorder\b", r"\bpreorder\b"],
+    "segment-tree": [r"\bsegment trees?\b", r"\blazy propagation\b", r"\brange (?:sum|min|max|update)"],
+    "fenwick-tree": [r"\bfenwick\b", r"\bbinary indexed tree\b"],
+    "union-find": [r"\bunion[- ]find\b", r"\bdisjoint set", r"\bdsu\b"],
+    "two-pointers": [r"\btwo[- ]pointers?\b", r"\bleft and right pointers\b", r"\bfast and slow\b"],
+    "sliding-window": [r"\bsliding window\b"],
+    "binary-search": [r"\bbinary search\b", r"\blower_bound\b", r"\bupper_bound\b", r"\bbisect\b"],
+    "greedy": [r"\bgreedy\b", r"\binterval scheduling\b"],
+    "sorting": [r"\bsort(?:ing|ed)?\b", r"\bmerge sort\b", r"\bquicksort\b", r"\bcounting sort\b"],
+    "heaps": [r"\bheaps?\b", r"\bpriority queue\b", r"\bheapq\b"],
+    "stacks-queues": [r"\bmonotonic (?:stack|queue)\b", r"\bstacks?\b", r"\bdeque\b"],
+    "hashing": [r"\bhash ?(?:map|set|table)\b", r"\bdictionary\b", r"\brolling hash\b"],
+    "strings": [r"\bstring (?:matching|algorithms?|processing|problems?|hashing|searching)\b", r"\bsubstrings?\b",
+                r"\bsuffix (?:arrays?|trees?|automat)", r"\bpalindrom", r"\bkmp\b", r"\bz[- ]function\b", r"\banagram\b"],
+    "tries": [r"\btries\b", r"\btrie\b", r"\bprefix tree\b"],
+    "backtracking": [r"\bbacktrack", r"\bpermutations?\b", r"\bsubsets?\b", r"\bn[- ]queens\b"],
+    "bit-manipulation": [r"\bbitmask", r"\bbitwise\b", r"\bxor\b", r"\bbit manipulation\b"],
+    "math": [r"\bmodular\b", r"\bmod(?:ulo)?\b", r"\bprimes?\b", r"\bsieve\b", r"\bgcd\b", r"\blcm\b",
+             r"\bcombinatorics\b", r"\bnumber theory\b"],
+    "prefix-sums": [r"\bprefix sums?\b", r"\bcumulative sum\b", r"\bdifference array\b"],
+    "linked-lists": [r"\blinked lists?\b"],
+    "geometry": [r"\bgeometry\b", r"\bconvex hull\b", r"\bcross product\b"],
+}
+
+_COMPILED_RULES = {
+    topic: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+    for topic, patterns in TOPIC_RULES.items()
+}
+# Bump when the rules change so notes tagged under the old rules are classified again
+RULES_VERSION = 2
+
+TOPIC_FALLBACK_PROMPT = (
+    "Which of these algorithm topics does the note below cover? "
+    "Answer with a comma-separated list using only these names, or 'none': "
+    + ", ".join(TOPIC_RULES) + "\n\n{notes}"
+)
+
+
+def classify(text):
+    """Count rule matches per topic. Returns {topic: count} for matching topics only."""
+    counts = {}
+    for topic, patterns in _COMPILED_RULES.items():
+        count = sum(len(pattern.findall(text)) for pattern in patterns)
+        if count:
+            counts[topic] = count
+    return counts
+
+
+def parse_model_topics(answer):
+    """Topics named in a model answer to TOPIC_FALLBACK_PROMPT, each counted once"""
+    names = {name.strip().lower() for name in re.split(r"[,\n]", answer)}
+    return {topic: 1 for topic in TOPIC_RULES if topic in names}
+
+
+def format_topics(counts):
+    """Encode topic counts for S3 metadata, e.g. "graphs:3,greedy:1" """
+    return ",".join(f"{topic}:{count}" for topic, count in sorted(counts.items()))
+
+
+def topics_source(from_model=False):
+    """Value of the "topics-source" metadata saved next to a note's tags"""
+    return "model" if from_model else f"rules-{RULES_VERSION}"
+
+
+def stored_topics(metadata):
+    """Topic counts from a note's S3 metadata, or None if it has none the current rules would keep"""
+    if not metadata or metadata.get("topics-source") not in (topics_source(True), topics_source()):
+        return None
+    return parse_topics(metadata.get("topics"))
+
+
+def parse_topics(value):
+    counts = {}
+    for item in (value or "").split(","):
+        topic, _, count = item.partition(":")
+        if topic and count.isdigit():
+            counts[topic] = int(count)
+    return counts
+
+
+class TopicIndex:
+    """Sidecar index of note key -> (version, topic counts), saved as one JSON file"""
+
+    def __init__(self, path=None, save_interval=30):
+        self.path = path
+        self._saves = SaveSchedule(save_interval)
+        self._entries = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable topic index {path}: {e}")
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry["version"] == version and entry.get("rules") == RULES_VERSION:
+            return entry["topics"]
+        return None
+
+    def put(self, key, version, topics):
+        with self._lock:
+            self._entries[key] = {"version": version, "topics": topics, "rules": RULES_VERSION}
+            self._saves.mark()
+
+    def topics_for(self, notes, metadata_for=None):
+        """Topic counts for each Note, indexing any revision not seen before.
+
+        A new revision gets the tags stored in its S3 metadata when they are
+        still valid, and is classified otherwise. `metadata_for(note)` looks
+        the metadata up for notes that were served from a cache without it.
+        """
+        results = []
+        for note in notes:
+            version = note_version(note.etag, note.last_modified)
+            topics = self.get(note.key, version)
+            if topics is None:
+                metadata = note.metadata
+                if metadata is None and metadata_for:
+                    metadata = metadata_for(note)
+                topics = stored_topics(metadata)
+                if topics is None:
+                    topics = classify(note.content)
+                self.put(note.key, version, topics)
+            results.append(topics)
+        return results
+
+    def save(self, force=False):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._saves.due(force):
+                return
+            data = json.dumps(self._entries)
+        try:
+            atomic_write(self.path, data)
+        except OSError as e:
+            print(f"Error saving topic index: {e}")
+
+
+
+def histogram(topic_counts):
+    """Combine per-note topic counts into {topic: (notes, mentions)}, most common first"""
+    totals = {}
+    for counts in topic_counts:
+        for topic, count in counts.items():
+            notes, mentions = totals.get(topic, (0, 0))
+            totals[topic] = (notes + 1, mentions + count)
+    return dict(sorted(totals.items(), key=lambda item: (-item[1][0], -item[1][1], item[0])))
+
+
+def topic_digest(notes, topic_counts, snippets=8, snippet_chars=400):
+    """Compact stand-in for the corpus: a topic histogram plus a few representative excerpts.
+
+    Returns a list of text blocks - the histogram first, then one excerpt
+    for each of the most common topics, taken from the note that mentions
+    that topic most.
+    """
+    totals = histogram(topic_counts)
+    untagged = sum(1 for counts in topic_counts if not counts)
+    lines = [f"Topic coverage across {len(notes)} notes (notes mentioning it / total mentions):"]
+    lines += [f"- {topic}: {count} / {mentions}" for topic, (count, mentions) in totals.items()]
+    if untagged:
+        lines.append(f"- untagged: {untagged}")
+    blocks = ["\n".join(lines)]
+
+    used = set()
+    for topic in list(totals)[:snippets]:
+        candidates = [
+            (counts.get(topic, 0), index) for index, counts in enumerate(topic_counts)
+            if topic in counts and index not in used
+        ]
+        if not candidates:
+            continue
+        _, index = max(candidates, key=lambda candidate: (candidate[0], -candidate[1]))
+        used.add(index)
+        excerpt = notes[index].content[:snippet_chars].strip()
+        blocks.append(f"Excerpt ({topic}):\n{excerpt}")
+    return blocks
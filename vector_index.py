@@ -0,0 +1,293 @@
+"""Vector index over note chunks for retrieval-augmented prompts.
+
+Notes are split into overlapping chunks, each chunk is embedded, and the
+normalized embeddings are kept in one NumPy matrix so a batch of queries is
+scored against every chunk with a single matrix product. Only chunk
+positions are stored; the chunk text is sliced back out of the note when a
+prompt is built.
+
+Embeddings come from Bedrock (Titan or Cohere embedding models) or from a
+local feature-hashing embedder that needs no network access.
+"""
+import contextvars
+import io
+import json
+import os
+import re
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bedrock_models import invoke_embedding, model_provider
+from local_state import SaveSchedule, atomic_write
+from note_cache import note_version
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def in_caller_context(fn):
+    """Wrap `fn` to run in a copy of the calling thread's context, so worker threads keep its model call priority"""
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(fn, *args)
+
+
+class HashingEmbedder:
+    """Local embedder: signed feature hashing of words and word pairs"""
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts, input_type="search_document"):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = WORD_RE.findall(text.lower())
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            for feature in features:
+                h = zlib.crc32(feature.encode('utf-8'))
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return vectors
+
+
+class BedrockEmbedder:
+    """Embeddings from a Bedrock embedding model (amazon.titan-embed-* or cohere.embed-*)"""
+
+    def __init__(self, bedrock_runtime_getter, model_id, scheduler, max_workers=4):
+        """`bedrock_runtime_getter` returns the client, so it is only created once embeddings are needed.
+
+        Calls go through `scheduler` (a BedrockScheduler) like every other model call.
+        """
+        self.bedrock_runtime_getter = bedrock_runtime_getter
+        self.model_id = model_id
+        self.scheduler = scheduler
+        self.max_workers = max_workers
+        self.name = model_id
+
+    def embed(self, texts, input_type="search_document"):
+        """`input_type` is "search_document" for indexed text and "search_query" for queries"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        if "cohere" in model_provider(self.model_id):
+            # Cohere embeds up to 96 texts per call
+            batches = [texts[i:i + 96] for i in range(0, len(texts), 96)]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                rows = [
+                    row for batch in executor.map(
+                        in_caller_context(lambda batch: self._embed_cohere(batch, input_type)), batches
+                    )
+                    for row in batch
+                ]
+        else:
+            # Titan embeds one text per call
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                rows = list(executor.map(in_caller_context(self._embed_titan), texts))
+        return np.asarray(rows, dtype=np.float32)
+
+    def _invoke(self, body):
+        return self.scheduler.call(lambda: invoke_embedding(self.bedrock_runtime_getter(), self.model_id, body))
+
+    def _embed_titan(self, text):
+        return self._invoke({"inputText": text})["embedding"]
+
+    def _embed_cohere(self, texts, input_type):
+        return self._invoke({"texts": texts, "input_type": input_type})["embeddings"]
+
+
+def chunk_spans(text, chunk_chars=1000, overlap=200):
+    """(start, end) offsets of overlapping chunks, cut at whitespace where possible"""
+    if len(text) <= chunk_chars:
+        return [(0, len(text))] if text.strip() else []
+    spans = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + chunk_chars)
+        if end < len(text):
+            cut = text.rfind(" ", start + chunk_chars // 2, end)
+            if cut > start:
+                end = cut
+        spans.append((start, end))
+        if end >= len(text):
+            break
+        start = max(start + 1, end - overlap)
+    return spans
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorIndex:
+    def __init__(self, embedder, path=None, chunk_chars=1000, overlap=200, save_interval=30):
+        self.embedder = embedder
+        self.path = path
+        self.chunk_chars = chunk_chars
+        self.overlap = overlap
+        self._saves = SaveSchedule(save_interval)
+        self._matrix = None     # (capacity, dim) float32, rows [0, self._rows) in use
+        self._rows = 0
+        self._alive = np.zeros(0, dtype=bool)
+        self._chunks = []       # row -> {"key", "version", "start", "end"}
+        self._note_rows = {}    # key -> (version, [rows])
+        self._lock = threading.Lock()
+        if path:
+            self._load()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._note_rows)
+
+    def version(self, key):
+        with self._lock:
+            entry = self._note_rows.get(key)
+            return entry[0] if entry else None
+
+    def add_note(self, key, version, text):
+        """Chunk, embed and index one note revision, replacing any older revision"""
+        spans = chunk_spans(text, self.chunk_chars, self.overlap)
+        vectors = normalize(self.embedder.embed([text[start:end] for start, end in spans])) if spans else None
+        with self._lock:
+            self._remove(key)
+            rows = []
+            if vectors is not None and len(vectors):
+                rows = self._append(vectors)
+                for row, (start, end) in zip(rows, spans):
+                    self._chunks[row] = {"key": key, "version": version, "start": start, "end": end}
+            self._note_rows[key] = (version, rows)
+            self._saves.mark()
+
+    def remove(self, key):
+        with self._lock:
+            if self._remove(key):
+                self._saves.mark()
+
+    def sync(self, notes, keep_keys=(), max_workers=4):
+        """Index new or changed notes and drop notes no longer in the bucket. Returns (added, removed)."""
+        present = set(keep_keys)
+        pending = []
+        for note in notes:
+            present.add(note.key)
+            version = note_version(note.etag, note.last_modified)
+            if self.version(note.key) != version:
+                pending.append((note.key, version, note.content))
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            list(executor.map(in_caller_context(lambda item: self.add_note(*item)), pending))
+        with self._lock:
+            stale = [key for key in self._note_rows if key not in present]
+            for key in stale:
+                self._remove(key)
+            if stale:
+                self._saves.mark()
+        return len(pending), len(stale)
+
+    def search(self, queries, k=10):
+        """Cosine top-k chunks for each query, scored in one batch.
+
+        Returns one list per query of (score, chunk) pairs, best first, where
+        chunk is {"key", "version", "start", "end"}.
+        """
+        query_vectors = normalize(self.embedder.embed(list(queries), input_type="search_query"))
+        with self._lock:
+            if not self._rows:
+                return [[] for _ in queries]
+            scores = query_vectors @ self._matrix[:self._rows].T
+            scores[:, ~self._alive[:self._rows]] = -np.inf
+            k = min(k, int(self._alive[:self._rows].sum()))
+            if k <= 0:
+                return [[] for _ in queries]
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            results = []
+            for query_row, rows in enumerate(top):
+                ranked = sorted(rows, key=lambda row: -scores[query_row, row])
+                results.append([(float(scores[query_row, row]), dict(self._chunks[row])) for row in ranked])
+        return results
+
+    def save(self, force=False):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._saves.due(force):
+                return
+            self._compact()
+            matrix = self._matrix[:self._rows].copy() if self._rows else np.zeros((0, 0), dtype=np.float32)
+            meta = json.dumps({"embedder": self.embedder.name, "chunks": self._chunks[:self._rows],
+                               "notes": {key: version for key, (version, _) in self._note_rows.items()}})
+        vectors = io.BytesIO()
+        np.save(vectors, matrix)
+        try:
+            atomic_write(os.path.join(self.path, "vectors.npy"), vectors.getvalue())
+            atomic_write(os.path.join(self.path, "chunks.json"), meta)
+        except OSError as e:
+            print(f"Error saving vector index: {e}")
+
+    def _append(self, vectors):
+        count, dim = vectors.shape
+        if self._matrix is None:
+            self._matrix = np.zeros((max(64, count), dim), dtype=np.float32)
+            self._alive = np.zeros(len(self._matrix), dtype=bool)
+        if self._rows + count > len(self._matrix):
+            capacity = max(len(self._matrix) * 2, self._rows + count)
+            matrix = np.zeros((capacity, dim), dtype=np.float32)
+            matrix[:self._rows] = self._matrix[:self._rows]
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:self._rows] = self._alive[:self._rows]
+            self._matrix, self._alive = matrix, alive
+        rows = list(range(self._rows, self._rows + count))
+        self._matrix[self._rows:self._rows + count] = vectors
+        self._alive[self._rows:self._rows + count] = True
+        self._chunks.extend([None] * count)
+        self._rows += count
+        return rows
+
+    def _remove(self, key):
+        entry = self._note_rows.pop(key, None)
+        if not entry:
+            return False
+        for row in entry[1]:
+            self._alive[row] = False
+            self._chunks[row] = None
+        # Dead rows are only skipped at search time; reclaim them once they dominate
+        if self._rows and self._alive[:self._rows].sum() < self._rows // 2:
+            self._compact()
+        return True
+
+    def _compact(self):
+        if not self._rows or self._alive[:self._rows].all():
+            return
+        keep = np.flatnonzero(self._alive[:self._rows])
+        new_row = {int(old): new for new, old in enumerate(keep)}
+        self._matrix = self._matrix[keep].copy()
+        self._alive = np.ones(len(keep), dtype=bool)
+        self._chunks = [self._chunks[int(old)] for old in keep]
+        self._rows = len(keep)
+        self._note_rows = {
+            key: (version, [new_row[row] for row in rows])
+            for key, (version, rows) in self._note_rows.items()
+        }
+
+    def _load(self):
+        matrix_path = os.path.join(self.path, "vectors.npy")
+        meta_path = os.path.join(self.path, "chunks.json")
+        if not (os.path.exists(matrix_path) and os.path.exists(meta_path)):
+            return
+        try:
+            matrix = np.load(matrix_path)
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable vector index {self.path}: {e}")
+            return
+        if meta.get("embedder") != self.embedder.name:
+            print(f"Vector index was built with {meta.get('embedder')}; rebuilding with {self.embedder.name}")
+            return
+        self._matrix = matrix.astype(np.float32)
+        self._rows = len(matrix)
+        self._alive = np.ones(self._rows, dtype=bool)
+        self._chunks = meta["chunks"]
+        rows_by_key = {}
+        for row, chunk in enumerate(self._chunks):
+            rows_by_key.setdefault(chunk["key"], []).append(row)
+        self._note_rows = {key: (version, rows_by_key.get(key, [])) for key, version in meta["notes"].items()}